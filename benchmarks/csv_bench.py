@@ -0,0 +1,72 @@
+"""
+Benchmark of CSV encoding of device history, comparing the previous pandas
+path (json_normalize + to_csv) against response_util.csv_text, buffered as
+build_response_body does, and csv_chunks, as streamed responses do.
+
+pandas is no longer a dependency of the service; install it to run this.
+
+Usage:
+    python -m benchmarks.csv_bench [rows ...]
+"""
+import csv
+import io
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import pandas as pd
+from history.api import response_util
+
+
+def make_history(rows):
+    start = datetime(2021, 8, 3, 20, 38, 13)
+    return [{
+        'attr': 'temperature' if i % 2 else 'status',
+        'value': 20.0 + (i % 100) / 10 if i % 2 else 'ok',
+        'device_id': 'b374a5',
+        'ts': (start + timedelta(seconds=i)).isoformat() + 'Z',
+        'metadata': {'protocol': 'mqtt', 'payload': 'json'}
+    } for i in range(rows)]
+
+
+def with_pandas(history):
+    buffer = io.StringIO()
+    pd.json_normalize(history).to_csv(
+        buffer, index=False, quotechar='"', encoding="utf-8", quoting=csv.QUOTE_NONNUMERIC)
+    return buffer.getvalue()
+
+
+def buffered(history):
+    return ''.join(response_util.csv_text(history, lookahead=None))
+
+
+def streamed(history):
+    size = 0
+    for chunk in response_util.csv_chunks(iter(history)):
+        size += len(chunk)
+    return size
+
+
+def measure(function, history):
+    started = time.perf_counter()
+    function(history)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    function(history)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+
+def main(sizes):
+    print('{:>9} {:<10} {:>10} {:>14}'.format('rows', 'encoder', 'time (s)', 'peak (MiB)'))
+    for rows in sizes:
+        history = make_history(rows)
+        assert with_pandas(history) == buffered(history)
+        for name, function in (('pandas', with_pandas), ('buffered', buffered), ('streamed', streamed)):
+            elapsed, peak = measure(function, history)
+            print('{:>9} {:<10} {:>10.3f} {:>14.1f}'.format(rows, name, elapsed, peak))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,64 @@
+"""
+Benchmark of the response formats of device history: encode time and size
+of JSON, CSV, newline delimited JSON, msgpack and Arrow IPC, as built by
+response_util.build_response_body for a multi-attribute history.
+
+msgpack and pyarrow are optional dependencies of the service; formats whose
+library is not installed are skipped.
+
+Usage:
+    python -m benchmarks.formats_bench [rows ...]
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+from history.api import response_util
+from history.api.models import DeviceHistory
+
+
+def make_history(rows):
+    start = datetime(2021, 8, 3, 20, 38, 13)
+    history = {'temperature': [], 'humidity': []}
+    for i in range(rows):
+        attr = 'temperature' if i % 2 else 'humidity'
+        history[attr].append({
+            'attr': attr,
+            'value': 20.0 + (i % 100) / 10,
+            'device_id': 'b374a5',
+            'ts': (start + timedelta(seconds=i)).isoformat() + 'Z',
+            'metadata': {}
+        })
+    return history
+
+
+def request_for(media):
+    request = MagicMock()
+    request.client_accepts = lambda accept: accept == media
+    return request
+
+
+def measure(media, history):
+    request = request_for(media)
+    started = time.perf_counter()
+    body = response_util.build_response_body(request, history, DeviceHistory.csv_response_parser)
+    elapsed = time.perf_counter() - started
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return elapsed, len(body) / 2**20
+
+
+def main(sizes):
+    print('{:>9} {:<38} {:>10} {:>11}'.format('rows', 'format', 'time (s)', 'size (MiB)'))
+    for media in response_util.media_types():
+        # the first Arrow encode pays for loading its compute functions
+        measure(media, make_history(10))
+    for rows in sizes:
+        history = make_history(rows)
+        for media in response_util.media_types():
+            elapsed, size = measure(media, history)
+            print('{:>9} {:<38} {:>10.3f} {:>11.1f}'.format(rows, media, elapsed, size))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,113 @@
+"""
+Concurrent load benchmark of running History deployments, used to compare
+them side by side on the same requests, e.g. the gevent deployment (the
+docker "start" command) with different worker counts or settings.
+
+Each target URL is hammered by the given number of keep-alive connections
+until the request count is reached; throughput and latency percentiles are
+printed per target.
+
+Usage:
+    python -m benchmarks.load_bench [-c concurrency] [-n requests] [-t token] url...
+
+    python -m benchmarks.load_bench -c 64 -n 5000 -t $JWT \\
+        'http://localhost:8000/device/b374a5/history?lastN=10' \\
+        'http://localhost:8001/device/b374a5/history?lastN=10'
+"""
+import argparse
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+
+async def read_response(reader):
+    """ Reads one response, returning its status and whether the connection stays open """
+    version, status, _ = (await reader.readline()).split(b' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection == 'keep-alive' or (version == b'HTTP/1.1' and connection != 'close')
+    return int(status), keep_alive
+
+
+async def worker(url, token, remaining, latencies, errors):
+    parts = urlsplit(url)
+    target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    request = ('GET {} HTTP/1.1\r\nHost: {}\r\nAuthorization: {}\r\n'
+               'Accept-Encoding: gzip\r\n\r\n').format(target, parts.netloc, token).encode('latin-1')
+    reader = writer = None
+    while remaining[0] > 0:
+        remaining[0] -= 1
+        if writer is None:
+            reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        started = time.perf_counter()
+        try:
+            writer.write(request)
+            status, keep_alive = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            errors[0] += 1
+            writer.close()
+            writer = None
+            continue
+        latencies.append(time.perf_counter() - started)
+        if status >= 400:
+            errors[0] += 1
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run(url, concurrency, requests, token):
+    remaining = [requests]
+    latencies = []
+    errors = [0]
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(url, token, remaining, latencies, errors)
+                           for _ in range(concurrency)))
+    return time.perf_counter() - started, sorted(latencies), errors[0]
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='History API load benchmark')
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('-c', '--concurrency', type=int, default=32)
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('-t', '--token', default='')
+    args = parser.parse_args()
+
+    print('{:<48} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+        'url', 'req/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'errors'))
+    loop = asyncio.get_event_loop()
+    for url in args.urls:
+        elapsed, latencies, errors = loop.run_until_complete(
+            run(url, args.concurrency, args.requests, args.token))
+        print('{:<48} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7}'.format(
+            url[:48], len(latencies) / elapsed, percentile(latencies, 0.5) * 1e3,
+            percentile(latencies, 0.95) * 1e3, percentile(latencies, 0.99) * 1e3, errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark of event timestamp normalization, comparing the previous
+try/except chain of Persister.parse_datetime against timestamps.normalize
+for the input shapes seen on the persister ingest path.
+
+Usage:
+    python -m benchmarks.timestamps_bench [iterations]
+"""
+import sys
+import timeit
+from datetime import datetime
+from dateutil.parser import parse
+from history.subscriber import timestamps
+
+
+def legacy_parse_datetime(timestamp):
+    """ Previous implementation, minus the ERROR log lines it emitted """
+    if timestamp is None:
+        return datetime.utcnow()
+    try:
+        val = int(timestamp)
+        if timestamp > ((2**31)-1):
+            return datetime.utcfromtimestamp(val/1000)
+        return datetime.utcfromtimestamp(float(timestamp))
+    except ValueError:
+        pass
+    try:
+        return datetime.utcfromtimestamp(float(timestamp)/1000)
+    except ValueError:
+        pass
+    return parse(timestamp)
+
+
+SHAPES = [
+    ('epoch seconds (int)', 1567704621),
+    ('epoch milliseconds (int)', 1567704621389),
+    ('epoch seconds (float)', 1567704621.389),
+    ('RFC3339 UTC', '2021-08-03T20:38:13.389Z'),
+    ('RFC3339 offset', '2021-08-03T20:38:13.389-03:00'),
+    ('free-form string', 'Aug 3 2021 20:38:13'),
+]
+
+
+def main(iterations):
+    print('{:<28} {:>14} {:>14} {:>8}'.format('shape', 'legacy (us)', 'normalize (us)', 'speedup'))
+    for name, value in SHAPES:
+        legacy = timeit.timeit(lambda: legacy_parse_datetime(value), number=iterations)
+        current = timeit.timeit(lambda: timestamps.normalize(value), number=iterations)
+        print('{:<28} {:>14.2f} {:>14.2f} {:>7.1f}x'.format(
+            name, legacy / iterations * 1e6, current / iterations * 1e6, legacy / current))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -1,16 +1,73 @@
 #logging
+import atexit
 import logging
+import queue
+import threading
+import time
 import falcon
 from logging import config as config_log
+from logging.handlers import QueueHandler, QueueListener
 from colorlog import ColoredFormatter
+from history import conf
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most ``rate`` records per call site (file and line) every
+    ``period`` seconds. The first record of the next period reports how many
+    were suppressed.
+    """
+
+    def __init__(self, rate, period=1.0):
+        super().__init__()
+        self.rate = rate
+        self.period = period
+        self.sites = dict()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            started, count, suppressed = self.sites.get(key, (now, 0, 0))
+            if now - started >= self.period:
+                if suppressed:
+                    record.msg = "%s (%d similar messages suppressed)" % (record.msg, suppressed)
+                started, count, suppressed = now, 0, 0
+            if count >= self.rate:
+                self.sites[key] = (started, count, suppressed + 1)
+                return False
+            self.sites[key] = (started, count + 1, suppressed)
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records over to a QueueListener thread, dropping them instead of
+    blocking when the queue is full
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 
 class Log:
-    
+
     levelToName = dict([(50,'CRITICAL'), (40,'ERROR'), (30,'WARNING'), (20,'INFO'), (10,'DEBUG')])
-    
+
+    listener = None
+
     def __init__(self, log_level=logging.DEBUG,
-                 log_format="[%(log_color)s%(asctime)-8s%(reset)s] |%(log_color)s%(module)-8s%(reset)s| %(log_color)s%(levelname)s%(reset)s: %(log_color)s%(message)s%(reset)s", is_disabled=False):
-             
+                 log_format="[%(log_color)s%(asctime)-8s%(reset)s] |%(log_color)s%(module)-8s%(reset)s| %(log_color)s%(levelname)s%(reset)s: %(log_color)s%(message)s%(reset)s", is_disabled=False,
+                 is_async=conf.log_async, rate_limit=conf.log_rate_limit):
+
         #Disable all others modules logs
         log_config = {
             'version': 1,
@@ -26,12 +83,23 @@ class Log:
 
         if not getattr(self.log, 'handler_set', None):
             self.stream = logging.StreamHandler()
-            self.stream.setLevel(log_level)
             self.stream.setFormatter(self.formatter)
+            if is_async:
+                # the listener thread writes whatever the logger lets through
+                log_queue = queue.Queue(conf.log_queue_size)
+                handler = NonBlockingQueueHandler(log_queue)
+                Log.listener = QueueListener(log_queue, self.stream)
+                Log.listener.start()
+                atexit.register(Log.listener.stop)
+            else:
+                handler = self.stream
+            handler.setLevel(log_level)
             self.log.setLevel(log_level)
-            self.log.addHandler(self.stream)
+            self.log.addHandler(handler)
+            if rate_limit:
+                self.log.addFilter(RateLimitFilter(rate_limit))
             self.log.handler_set = True
-    
+
     @staticmethod
     def update_log_level(logger, level):
         logger.setLevel(level.upper())
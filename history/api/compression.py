@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Response compression negotiated by Accept-Encoding. Buffered bodies are
+compressed at once, streamed ones chunk by chunk as the server sends them.
+Bodies smaller than the configured threshold are sent as they are.
+"""
+import gzip
+import zlib
+from .. import conf
+
+# optional, enables zstd
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# size of the chunks read from file-like streams
+READ_SIZE = 64 * 1024
+
+
+def accepted_encodings(header):
+    """
+    Parses an Accept-Encoding header
+
+    :returns: dict of content coding to its quality value
+    """
+    encodings = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[coding] = quality
+    return encodings
+
+
+def supported_encodings():
+    """ Returns the enabled content codings this service can produce, by preference """
+    names = [name.strip().lower() for name in conf.api_compression.split(',') if name.strip()]
+    return [name for name in names
+            if name == 'gzip' or (name == 'zstd' and zstandard is not None)]
+
+
+def negotiate(header):
+    """ Returns the content coding to be used for a request, or None """
+    accepted = accepted_encodings(header)
+    best = None
+    for name in supported_encodings():
+        quality = accepted.get(name, accepted.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (name, quality)
+    return best[0] if best else None
+
+
+def compressor(encoding):
+    """ Returns a streaming compressor with compress() and flush() """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    # wbits 31 writes the gzip header and trailer
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def compress(encoding, data):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, GZIP_LEVEL)
+
+
+def compress_stream(encoding, chunks):
+    """ Lazily compresses an iterable of byte chunks """
+    engine = compressor(encoding)
+    for chunk in chunks:
+        compressed = engine.compress(chunk)
+        if compressed:
+            yield compressed
+    yield engine.flush()
+
+
+def _iterate(stream):
+    if hasattr(stream, 'read'):
+        return iter(lambda: stream.read(READ_SIZE), b'')
+    return iter(stream)
+
+
+class CompressionMiddleware(object):
+    """
+    Compresses response bodies with the content coding preferred by the
+    client among the enabled ones (HISTORY_COMPRESSION)
+    """
+
+    def __init__(self, min_size=None):
+        self.min_size = conf.api_compression_min_size if min_size is None else min_size
+
+    def process_response(self, req, resp, resource, req_succeeded=True):
+        if resp.get_header('Content-Encoding') is not None:
+            return
+        if resp.body is None and resp.data is None and resp.stream is None:
+            return
+        encoding = negotiate(req.get_header('Accept-Encoding'))
+        resp.append_header('Vary', 'Accept-Encoding')
+        if encoding is None:
+            return
+
+        if resp.stream is not None and resp.body is None and resp.data is None:
+            self._compress_stream(resp, encoding)
+            return
+
+        body = resp.body if resp.body is not None else resp.data
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        if len(body) < self.min_size:
+            return
+        resp.body = None
+        resp.data = compress(encoding, body)
+        resp.set_header('Content-Encoding', encoding)
+
+    def _compress_stream(self, resp, encoding):
+        # the headers are sent before the body, so the decision is taken on
+        # the first chunks, read here until the threshold is reached
+        chunks = _iterate(resp.stream)
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= self.min_size:
+                break
+        else:
+            resp.stream = None
+            resp.data = b''.join(head)
+            return
+
+        def body():
+            yield from head
+            yield from chunks
+
+        resp.stream = compress_stream(encoding, body())
+        resp.set_header('Content-Encoding', encoding)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Device-manager client used to find out which attributes a device has
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import falcon
+import requests
+from requests.adapters import HTTPAdapter
+from .. import conf, Logger
+
+logger = Logger.Log(conf.log_level).color_log()
+
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_maxsize=conf.device_manager_pool_size))
+session.mount('https://', HTTPAdapter(pool_maxsize=conf.device_manager_pool_size))
+
+
+def fetch_attrs(device_id, token):
+    """
+    Requests infos of the device to device-manager then get all the attrs related to the device
+
+    :raises falcon.HTTPBadGateway: if device-manager could not be reached
+    """
+    try:
+        response = session.get(conf.device_manager_url + '/device/' + device_id,
+                               headers={'Authorization': token},
+                               timeout=conf.device_manager_timeout)
+    except requests.exceptions.RequestException as error:
+        logger.error('Failed to reach device-manager: %s', error)
+        raise falcon.HTTPBadGateway(title="Device-manager unavailable",
+                                    description="Could not retrieve the device attributes")
+    attrs_list = []
+    json_data = json.loads(response.text)
+
+    for k in json_data['attrs']:
+        for d in json_data['attrs'][k]:
+            if 'label' in d:
+                attrs_list.append(d['label'])
+
+    return attrs_list
+
+
+class AttrsCache(object):
+    """
+    Bounded LRU cache of device attribute labels, keyed by tenant and device.
+
+    Entries younger than ``ttl`` are served as they are. Entries older than
+    that but younger than ``ttl + stale_ttl`` are served while a background
+    refresh runs. Anything older is fetched before answering.
+    """
+
+    def __init__(self, fetch=fetch_attrs, max_size=None, ttl=None, stale_ttl=None):
+        self.fetch = fetch
+        self.max_size = max_size or conf.device_attrs_cache_size
+        self.ttl = conf.device_attrs_cache_ttl if ttl is None else ttl
+        self.stale_ttl = conf.device_attrs_cache_stale_ttl if stale_ttl is None else stale_ttl
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get(self, tenant, device_id, token):
+        """ Returns the attribute labels of a device """
+        key = (tenant, device_id)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                attrs, fetched = entry
+                age = now - fetched
+                if age < self.ttl:
+                    self.entries.move_to_end(key)
+                    return attrs
+                if age < self.ttl + self.stale_ttl:
+                    self.entries.move_to_end(key)
+                    self._refresh_in_background(key, token)
+                    return attrs
+
+        attrs = self.fetch(device_id, token)
+        self._store(key, attrs)
+        return attrs
+
+    def _store(self, key, attrs):
+        with self.lock:
+            self.entries[key] = (attrs, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def _refresh_in_background(self, key, token):
+        # called with the lock held
+        if key in self.refreshing:
+            return
+        self.refreshing.add(key)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=2)
+        self.executor.submit(self._refresh, key, token)
+
+    def _refresh(self, key, token):
+        try:
+            self._store(key, self.fetch(key[1], token))
+        except Exception as error:
+            logger.warning('Failed to refresh attributes of %s: %s', key, error)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+
+cache = AttrsCache()
@@ -3,14 +3,19 @@
 Exposes device information using dojot's modelling
 """
 import json
-import base64
+import itertools
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 import dateutil.parser
 import falcon
 import pymongo
-import requests
-from .. import conf, Logger
+from bson.son import SON
+from .. import conf, Logger, buckets, catalog, latest, mongo
 from . import response_util as ResponseUtil 
+from . import device_manager
+from . import paging
+from . import tokens
 
 logger = Logger.Log(conf.log_level).color_log()
 
@@ -48,14 +53,12 @@ class AuthMiddleware(object):
             :param data: Base64 data as an ASCII byte string
             :returns: The decoded byte string.
         """
-        missing_padding = len(data) % 4
-        if missing_padding != 0:
-            data += '=' * (4 - missing_padding)
-        return base64.decodestring(data.encode('utf-8'))
+        return tokens.decode_base64(data)
 
     def _parse_token(self, token):
         """
-            Parses the authorization token, returning the service to be used as tenant id
+            Parses the authorization token, returning the service to be used as tenant id.
+            Parsed tokens are cached, shared by every route, until they expire.
 
             :param token: JWT token to be parsed
             :returns: Service to be used on API calls, or None if token is invalid
@@ -63,32 +66,67 @@ class AuthMiddleware(object):
         if not token or len(token) == 0:
             return None
 
-        payload = token.split('.')[1]
-        try:
-            data = json.loads(AuthMiddleware._decode_base64(payload))
-            return data['service']
-        except Exception as exception:
-            logger.error(exception)
-            return None
+        return tokens.cache.get(token)
+
+
+INTERVAL_UNITS = {'s': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000}
+
+AGGREGATION_FUNCTIONS = {
+    'avg': {'$avg': '$value'},
+    'min': {'$min': '$value'},
+    'max': {'$max': '$value'},
+    'sum': {'$sum': '$value'},
+    'count': {'$sum': 1},
+    'first': {'$first': '$value'},
+    'last': {'$last': '$value'}
+}
+
+# fields of a history document that can be selected with "fields"
+HISTORY_FIELDS = ('attr', 'value', 'device_id', 'ts', 'metadata')
 
 
 class HistoryUtil(object):
 
-    db = pymongo.MongoClient(conf.db_host, replicaSet=conf.db_replica_set)
+    db = mongo.reader()
+
+    # collection name -> when its existence was last confirmed
+    known_collections = {}
+
+    @staticmethod
+    def handle_timeout(ex, req, resp, params):
+        """ Answers requests whose query ran past conf.db_max_time_ms """
+        logger.warning('Query timed out on %s: %s', req.path, ex)
+        raise falcon.HTTPError(falcon.HTTP_504, title="Query timed out",
+                               description="The query took longer than allowed, narrow its time range or limit")
 
     @staticmethod
     def get_db():
         return HistoryUtil.db['device_history']
 
+    @staticmethod
+    def collection_exists(db, collection_name):
+        """ Asks MongoDB whether a single collection exists, without listing every other one """
+        result = db.command('listCollections', filter={'name': collection_name})
+        return len(result['cursor']['firstBatch']) > 0
+
     @staticmethod
     def get_collection(service, item):
+        """
+        Returns the collection of a device (or of the notifications) of a tenant.
+        Collections known to exist are not looked up again until
+        conf.collection_cache_ttl expires; missing ones are always looked up,
+        so new devices are found right away.
+        """
         db = HistoryUtil.get_db()
         collection_name = "%s_%s" % (service, item)
-        if collection_name in db.collection_names():
-            return db["%s_%s" % (service, item)]
-        else:
-            raise falcon.HTTPNotFound(title="Device not found",
-                                      description="No data for the given device could be found")
+        confirmed = HistoryUtil.known_collections.get(collection_name)
+        if confirmed is None or time.monotonic() - confirmed > conf.collection_cache_ttl:
+            if not HistoryUtil.collection_exists(db, collection_name):
+                HistoryUtil.known_collections.pop(collection_name, None)
+                raise falcon.HTTPNotFound(title="Device not found",
+                                          description="No data for the given device could be found")
+            HistoryUtil.known_collections[collection_name] = time.monotonic()
+        return db[collection_name]
     
     @staticmethod
     def check_type(arg):
@@ -113,6 +151,15 @@ class HistoryUtil(object):
 class DeviceHistory(object):
     """Service used to retrieve a given device historical data"""
 
+    # runs the capped per-attribute finds of limited multi-attribute queries
+    executor = None
+
+    @staticmethod
+    def get_executor():
+        if DeviceHistory.executor is None:
+            DeviceHistory.executor = ThreadPoolExecutor(max_workers=conf.api_attr_workers)
+        return DeviceHistory.executor
+
     @staticmethod
     def parse_request(request, attr):
         """ returns mongo compatible query object, based on the query params provided """
@@ -141,8 +188,9 @@ class DeviceHistory(object):
                 logger.error(e)
                 raise falcon.HTTPInvalidParam('Must be integer.', 'hLimit')
 
+        query = {'value': {'$ne': ' '}}
         if attr:
-            query = {'attr': attr, 'value': {'$ne': ' '}}
+            query['attr'] = attr
 
         ts_filter = {}
         if 'dateFrom' in request.params.keys():
@@ -153,13 +201,32 @@ class DeviceHistory(object):
             query['ts'] = ts_filter
 
         ls_filter = {"_id": False, '@timestamp': False, '@version': False}
-        req = {'query': query, 'limit': limit_val, 'filter': ls_filter, 'sort': sort}
+        fields = None
+        if 'fields' in request.params.keys():
+            fields = DeviceHistory.parse_fields(request.params['fields'])
+            # attr and ts are always read, as grouping and formatting rely on
+            # them, and dropped by format_ts when not selected
+            ls_filter = dict.fromkeys(['attr', 'ts'] + fields, True)
+            ls_filter['_id'] = False
+        req = {'query': query, 'limit': limit_val, 'filter': ls_filter, 'sort': sort, 'fields': fields}
 
         logger.debug('DeviceHistory.parse_request [return]')
         logger.debug(req)
 
         return req
 
+    @staticmethod
+    def parse_fields(value):
+        """ Parses the fields to be returned, given as a comma separated list """
+        if isinstance(value, list):
+            value = ','.join(value)
+        fields = [field.strip() for field in value.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in HISTORY_FIELDS]
+        if unknown or not fields:
+            raise falcon.HTTPInvalidParam(
+                'Must be a list of ' + ', '.join(HISTORY_FIELDS) + '.', 'fields')
+        return list(dict.fromkeys(fields))
+
     @staticmethod
     def csv_response_parser(history):
         concatenated_history = []
@@ -168,84 +235,523 @@ class DeviceHistory(object):
         return concatenated_history
 
     @staticmethod
-    def get_attrs(device_id, token):
-        """Requests infos of the device to device-manager then get all the attrs related to the device"""
+    def get_attrs(device_id, token, tenant=None):
+        """Returns all the attrs related to the device, as known by device-manager"""
         logger.debug('DeviceHistory.get_attrs [start]')
 
-        response = requests.get(conf.device_manager_url+'/device/'+device_id, headers={'Authorization': token})
-        attrs_list = []
-        json_data = json.loads(response.text)
-
-        for k in json_data['attrs']:
-            for d in json_data['attrs'][k]:
-                if 'label' in d:
-                    attrs_list.append(d['label'])
+        attrs_list = device_manager.cache.get(tenant, device_id, token)
 
         logger.debug('DeviceHistory.get_attrs [return]')
         logger.debug(attrs_list)
 
         return attrs_list
 
+    @staticmethod
+    def get_all_attrs(req, device_id):
+        """
+        Returns the attributes of the device, as listed by device-manager,
+        followed by those only the catalog knows of. The catalog is not
+        backfilled and is flushed asynchronously, so it may miss attributes;
+        it is only used when device-manager cannot be reached.
+        """
+        service = req.context['related_service']
+        known_attrs = DeviceHistory.get_catalog(service, device_id)
+        token = req.get_header('authorization')
+        try:
+            attrs = DeviceHistory.get_attrs(device_id, token, service)
+        except falcon.HTTPBadGateway:
+            if not known_attrs:
+                raise
+            return sorted(known_attrs)
+        return list(attrs) + sorted(set(known_attrs or ()) - set(attrs))
+
+    @staticmethod
+    def get_catalog(service, device_id):
+        """Returns the attributes of the device that have data, as cataloged by the persister"""
+        if not catalog.is_enabled():
+            return {}
+        return catalog.lookup(HistoryUtil.get_db(), service, device_id)
+
+    @staticmethod
+    def get_latest(service, device_id):
+        """
+        Returns the latest value of each attribute of the device, as kept by
+        the persister, or None when it has none
+        """
+        if not latest.is_enabled():
+            return None
+        return latest.lookup(HistoryUtil.get_db(), service, device_id)
+
+    @staticmethod
+    def wants_latest(req, extra_params=()):
+        """ Whether the request only asks for the newest value of its attributes """
+        if not latest.is_enabled() or set(req.params.keys()) - {'lastN', 'attr', 'fields'} - set(extra_params):
+            return False
+        return str(req.params.get('lastN')).strip() == '1'
+
+    @staticmethod
+    def respond_latest(req, resp, device_id):
+        """
+        Sets the response body of a lastN=1 request from the latest values.
+        Attributes missing from them are looked up in the history.
+
+        :returns: False if the request has to be answered from the history
+        """
+        service = req.context['related_service']
+        values = DeviceHistory.get_latest(service, device_id)
+        if values is None:
+            return False
+        query = DeviceHistory.parse_request(req, None)
+        attr = req.params.get('attr')
+        if attr is not None and not isinstance(attr, list):
+            if attr not in values:
+                return False
+            ResponseUtil.set_body(
+                req, resp, list(DeviceHistory.format_ts([values[attr]], query['fields'])))
+            return True
+
+        history = DeviceHistory.from_latest(req, query, device_id, values, attr)
+        ResponseUtil.set_body(req, resp, history, DeviceHistory.csv_response_parser)
+        return True
+
+    @staticmethod
+    def from_latest(req, query, device_id, values, attrs=None):
+        """
+        Builds the lastN=1 history of several attributes from the latest
+        values of the device
+
+        :param values: latest values, as returned by get_latest
+        :param attrs: attributes to be returned, all of them when None
+        :returns: dict of attribute to its history, with every attribute
+        """
+        service = req.context['related_service']
+        if attrs is None:
+            attrs = DeviceHistory.get_all_attrs(req, device_id)
+        missing = [name for name in attrs if name not in values]
+        older = {}
+        if missing:
+            collection = HistoryUtil.get_collection(service, device_id)
+            older = DeviceHistory.get_multiple_attrs(collection, query, missing)
+        history = {}
+        for name in attrs:
+            if name in values:
+                history[name] = list(DeviceHistory.format_ts([values[name]], query['fields']))
+            else:
+                history[name] = older.get(name, [])
+        return history
+
+    @staticmethod
+    def format_ts(docs, fields=None):
+        """
+        Lazily formats the timestamp of each document as an ISO 8601 string,
+        keeping only the given fields, in their order, when there are any
+        """
+        for d in docs:
+            d['ts'] = d['ts'].isoformat() + 'Z'
+            if fields:
+                d = {field: d[field] for field in fields if field in d}
+            yield d
+
+    @staticmethod
+    def iter_single_attr(collection, query):
+        """ Lazily yields the history of a single attribute, straight from the cursor """
+        if buckets.is_enabled():
+            cursor = buckets.find(collection, query)
+        else:
+            cursor = mongo.max_time(collection.find(query['query'],
+                                                    query['filter'],
+                                                    sort=query['sort'],
+                                                    limit=query['limit']))
+        return DeviceHistory.format_ts(cursor, query.get('fields'))
+
     @staticmethod
     def get_single_attr(collection, query):
         logger.debug('DeviceHistory.get_single_attr [start]')
 
-        cursor = collection.find(query['query'],
-                                 query['filter'],
-                                 sort=query['sort'],
-                                 limit=query['limit'])
-        history = []
-        for d in cursor:
-            d['ts'] = d['ts'].isoformat() + 'Z'
-            history.append(d)
+        history = list(DeviceHistory.iter_single_attr(collection, query))
 
         logger.debug('DeviceHistory.get_single_attr [return]')
         logger.debug(history)
 
         return history
-        
+
+    @staticmethod
+    def iter_multiple_attrs(collection, query, attrs):
+        """
+        Lazily yields (attribute, history) pairs for several attributes.
+        Limited queries (firstN, lastN, hLimit) run one capped find per
+        attribute, concurrently, so only the first N samples of each are read.
+        Range queries stream a single find sorted by attribute. Every requested
+        attribute is yielded; those without data have an empty history.
+
+        :param query: query built by parse_request without an attribute
+        :param attrs: list of attributes to be returned
+        """
+        def single_query(attr):
+            return dict(query, query=dict(query['query'], attr=attr))
+
+        if query['limit']:
+            def fetch(attr):
+                return list(DeviceHistory.iter_single_attr(collection, single_query(attr)))
+            for attr, docs in zip(attrs, DeviceHistory.get_executor().map(fetch, attrs)):
+                yield attr, iter(docs)
+            return
+
+        if buckets.is_enabled():
+            for attr in attrs:
+                yield attr, DeviceHistory.iter_single_attr(collection, single_query(attr))
+            return
+
+        match = dict(query['query'], attr={'$in': list(attrs)})
+        direction = query['sort'][0][1]
+        sort = [('attr', direction), ('ts', direction)]
+        cursor = mongo.max_time(collection.find(match, query['filter'], sort=sort))
+        groups = itertools.groupby(cursor, key=lambda d: d['attr'])
+
+        missing = dict.fromkeys(attrs)
+        for attr, docs in groups:
+            missing.pop(attr, None)
+            yield attr, DeviceHistory.format_ts(docs, query.get('fields'))
+        for attr in missing:
+            yield attr, iter(())
+
+    @staticmethod
+    def get_multiple_attrs(collection, query, attrs):
+        """
+        Fetches the history of several attributes
+
+        :param query: query built by parse_request without an attribute
+        :param attrs: list of attributes to be returned
+        :returns: dict of attribute to its history, with every requested attribute
+        """
+        logger.debug('DeviceHistory.get_multiple_attrs [start]')
+
+        history = {attr: [] for attr in attrs}
+        for attr, docs in DeviceHistory.iter_multiple_attrs(collection, query, attrs):
+            history[attr] = list(docs)
+
+        logger.debug('DeviceHistory.get_multiple_attrs [return]')
+        logger.debug(history)
+
+        return history
+
+    @staticmethod
+    def parse_interval(value):
+        """
+        Parses an aggregation interval such as "30s", "5m", "1h" or "1d"
+
+        :returns: interval length, in milliseconds
+        """
+        match = re.match(r'^(\d+)([smhd])$', value or '')
+        if match is None or int(match.group(1)) == 0:
+            raise falcon.HTTPInvalidParam(
+                'Must be a positive integer followed by s, m, h or d.', 'interval')
+        return int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+    @staticmethod
+    def parse_functions(value):
+        """ Parses the aggregation functions, given as a comma separated list """
+        if isinstance(value, list):
+            value = ','.join(value)
+        functions = [fn.strip() for fn in (value or 'avg').split(',') if fn.strip()]
+        unknown = [fn for fn in functions if fn not in AGGREGATION_FUNCTIONS]
+        if unknown or not functions:
+            raise falcon.HTTPInvalidParam(
+                'Must be a list of ' + ', '.join(AGGREGATION_FUNCTIONS) + '.', 'fn')
+        return list(dict.fromkeys(functions))
+
+    @staticmethod
+    def get_aggregated(collection, query, attrs, interval, functions):
+        """
+        Aggregates the history of several attributes into time buckets, in the
+        database. Buckets are aligned to the epoch and listed oldest first.
+
+        :param query: query built by parse_request without an attribute
+        :param interval: bucket length, in milliseconds
+        :param functions: aggregation functions, see AGGREGATION_FUNCTIONS
+        :returns: dict of attribute to its buckets, with every requested attribute
+        """
+        logger.debug('DeviceHistory.get_aggregated [start]')
+
+        match = dict(query['query'], attr={'$in': list(attrs)})
+        by_time = SON([('attr', pymongo.ASCENDING), ('ts', pymongo.ASCENDING)])
+        if buckets.is_enabled():
+            stages = buckets.sample_stages(match) + [{'$sort': by_time}]
+        else:
+            # sorting first walks the (attr, ts) index and orders first/last
+            stages = [{'$match': match}, {'$sort': by_time}]
+        since_epoch = {'$subtract': ['$ts', buckets.EPOCH]}
+        group = {'_id': {
+            'attr': '$attr',
+            'ts': {'$subtract': ['$ts', {'$mod': [since_epoch, interval]}]}
+        }}
+        for fn in functions:
+            group[fn] = AGGREGATION_FUNCTIONS[fn]
+        stages += [
+            {'$group': group},
+            {'$sort': SON([('_id.attr', pymongo.ASCENDING), ('_id.ts', pymongo.ASCENDING)])}
+        ]
+
+        history = {attr: [] for attr in attrs}
+        for doc in collection.aggregate(stages, allowDiskUse=True, **mongo.command_options()):
+            point = {'attr': doc['_id']['attr'], 'ts': doc['_id']['ts'].isoformat() + 'Z'}
+            for fn in functions:
+                point[fn] = doc[fn]
+            history[point['attr']].append(point)
+
+        logger.debug('DeviceHistory.get_aggregated [return]')
+        logger.debug(history)
+
+        return history
+
+    @staticmethod
+    def get_page(collection, query, attrs, page):
+        """
+        Fetches a page of the history of one or more attributes, ordered by
+        (ts, _id) across all of them
+
+        :param query: query built by parse_request without an attribute
+        :param page: paging.Page to be fetched
+        :returns: dict of attribute to its history in the page, and the
+            token of the next page (None on the last one)
+        """
+        logger.debug('DeviceHistory.get_page [start]')
+
+        match = dict(query['query'], attr={'$in': list(attrs)})
+        docs, token = page.find(collection, match, query['filter'])
+        history = {attr: [] for attr in attrs}
+        for d in docs:
+            history[d['attr']].extend(DeviceHistory.format_ts([d], query.get('fields')))
+
+        logger.debug('DeviceHistory.get_page [return]')
+        logger.debug(history)
+
+        return history, token
+
+    @staticmethod
+    def respond_multiple_attrs(req, resp, collection, attrs):
+        """ Sets the response body, or stream, with the history of several attributes """
+        query = DeviceHistory.parse_request(req, None)
+        if ResponseUtil.should_stream(req):
+            resp.content_type = ResponseUtil.media_type(req)
+            resp.stream = ResponseUtil.stream_groups(
+                req, DeviceHistory.iter_multiple_attrs(collection, query, attrs))
+            return
+        history = DeviceHistory.get_multiple_attrs(collection, query, attrs)
+        ResponseUtil.set_body(req, resp, history, DeviceHistory.csv_response_parser)
+        logger.debug(history)
+
     @staticmethod
     def on_get(req, resp, device_id):
         logger.debug('DeviceHistory.on_get [start]')
         
         ResponseUtil.validate_accept_header(req)            
+        if DeviceHistory.wants_latest(req) and DeviceHistory.respond_latest(req, resp, device_id):
+            logger.debug('DeviceHistory.on_get [return]')
+            resp.status = falcon.HTTP_200
+            return
         collection = HistoryUtil.get_collection(req.context['related_service'], device_id)
-        if 'attr' in req.params.keys():
+        if 'interval' in req.params.keys():
+            logger.info('will aggregate the history')
+            if 'attr' in req.params.keys():
+                attrs = req.params['attr']
+                attrs = attrs if isinstance(attrs, list) else [attrs]
+            else:
+                attrs = DeviceHistory.get_all_attrs(req, device_id)
+            history = DeviceHistory.get_aggregated(
+                collection, DeviceHistory.parse_request(req, None), attrs,
+                DeviceHistory.parse_interval(req.params['interval']),
+                DeviceHistory.parse_functions(req.params.get('fn')))
+            ResponseUtil.set_body(req, resp, history, DeviceHistory.csv_response_parser)
+
+        elif paging.parse(req) is not None:
+            logger.info('will return a page of the history')
+            if buckets.is_enabled():
+                raise falcon.HTTPInvalidParam(
+                    'Paging is not available when samples are stored in buckets.', 'pageSize')
+            page = paging.parse(req)
+            if 'attr' in req.params.keys():
+                attr = req.params['attr']
+                attrs = attr if isinstance(attr, list) else [attr]
+            else:
+                attrs = DeviceHistory.get_all_attrs(req, device_id)
+            history, token = DeviceHistory.get_page(
+                collection, DeviceHistory.parse_request(req, None), attrs, page)
+            if token is not None:
+                resp.set_header(paging.NEXT_PAGE_HEADER, token)
+            if 'attr' in req.params.keys() and not isinstance(req.params['attr'], list):
+                ResponseUtil.set_body(req, resp, history[req.params['attr']])
+            else:
+                ResponseUtil.set_body(req, resp, history, DeviceHistory.csv_response_parser)
+
+        elif 'attr' in req.params.keys():
             if isinstance(req.params['attr'], list):
                 logger.info('got list of attrs')
-                history = {}
-                for attr in req.params['attr']:
-                    query = DeviceHistory.parse_request(req, attr)
-                    history[attr] = DeviceHistory.get_single_attr(collection, query)
-                resp.body = ResponseUtil.build_response_body(req, history, DeviceHistory.csv_response_parser )
+                DeviceHistory.respond_multiple_attrs(req, resp, collection, req.params['attr'])
                 
             else:
                 logger.info('got single attr')
-                history = DeviceHistory.get_single_attr(
-                    collection, DeviceHistory.parse_request(req, req.params['attr']))
-                if len(history) == 0:
-                    msg = "No data for the given attribute could be found"
-                    raise falcon.HTTPNotFound(title="Attr not found", description=msg)
-                
-                resp.body =  ResponseUtil.build_response_body(req, history )
+                msg = "No data for the given attribute could be found"
+                query = DeviceHistory.parse_request(req, req.params['attr'])
+                if ResponseUtil.should_stream(req):
+                    docs = DeviceHistory.iter_single_attr(collection, query)
+                    first = next(docs, None)
+                    if first is None:
+                        raise falcon.HTTPNotFound(title="Attr not found", description=msg)
+                    resp.content_type = ResponseUtil.media_type(req)
+                    resp.stream = ResponseUtil.stream_array(req, itertools.chain([first], docs))
+                else:
+                    history = DeviceHistory.get_single_attr(collection, query)
+                    if len(history) == 0:
+                        raise falcon.HTTPNotFound(title="Attr not found", description=msg)
+
+                    ResponseUtil.set_body(req, resp, history)
+                    logger.debug(history)
                 
         else:
             logger.info('will return all the attrs')
-            history = {}
-            token = req.get_header('authorization')
-            attrs_list = DeviceHistory.get_attrs(device_id, token)
-            for attr in attrs_list:
-                query = DeviceHistory.parse_request(req, attr)
-                history[attr] = DeviceHistory.get_single_attr(collection, query)
-            
-            resp.body = ResponseUtil.build_response_body(req, history, DeviceHistory.csv_response_parser )
+            attrs_list = DeviceHistory.get_all_attrs(req, device_id)
+            DeviceHistory.respond_multiple_attrs(req, resp, collection, attrs_list)
 
         logger.debug('DeviceHistory.on_get [return]')
-        logger.debug(history)
 
         resp.status = falcon.HTTP_200
       
 
+class DeviceSummary(object):
+    """Summary of the attributes of a device that have data, taken from the catalog"""
+
+    @staticmethod
+    def on_get(req, resp, device_id):
+        logger.debug('DeviceSummary.on_get [start]')
+
+        entries = DeviceHistory.get_catalog(req.context['related_service'], device_id)
+        if not entries:
+            raise falcon.HTTPNotFound(title="Device not found",
+                                      description="No data for the given device could be found")
+        summary = {'device_id': device_id, 'attrs': {}}
+        for attr in sorted(entries):
+            summary['attrs'][attr] = {
+                'first_ts': entries[attr]['first_ts'].isoformat() + 'Z',
+                'last_ts': entries[attr]['last_ts'].isoformat() + 'Z',
+                'count': entries[attr]['count']
+            }
+
+        logger.debug('DeviceSummary.on_get [return]')
+        logger.debug(summary)
+
+        resp.status = falcon.HTTP_200
+        resp.body = json.dumps(summary)
+
+
+class BulkHistory(object):
+    """History of several devices of a tenant, fetched concurrently, in a single response"""
+
+    executor = None
+
+    @staticmethod
+    def get_executor():
+        if BulkHistory.executor is None:
+            BulkHistory.executor = ThreadPoolExecutor(max_workers=conf.api_bulk_workers)
+        return BulkHistory.executor
+
+    @staticmethod
+    def parse_devices(value):
+        """ Parses the devices to be fetched, given as a comma separated list """
+        if isinstance(value, list):
+            value = ','.join(value)
+        devices = list(dict.fromkeys(device.strip() for device in value.split(',') if device.strip()))
+        if not devices or len(devices) > conf.api_bulk_max_devices:
+            raise falcon.HTTPInvalidParam(
+                'Must be a list of 1 to {} devices.'.format(conf.api_bulk_max_devices), 'device_id')
+        return devices
+
+    @staticmethod
+    def get_device_history(req, query, device_id, attrs, values=None):
+        """
+        Returns the history of a device, as DeviceHistory.get_multiple_attrs
+
+        :param attrs: attributes to be returned, all of them when None
+        :param values: latest values of the device, to answer lastN=1 from
+        """
+        service = req.context['related_service']
+        try:
+            if values is not None:
+                return DeviceHistory.from_latest(req, query, device_id, values, attrs)
+            collection = HistoryUtil.get_collection(service, device_id)
+        except falcon.HTTPNotFound:
+            return {attr: [] for attr in attrs or []}
+        if attrs is None:
+            attrs = DeviceHistory.get_all_attrs(req, device_id)
+        return DeviceHistory.get_multiple_attrs(collection, query, attrs)
+
+    @staticmethod
+    def csv_response_parser(history):
+        return [doc for device in history.values() for docs in device.values() for doc in docs]
+
+    @staticmethod
+    def on_get(req, resp):
+        logger.debug('BulkHistory.on_get [start]')
+        ResponseUtil.validate_accept_header(req)
+        if 'device_id' not in req.params.keys():
+            raise falcon.HTTPMissingParam('device_id')
+
+        devices = BulkHistory.parse_devices(req.params['device_id'])
+        attrs = req.params.get('attr')
+        if attrs is not None and not isinstance(attrs, list):
+            attrs = [attrs]
+        query = DeviceHistory.parse_request(req, None)
+        latest_values = {}
+        if DeviceHistory.wants_latest(req, extra_params=['device_id']):
+            latest_values = latest.lookup_many(
+                HistoryUtil.get_db(), req.context['related_service'], devices)
+
+        results = BulkHistory.get_executor().map(
+            lambda device_id: (device_id, BulkHistory.get_device_history(
+                req, query, device_id, attrs, latest_values.get(device_id))),
+            devices)
+
+        resp.status = falcon.HTTP_200
+        if ResponseUtil.should_stream(req):
+            resp.content_type = ResponseUtil.media_type(req)
+            resp.stream = ResponseUtil.stream_map(req, results, BulkHistory.csv_response_parser)
+            return
+        history = dict(results)
+
+        logger.debug('BulkHistory.on_get [return]')
+        logger.debug(history)
+
+        ResponseUtil.set_body(req, resp, history, BulkHistory.csv_response_parser)
+
+
+class LatestValues(object):
+    """Latest value of every attribute of every device of a tenant"""
+
+    @staticmethod
+    def on_get(req, resp):
+        logger.debug('LatestValues.on_get [start]')
+        ResponseUtil.validate_accept_header(req)
+        if not latest.is_enabled():
+            raise falcon.HTTPNotFound(title="Latest values not available",
+                                      description="The latest values of the devices are not being kept")
+
+        attrs = req.params.get('attr')
+        if attrs is not None and not isinstance(attrs, list):
+            attrs = [attrs]
+        snapshot = latest.snapshot(HistoryUtil.get_db(), req.context['related_service'])
+        history = {}
+        for device_id, values in snapshot.items():
+            names = sorted(values) if attrs is None else [attr for attr in attrs if attr in values]
+            if names:
+                history[device_id] = list(DeviceHistory.format_ts(values[attr] for attr in names))
+
+        logger.debug('LatestValues.on_get [return]')
+        logger.debug(history)
+
+        resp.status = falcon.HTTP_200
+        ResponseUtil.set_body(req, resp, history, DeviceHistory.csv_response_parser)
+
+
 class NotificationHistory(object):
 
     @staticmethod
@@ -257,17 +763,33 @@ class NotificationHistory(object):
         ResponseUtil.validate_accept_header(req)
 
         collection = HistoryUtil.get_collection(req.context['related_service'], "notifications")
-        history = {}
         logger.info("Will retrieve notifications")
         filter_query = req.params
         query = NotificationHistory.get_query(filter_query)      
+        page = paging.parse(req)
+        if page is not None:
+            docs, token = page.find(collection, query['query'], query['filter'])
+            if token is not None:
+                resp.set_header(paging.NEXT_PAGE_HEADER, token)
+            history = {'notifications': [dict(d, ts=d['ts'].isoformat() + 'Z') for d in docs]}
+            resp.status = falcon.HTTP_200
+            ResponseUtil.set_body(req, resp, history)
+            return
+        if ResponseUtil.should_stream(req) and ResponseUtil.media_type(req) == ResponseUtil.JSON:
+            resp.status = falcon.HTTP_200
+            resp.content_type = ResponseUtil.JSON
+            resp.stream = ResponseUtil.embed_json_array(
+                {'notifications': ResponseUtil.PLACEHOLDER},
+                NotificationHistory.iter_notifications(collection, query))
+            return
+        history = {}
         history['notifications'] = NotificationHistory.get_notifications(collection, query)
 
         logger.debug('NotificationHistory.on_get [return]')
         logger.debug(history)
 
         resp.status = falcon.HTTP_200
-        resp.body = ResponseUtil.build_response_body(req, history)
+        ResponseUtil.set_body(req, resp, history)
 
     @staticmethod
     def get_query(filter_query):
@@ -276,6 +798,8 @@ class NotificationHistory(object):
         query = {}
         if filter_query:
             for field in filter_query.keys():
+                if field in paging.PARAMS:
+                    continue
                 value = filter_query[field]
 
                 if field != "subject":
@@ -294,16 +818,20 @@ class NotificationHistory(object):
 
         return result
     
+    @staticmethod
+    def iter_notifications(collection, query):
+        """ Lazily yields the notifications matching a query, straight from the cursor """
+        docs = mongo.max_time(collection.find(query['query'], query['filter'],
+                                              limit=query['limit_val'], sort=query['sort']))
+        for d in docs:
+            d['ts'] = d['ts'].isoformat() + 'Z'
+            yield d
+
     @staticmethod
     def get_notifications(collection, query):
         logger.debug('NotificationHistory.get_notifications [start]')
 
-        docs = collection.find(query['query'], query['filter'], limit=query['limit_val'], sort=query['sort'])
-
-        history = []
-        for d in docs:
-            d['ts'] = d['ts'].isoformat() + 'Z'
-            history.append(d)
+        history = list(NotificationHistory.iter_notifications(collection, query))
 
         logger.debug('NotificationHistory.get_notifications [return]')
         logger.debug(history)
@@ -321,17 +849,27 @@ class STHHistory(object):
         collection = HistoryUtil.get_collection(req.context['related_service'], device_id)
 
         query = DeviceHistory.parse_request(req, attr)
-        cursor = collection.find(query['query'],
-                                 query['filter'],
-                                 sort=query['sort'],
-                                 limit=query['limit'])
-        history = []
-        for d in cursor:
-            history.insert(0, {
-                "attrType": device_type,
-                "attrValue": d['value'],
-                "recvTime": d['ts'].isoformat() + 'Z'
-            })
+        if query['fields']:
+            # the NGSI body always carries the value, whatever the fields
+            query['filter']['value'] = True
+        stream = conf.api_stream_responses and not query['limit']
+        if stream:
+            # values are listed oldest first; without a limit, reading them
+            # in that order gives the same result without buffering them
+            query['sort'] = [('ts', pymongo.ASCENDING)]
+        if buckets.is_enabled():
+            cursor = buckets.find(collection, query)
+        else:
+            cursor = mongo.max_time(collection.find(query['query'],
+                                                    query['filter'],
+                                                    sort=query['sort'],
+                                                    limit=query['limit']))
+        values = ({
+            "attrType": device_type,
+            "attrValue": d['value'],
+            "recvTime": d['ts'].isoformat() + 'Z'
+        } for d in cursor)
+        history = ResponseUtil.PLACEHOLDER if stream else list(values)[::-1]
 
         ngsi_body = {
             "contextResponses": [
@@ -351,10 +889,13 @@ class STHHistory(object):
         }
 
         logger.debug('STHHistory.on_get [return]')
-        logger.debug(ngsi_body)
 
         resp.status = falcon.HTTP_200
-        resp.body = json.dumps(ngsi_body)
+        if stream:
+            resp.stream = ResponseUtil.embed_json_array(ngsi_body, values)
+        else:
+            logger.debug(ngsi_body)
+            resp.body = json.dumps(ngsi_body)
 
 
 class LoggingInterface(object):
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Keyset pagination over (ts, _id). Each page seeks past the last document of
+the previous one instead of skipping documents, so deep pages cost the same
+as the first one on the (ts, _id) and (attr, ts, _id) indexes.
+
+The continuation token handed to clients is the position of that last
+document and the direction of the listing, as url-safe base64 JSON.
+"""
+import base64
+import binascii
+import falcon
+import pymongo
+from bson import json_util
+from .. import conf, mongo
+
+# request parameters that control paging rather than filter documents
+PARAMS = ('pageSize', 'pageToken', 'order')
+
+NEXT_PAGE_HEADER = 'X-Next-Page-Token'
+
+
+class Page(object):
+    """ A page request: its size, listing direction and starting position """
+
+    def __init__(self, size, direction=pymongo.DESCENDING, after=None):
+        self.size = size
+        self.direction = direction
+        self.after = after
+
+    @property
+    def sort(self):
+        return [('ts', self.direction), ('_id', self.direction)]
+
+    def seek(self, query):
+        """ Restricts a query to the documents after the starting position """
+        if self.after is None:
+            return query
+        ts, _id = self.after
+        op = '$lt' if self.direction == pymongo.DESCENDING else '$gt'
+        return {'$and': [query, {'$or': [{'ts': {op: ts}}, {'ts': ts, '_id': {op: _id}}]}]}
+
+    def next_token(self, docs):
+        """
+        Returns the token of the page after ``docs``, or None when it is the
+        last one. ``docs`` must be fetched with a limit of size + 1.
+        """
+        if len(docs) <= self.size:
+            return None
+        last = docs[self.size - 1]
+        payload = json_util.dumps({'ts': last['ts'], 'id': last['_id'], 'dir': self.direction})
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def find(self, collection, query, projection):
+        """
+        Runs a paginated find, returning the documents of the page (without
+        _id) and the token of the next page
+        """
+        projection = {key: value for key, value in projection.items() if key != '_id'}
+        docs = list(mongo.max_time(collection.find(self.seek(query), projection or None,
+                                                   sort=self.sort, limit=self.size + 1)))
+        token = self.next_token(docs)
+        docs = docs[:self.size]
+        for doc in docs:
+            doc.pop('_id', None)
+        return docs, token
+
+
+def decode_token(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if data['dir'] in (pymongo.ASCENDING, pymongo.DESCENDING):
+            return (data['ts'], data['id']), data['dir']
+    except (ValueError, KeyError, TypeError, binascii.Error, UnicodeError):
+        pass
+    raise falcon.HTTPInvalidParam('Not a valid continuation token.', 'pageToken')
+
+
+def parse(request):
+    """
+    Returns the Page requested by pageSize, pageToken and order, or None when
+    the request is not paginated
+    """
+    params = request.params.keys()
+    if 'pageSize' not in params and 'pageToken' not in params:
+        return None
+    size = request.params.get('pageSize', conf.api_max_page_size)
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise falcon.HTTPInvalidParam('Must be integer.', 'pageSize')
+    if size < 1 or size > conf.api_max_page_size:
+        raise falcon.HTTPInvalidParam(
+            'Must be between 1 and {}.'.format(conf.api_max_page_size), 'pageSize')
+
+    if 'pageToken' in params:
+        after, direction = decode_token(request.params['pageToken'])
+        return Page(size, direction, after)
+    order = request.params.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise falcon.HTTPInvalidParam('Must be asc or desc.', 'order')
+    return Page(size, pymongo.ASCENDING if order == 'asc' else pymongo.DESCENDING)
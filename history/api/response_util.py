@@ -1,30 +1,361 @@
 # -*- coding: utf-8 -*-
-import json
-import io
 import csv
+import io
+import itertools
+import json
 import falcon
-import pandas as pd
+from .. import conf
+
+# optional binary formats, offered only when their library is installed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import pyarrow
+    import pyarrow.compute
+except ImportError:
+    pyarrow = None
+
+# encoded size at which a streamed chunk is handed to the server
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# documents read before the columns of a streamed CSV are decided
+CSV_LOOKAHEAD = 1000
+
+# stands for the streamed array in the document given to embed_json_array
+PLACEHOLDER = '__history_stream__'
+
+# rows per record batch of Arrow IPC streams
+ARROW_BATCH_SIZE = 64 * 1024
+
+# response formats, by server preference when the client accepts several
+# with the same quality
+JSON = 'application/json'
+CSV = 'text/csv'
+NDJSON = 'application/x-ndjson'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+
+def media_types():
+    """ Returns the media types the api can respond with """
+    types = [JSON, CSV, NDJSON]
+    if msgpack is not None:
+        types.append(MSGPACK)
+    if pyarrow is not None:
+        types.append(ARROW)
+    return types
+
+
+def media_type(request):
+    """ Returns the supported media type the client prefers, by Accept quality """
+    # ties go to the last type given, so the server preference is reversed
+    media = request.client_prefers(list(reversed(media_types())))
+    if media is None:
+        raise falcon.HTTPNotAcceptable("Not Acceptable")
+    return media
+
 
 def validate_accept_header(request):
     """ Validates if the http accept header is supported by the api """
-    if not (request.client_accepts("application/json") or request.client_accepts("text/csv")):
-        raise falcon.HTTPNotAcceptable("Not Acceptable")
+    media_type(request)
     return
     
 
 def build_response_body(request, history, csv_parser= None):
     """ Format the response according to the type entered in http accept header.
-        It is possible enter a method to perform specific formatting of a route before parsing csv
+        It is possible enter a method to perform specific formatting of a route before parsing csv.
+        Binary formats are returned as bytes.
     """
-    if request.client_accepts("application/json"):
+    media = media_type(request)
+    if media == JSON:
         return json.dumps(history)
-    elif request.client_accepts('text/csv'):
+    elif media == CSV:
         history_parsed = csv_parser(history) if csv_parser else history
-        csv_buffer = io.StringIO()
-        history_normalized = pd.json_normalize(history_parsed)
-        history_normalized.to_csv(csv_buffer, index=False, quotechar='"', encoding="utf-8", quoting=csv.QUOTE_NONNUMERIC)
-        return csv_buffer.getvalue()
-    
-    raise falcon.HTTPNotAcceptable("Not Acceptable")
-    
-    
\ No newline at end of file
+        return ''.join(csv_text(history_parsed, lookahead=None))
+    elif media == MSGPACK:
+        return msgpack.packb(history)
+
+    rows = records(history, csv_parser)
+    if media == NDJSON:
+        return ''.join(ndjson_lines(rows))
+    return arrow_stream(rows)
+
+
+def set_body(request, response, history, csv_parser=None):
+    """ Sets the response body, and its content type, in the format accepted by the client """
+    body = build_response_body(request, history, csv_parser)
+    response.content_type = media_type(request)
+    if isinstance(body, bytes):
+        response.data = body
+    else:
+        response.body = body
+
+
+def records(history, parser=None):
+    """
+    Returns the documents of a response as a list of rows, for the row
+    oriented formats: the parsed history, or the concatenation of its
+    lists when it maps names to lists of documents
+    """
+    rows = parser(history) if parser else history
+    if isinstance(rows, dict):
+        if rows and all(isinstance(value, list) for value in rows.values()):
+            return list(itertools.chain.from_iterable(rows.values()))
+        return [rows]
+    return rows
+
+
+def should_stream(request):
+    """ Whether the response should be streamed from the cursor instead of built in memory """
+    return conf.api_stream_responses
+
+
+def json_array_chunks(docs, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encodes an iterable of documents as a JSON array, yielding it in chunks of
+    about chunk_size bytes, so memory does not grow with the number of documents.
+    The output is the same as json.dumps(list(docs)).
+    """
+    parts = ['[']
+    size = 1
+    separator = ''
+    for doc in docs:
+        encoded = separator + json.dumps(doc)
+        separator = ', '
+        parts.append(encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+    parts.append(']')
+    yield ''.join(parts).encode('utf-8')
+
+
+def json_object_chunks(items, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encodes (key, iterable of documents) pairs as a JSON object of arrays,
+    yielding it in chunks. The output is the same as json.dumps of the dict.
+    """
+    separator = '{'
+    for key, docs in items:
+        yield (separator + json.dumps(key) + ': ').encode('utf-8')
+        separator = ', '
+        yield from json_array_chunks(docs, chunk_size)
+    yield ('{}' if separator == '{' else '}').encode('utf-8')
+
+
+def json_map_chunks(items):
+    """
+    Encodes (key, value) pairs as a JSON object, yielding a chunk per pair
+    as soon as it is available. The output is the same as json.dumps of the dict.
+    """
+    separator = '{'
+    for key, value in items:
+        yield (separator + json.dumps(key) + ': ' + json.dumps(value)).encode('utf-8')
+        separator = ', '
+    yield ('{}' if separator == '{' else '}').encode('utf-8')
+
+
+def embed_json_array(document, docs, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encodes a document whose only PLACEHOLDER value is to be replaced by the
+    JSON array of docs, yielding it in chunks
+    """
+    head, tail = json.dumps(document).split(json.dumps(PLACEHOLDER))
+    yield head.encode('utf-8')
+    yield from json_array_chunks(docs, chunk_size)
+    yield tail.encode('utf-8')
+
+
+def flatten(doc):
+    """
+    Flattens nested dicts into "parent.child" keys, in the same order as
+    pandas.json_normalize: top level values keep their place and flattened
+    ones follow, so {} values produce no column at all.
+    """
+    flat = {}
+    nested = {}
+    for key, value in doc.items():
+        if isinstance(value, dict):
+            _flatten_into(nested, str(key), value)
+        else:
+            flat[key] = value
+    flat.update(nested)
+    return flat
+
+
+def _flatten_into(flat, prefix, doc):
+    for key, value in doc.items():
+        name = prefix + '.' + str(key)
+        if isinstance(value, dict):
+            _flatten_into(flat, name, value)
+        else:
+            flat[name] = value
+
+
+def _column_kind(values):
+    """
+    Infers how pandas would type a column: "float" when it only holds
+    numbers and some of them are floats or missing, "number" when it mixes
+    floats (NaN included) with other values, "plain" otherwise
+    """
+    floats = any(isinstance(value, float) for value in values)
+    present = [value for value in values
+               if value is not None and not (isinstance(value, float) and value != value)]
+    if present and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return 'float' if floats or len(present) < len(values) else 'plain'
+    return 'number' if floats else 'plain'
+
+
+def csv_text(docs, lookahead=CSV_LOOKAHEAD, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encodes documents as CSV, byte-compatible with pandas.json_normalize
+    followed by to_csv(index=False, quoting=csv.QUOTE_NONNUMERIC), yielding
+    text chunks of about chunk_size characters.
+
+    Columns and their types are decided from the first ``lookahead``
+    documents (all of them when None), the rest are encoded as they are read.
+    Columns that only show up after the lookahead are left out. A single
+    document, given as a dict, is encoded as a single row.
+    """
+    if isinstance(docs, dict):
+        docs = [docs]
+    docs = iter(docs)
+    head = [flatten(doc) for doc in itertools.islice(docs, lookahead)]
+    columns = list(dict.fromkeys(key for row in head for key in row))
+    # columns whose values may need fixing: ints written as floats in float
+    # columns, and NaN written as an empty string, as pandas does
+    fixes = []
+    for index, column in enumerate(columns):
+        kind = _column_kind([row.get(column) for row in head])
+        if kind != 'plain':
+            fixes.append((index, kind == 'float'))
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n')
+    writer.writerow(columns)
+    for row in itertools.chain(head, map(flatten, docs)):
+        get = row.get
+        values = [get(column) for column in columns]
+        for index, to_float in fixes:
+            value = values[index]
+            if value.__class__ is float:
+                if value != value:
+                    values[index] = None
+            elif to_float and value.__class__ is int:
+                values[index] = float(value)
+        writer.writerow(values)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_chunks(docs, lookahead=CSV_LOOKAHEAD, chunk_size=STREAM_CHUNK_SIZE):
+    """ Encodes documents as CSV (see csv_text), yielding it in byte chunks """
+    for text in csv_text(docs, lookahead, chunk_size):
+        yield text.encode('utf-8')
+
+
+def ndjson_lines(docs):
+    """ Encodes documents as newline delimited JSON, a line per document """
+    for doc in docs:
+        yield json.dumps(doc) + '\n'
+
+
+def ndjson_chunks(docs, chunk_size=STREAM_CHUNK_SIZE):
+    """ Encodes documents as newline delimited JSON, yielding it in byte chunks """
+    parts = []
+    size = 0
+    for line in ndjson_lines(docs):
+        parts.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+    yield ''.join(parts).encode('utf-8')
+
+
+def _arrow_column(name, values):
+    """
+    Builds an Arrow array from the values of a column. ISO 8601 timestamps
+    become UTC timestamps, and columns mixing types are encoded as strings.
+    """
+    try:
+        array = pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, OverflowError):
+        array = pyarrow.array([value if value is None or isinstance(value, str) else json.dumps(value)
+                               for value in values], type=pyarrow.string())
+    if name == 'ts' and pyarrow.types.is_string(array.type):
+        try:
+            array = pyarrow.compute.cast(array, pyarrow.timestamp('us', tz='UTC'))
+        except pyarrow.ArrowInvalid:
+            pass
+    return array
+
+
+def arrow_stream(docs, batch_size=ARROW_BATCH_SIZE):
+    """
+    Encodes documents as an Arrow IPC stream of a columnar table, with the
+    same flattened columns as CSV
+    """
+    rows = [flatten(doc) for doc in docs]
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    table = pyarrow.Table.from_arrays(
+        [_arrow_column(column, [row.get(column) for row in rows]) for column in columns],
+        names=columns)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=batch_size)
+    return sink.getvalue().to_pybytes()
+
+
+def stream_array(request, docs):
+    """
+    Streams documents in the format accepted by the client. Binary formats
+    are encoded once every document has been read.
+    """
+    media = media_type(request)
+    if media == JSON:
+        return json_array_chunks(docs)
+    elif media == CSV:
+        return csv_chunks(docs)
+    elif media == NDJSON:
+        return ndjson_chunks(docs)
+    elif media == MSGPACK:
+        return iter([msgpack.packb(list(docs))])
+    return iter([arrow_stream(docs)])
+
+
+def stream_map(request, items, parser):
+    """
+    Streams (key, value) pairs as a JSON object, a pair at a time. Other
+    formats get the rows the parser makes of each value, one after the
+    other; msgpack is encoded once every pair has been read.
+    """
+    media = media_type(request)
+    if media == JSON:
+        return json_map_chunks(items)
+    elif media == MSGPACK:
+        return iter([msgpack.packb(dict(items))])
+    return stream_array(request, itertools.chain.from_iterable(parser({key: value}) for key, value in items))
+
+
+def stream_groups(request, items):
+    """
+    Streams (key, documents) pairs as a JSON object of arrays (a map, in
+    msgpack) or, for the row formats, as the rows of every group one after
+    the other
+    """
+    media = media_type(request)
+    if media == JSON:
+        return json_object_chunks(items)
+    elif media == MSGPACK:
+        return iter([msgpack.packb({key: list(docs) for key, docs in items})])
+    return stream_array(request, itertools.chain.from_iterable(docs for _, docs in items))
+
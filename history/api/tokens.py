@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Parsing of the JWT sent by clients, and a cache of parsed tokens so that
+clients repeating the same token do not pay for decoding it again
+"""
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from .. import conf, Logger
+
+logger = Logger.Log(conf.log_level).color_log()
+
+
+def decode_base64(data):
+    """
+        Decode base64, padding being optional. Both the standard and the URL
+        safe alphabets, the latter used by JWT, are accepted.
+        :param data: Base64 data as an ASCII string
+        :returns: The decoded byte string.
+    """
+    missing_padding = len(data) % 4
+    if missing_padding != 0:
+        data += '=' * (4 - missing_padding)
+    return base64.urlsafe_b64decode(data.encode('utf-8'))
+
+
+def parse(token):
+    """
+    Parses the payload of a JWT. The signature is not verified.
+
+    :returns: the payload, or None if the token is not valid
+    """
+    if not token:
+        return None
+    try:
+        data = json.loads(decode_base64(token.split('.')[1]))
+        if not isinstance(data, dict) or 'service' not in data:
+            raise ValueError('Token has no service')
+        return data
+    except Exception as exception:
+        logger.error(exception)
+        return None
+
+
+class TokenCache(object):
+    """
+    Bounded LRU cache from token to the service it was issued for.
+
+    Entries are dropped at the token "exp" claim, or ``ttl`` seconds after
+    being parsed when the token has none. Invalid tokens are not cached.
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or conf.auth_token_cache_size
+        self.ttl = conf.auth_token_cache_ttl if ttl is None else ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        """ Returns the service of a token, or None if it is not valid """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is not None:
+                service, expires = entry
+                if now < expires:
+                    self.entries.move_to_end(token)
+                    self.hits += 1
+                    return service
+                del self.entries[token]
+            self.misses += 1
+
+        data = parse(token)
+        if data is None:
+            return None
+        expires = now + self.ttl
+        if isinstance(data.get('exp'), (int, float)):
+            expires = min(expires, data['exp'])
+        if now < expires:
+            with self.lock:
+                self.entries[token] = (data['service'], expires)
+                self.entries.move_to_end(token)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return data['service']
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+cache = TokenCache()
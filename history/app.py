@@ -6,17 +6,23 @@ App runner
 # System imports
 # Third-party imports
 import falcon
+from pymongo.errors import ExecutionTimeout
 
 # Local imports
 from history import conf, Logger
-from history.api.models import DeviceHistory, STHHistory, AuthMiddleware, NotificationHistory, LoggingInterface
+from history.api.compression import CompressionMiddleware
+from history.api.models import BulkHistory, DeviceHistory, DeviceSummary, HistoryUtil, LatestValues, STHHistory, AuthMiddleware, NotificationHistory, LoggingInterface
 
 #init logger
 logger = Logger.Log(conf.log_level).color_log()
 
 # Create falcon app
-app = falcon.API(middleware=[AuthMiddleware()])
+app = falcon.API(middleware=[AuthMiddleware(), CompressionMiddleware()])
+app.add_error_handler(ExecutionTimeout, HistoryUtil.handle_timeout)
 app.add_route('/device/{device_id}/history', DeviceHistory())
+app.add_route('/device/{device_id}/summary', DeviceSummary())
+app.add_route('/devices/history', BulkHistory())
+app.add_route('/latest', LatestValues())
 app.add_route('/notifications/history', NotificationHistory())
 app.add_route('/STH/v1/contextEntities/type/{device_type}/id/{device_id}/attributes/{attr}', STHHistory())
 app.add_route('/log', LoggingInterface())
@@ -0,0 +1,169 @@
+"""
+Bucketed time-series layout: instead of one document per sample, samples of a
+device attribute are appended to a bucket document per time window.
+
+    {
+        "attr": "temperature",
+        "device_id": "b374a5",
+        "ts": <window start>,
+        "count": 2,
+        "samples": {"ts": [<ts>, <ts>], "value": [21.5, 21.7]},
+        "metadata": {...}
+    }
+
+Bucket documents keep "attr" and "ts" (the window start) so the existing
+(attr, ts) and TTL indexes apply to them unchanged.
+"""
+import itertools
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne, DESCENDING
+from . import conf, mongo
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def is_enabled():
+    """ Whether samples are stored in bucket documents """
+    return conf.db_storage_mode == 'bucket'
+
+
+def as_utc(ts):
+    """ Converts a datetime to a naive UTC datetime, as returned by pymongo """
+    if ts.tzinfo is not None:
+        return ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def window_start(ts, window=None):
+    """
+    Returns the start of the bucket window a timestamp belongs to
+
+    :type ts: datetime
+    :param ts: sample timestamp
+
+    :type window: int
+    :param window: window length, in seconds
+    """
+    window = window or conf.db_bucket_window
+    seconds = (as_utc(ts) - EPOCH).total_seconds()
+    return EPOCH + timedelta(seconds=seconds // window * window)
+
+
+def sample_update(attr, device_id, ts, value, metadata):
+    """
+    Builds the upsert that appends a sample to its bucket. A full bucket
+    does not match the filter, so a new bucket for the same window is created.
+    """
+    return UpdateOne(
+        {'attr': attr, 'ts': window_start(ts), 'count': {'$lt': conf.db_bucket_max_samples}},
+        {
+            '$push': {'samples.ts': ts, 'samples.value': value},
+            '$inc': {'count': 1},
+            '$set': {'device_id': device_id, 'metadata': metadata}
+        },
+        upsert=True)
+
+
+def find(collection, query):
+    """
+    Runs a DeviceHistory query against bucket documents, returning the
+    matching samples as regular history documents
+
+    :type query: dict
+    :param query: query as built by DeviceHistory.parse_request
+    """
+    bucket_query = dict(query['query'])
+    value_filter = bucket_query.pop('value', None)
+    ts_filter = bucket_query.pop('ts', {})
+    lower = as_utc(ts_filter['$gte']) if '$gte' in ts_filter else None
+    upper = as_utc(ts_filter['$lte']) if '$lte' in ts_filter else None
+
+    bucket_ts = {}
+    if lower is not None:
+        bucket_ts['$gte'] = window_start(lower)
+    if upper is not None:
+        bucket_ts['$lte'] = upper
+    if bucket_ts:
+        bucket_query['ts'] = bucket_ts
+
+    projection = query['filter']
+    if query.get('fields'):
+        # selected fields are picked from the samples once they are unpacked
+        projection = dict(projection, samples=True, value=True)
+    descending = query['sort'][0][1] == DESCENDING
+    cursor = mongo.max_time(collection.find(bucket_query, projection, sort=query['sort']))
+    skipped = value_filter['$ne'] if value_filter else None
+    samples = unpack(cursor, descending)
+    samples = (s for s in samples
+               if (lower is None or s['ts'] >= lower)
+               and (upper is None or s['ts'] <= upper)
+               and (skipped is None or s['value'] != skipped))
+    if query['limit']:
+        samples = itertools.islice(samples, query['limit'])
+    return samples
+
+
+def unpack(cursor, descending=True):
+    """
+    Expands bucket documents, sorted by window, into one document per sample.
+    Buckets sharing a window are merged, and documents written before the
+    bucket layout was enabled are passed through.
+    """
+    for _, docs in itertools.groupby(cursor, key=lambda doc: doc['ts']):
+        expanded = []
+        for doc in docs:
+            samples = doc.get('samples')
+            if samples is None:
+                expanded.append(doc)
+                continue
+            for ts, value in zip(samples['ts'], samples['value']):
+                expanded.append({
+                    'attr': doc['attr'],
+                    'value': value,
+                    'device_id': doc.get('device_id'),
+                    'ts': ts,
+                    'metadata': doc.get('metadata', {})
+                })
+        expanded.sort(key=lambda doc: doc['ts'], reverse=descending)
+        for doc in expanded:
+            yield doc
+
+
+def sample_stages(match):
+    """
+    Aggregation stages that turn the bucket documents matching a
+    DeviceHistory query into one {attr, ts, value} document per sample, so
+    pipelines written for the document layout run unchanged after them
+
+    :type match: dict
+    :param match: the "query" part of a DeviceHistory query
+    """
+    bucket_match = dict(match)
+    value_filter = bucket_match.pop('value', None)
+    ts_filter = bucket_match.pop('ts', {})
+    bucket_ts = {}
+    if '$gte' in ts_filter:
+        bucket_ts['$gte'] = window_start(ts_filter['$gte'])
+    if '$lte' in ts_filter:
+        bucket_ts['$lte'] = as_utc(ts_filter['$lte'])
+    if bucket_ts:
+        bucket_match['ts'] = bucket_ts
+
+    sample_match = {}
+    if ts_filter:
+        sample_match['ts'] = ts_filter
+    if value_filter is not None:
+        sample_match['value'] = value_filter
+
+    return [
+        {'$match': bucket_match},
+        # documents written before the bucket layout hold a single sample
+        {'$project': {
+            'attr': 1,
+            'ts': {'$ifNull': ['$samples.ts', ['$ts']]},
+            'value': {'$ifNull': ['$samples.value', ['$value']]}
+        }},
+        {'$unwind': {'path': '$ts', 'includeArrayIndex': 'index'}},
+        {'$project': {'attr': 1, 'ts': 1, 'value': {'$arrayElemAt': ['$value', '$index']}}},
+        {'$match': sample_match}
+    ]
@@ -0,0 +1,59 @@
+"""
+Catalog of the device attributes that have data. The persister keeps one
+document per tenant, device and attribute in a single collection:
+
+    {
+        "tenant": "admin",
+        "device_id": "b374a5",
+        "attr": "temperature",
+        "first_ts": <oldest sample>,
+        "last_ts": <newest sample>,
+        "count": 1234
+    }
+
+so the API can list the attributes of a device, or tell that an attribute
+never got any data, without asking device-manager or scanning the device
+collection. Entries are not expired along with the samples they describe.
+"""
+from pymongo import ASCENDING, UpdateOne
+from . import conf, mongo
+from .buckets import as_utc
+
+
+def is_enabled():
+    """ Whether the persister keeps the attribute catalog """
+    return bool(conf.db_catalog_collection)
+
+
+def entry_update(tenant, device_id, attr, first_ts, last_ts, count):
+    """
+    Builds the upsert that merges samples seen by the persister into the
+    catalog entry of a device attribute
+    """
+    return UpdateOne(
+        {'tenant': tenant, 'device_id': device_id, 'attr': attr},
+        {
+            '$min': {'first_ts': as_utc(first_ts)},
+            '$max': {'last_ts': as_utc(last_ts)},
+            '$inc': {'count': count}
+        },
+        upsert=True)
+
+
+def create_indexes(db):
+    db[conf.db_catalog_collection].create_index(
+        [('tenant', ASCENDING), ('device_id', ASCENDING), ('attr', ASCENDING)], unique=True)
+
+
+def lookup(db, tenant, device_id):
+    """
+    Returns the catalog entries of a device
+
+    :rtype: dict
+    :returns: attribute to {first_ts, last_ts, count}, empty when the device
+        has no entries
+    """
+    cursor = mongo.max_time(db[conf.db_catalog_collection].find(
+        {'tenant': tenant, 'device_id': device_id},
+        {'_id': False, 'tenant': False, 'device_id': False}))
+    return {entry.pop('attr'): entry for entry in cursor}
@@ -10,14 +10,84 @@ import os
 
 # Logger related configuration
 log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
+# write logs from a background thread instead of the calling one
+log_async = os.environ.get("LOG_ASYNC", "False").lower() in ("yes", "true", "t", "1")
+log_queue_size = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+# maximum records per second from a single log call site (0 means no limit)
+log_rate_limit = int(os.environ.get("LOG_RATE_LIMIT", 0))
 
 # mongo related configuration
 db_address = os.environ.get("HISTORY_DB_ADDRESS", "mongodb")
 db_port = os.environ.get("HISTORY_DB_PORT", 27017)
 db_host = "" + db_address + ":" + str(db_port)
 db_replica_set = os.environ.get("HISTORY_DB_REPLICA_SET", None)
+# client pool and timeouts, in milliseconds (0: no timeout)
+db_max_pool_size = int(os.environ.get('HISTORY_DB_MAX_POOL_SIZE', 100))
+db_min_pool_size = int(os.environ.get('HISTORY_DB_MIN_POOL_SIZE', 0))
+db_connect_timeout_ms = int(os.environ.get('HISTORY_DB_CONNECT_TIMEOUT_MS', 20000))
+db_server_selection_timeout_ms = int(os.environ.get('HISTORY_DB_SERVER_SELECTION_TIMEOUT_MS', 30000))
+db_socket_timeout_ms = int(os.environ.get('HISTORY_DB_SOCKET_TIMEOUT_MS', 0))
+db_wait_queue_timeout_ms = int(os.environ.get('HISTORY_DB_WAIT_QUEUE_TIMEOUT_MS', 0))
+# where the API reads from: "primary", "primaryPreferred", "secondary",
+# "secondaryPreferred" or "nearest"; the persister always uses the primary
+db_read_preference = os.environ.get('HISTORY_DB_READ_PREFERENCE', 'secondaryPreferred')
+# how far behind the primary, in seconds, a secondary may be to serve reads
+# (0: no limit, otherwise at least 90)
+db_max_staleness = int(os.environ.get('HISTORY_DB_MAX_STALENESS_SECONDS', 0))
+# read concern level of the API reads (empty: server default)
+db_read_concern = os.environ.get('HISTORY_DB_READ_CONCERN', '')
+# server time limit of each API query, in milliseconds (0: no limit)
+db_max_time_ms = int(os.environ.get('HISTORY_DB_MAX_TIME_MS', 30000))
 db_expiration = os.environ.get('HISTORY_DB_DATA_EXPIRATION', 604800)
 db_shard = os.environ.get('MONGO_SHARD', False)
+# "document" stores one document per sample, "bucket" appends samples to one
+# document per device attribute and time window
+db_storage_mode = os.environ.get('HISTORY_DB_STORAGE_MODE', 'document').lower()
+db_bucket_window = int(os.environ.get('HISTORY_DB_BUCKET_WINDOW', 3600))
+db_bucket_max_samples = int(os.environ.get('HISTORY_DB_BUCKET_MAX_SAMPLES', 1000))
+# collection where the persister catalogs which device attributes have data
+# (empty disables the catalog)
+db_catalog_collection = os.environ.get('HISTORY_DB_CATALOG', 'catalog')
+# collection where the persister keeps the latest value of every device
+# attribute (empty disables it)
+db_latest_collection = os.environ.get('HISTORY_DB_LATEST', 'latest')
+# seconds a collection known to exist is not looked up again
+collection_cache_ttl = float(os.environ.get('HISTORY_COLLECTION_CACHE_TTL', 300))
+# stream JSON responses straight from the database cursor
+api_stream_responses = os.environ.get('HISTORY_STREAM_RESPONSES', 'False').lower() in ('yes', 'true', 't', '1')
+# threads fetching the devices of a bulk history request, and how many
+# devices a single request may ask for
+api_bulk_workers = int(os.environ.get('HISTORY_BULK_WORKERS', 8))
+api_bulk_max_devices = int(os.environ.get('HISTORY_BULK_MAX_DEVICES', 500))
+# threads running the per-attribute finds of limited multi-attribute requests
+api_attr_workers = int(os.environ.get('HISTORY_ATTR_WORKERS', 8))
+# largest page a paginated history request may ask for
+api_max_page_size = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 10000))
+
+# persister write buffer configuration
+persister_batch_size = int(os.environ.get('PERSISTER_BATCH_SIZE', 500))
+persister_flush_interval = float(os.environ.get('PERSISTER_FLUSH_INTERVAL', 1.0))
+
+# persister pipeline configuration: threads of each stage and size of the
+# queue feeding it
+persister_queue_size = int(os.environ.get('PERSISTER_QUEUE_SIZE', 1000))
+persister_data_workers = int(os.environ.get('PERSISTER_DATA_WORKERS', 2))
+persister_device_workers = int(os.environ.get('PERSISTER_DEVICE_WORKERS', 1))
+persister_notification_workers = int(os.environ.get('PERSISTER_NOTIFICATION_WORKERS', 1))
+persister_writer_workers = int(os.environ.get('PERSISTER_WRITER_WORKERS', 4))
+persister_writer_queue_size = int(os.environ.get('PERSISTER_WRITER_QUEUE_SIZE', 16))
+
+# local spool for writes that fail while MongoDB is unreachable (an empty
+# directory disables it); it must be on a volume that outlives the container,
+# e.g. /var/lib/persister/spool. Replay rate is in batches per second; a batch
+# failing for reasons other than connectivity is dropped after the given attempts
+persister_spool_dir = os.environ.get('PERSISTER_SPOOL_DIR', '')
+persister_spool_segment_size = int(os.environ.get('PERSISTER_SPOOL_SEGMENT_SIZE', 64 * 1024 * 1024))
+persister_spool_replay_rate = float(os.environ.get('PERSISTER_SPOOL_REPLAY_RATE', 10))
+persister_spool_replay_attempts = int(os.environ.get('PERSISTER_SPOOL_REPLAY_ATTEMPTS', 5))
+
+# background index creation configuration
+persister_index_workers = int(os.environ.get('PERSISTER_INDEX_WORKERS', 4))
 
 # Kafka configuration
 kafka_address = os.environ.get("KAFKA_ADDRESS", "kafka")
@@ -51,3 +121,18 @@ data_broker_url = os.environ.get("DATA_BROKER_URL", "http://data-broker")
 auth_url = os.environ.get('AUTH_URL', "http://auth:5000")
 # device-manager URL
 device_manager_url = os.environ.get('DEVICE_MANAGER_URL', "http://device-manager:5000")
+device_manager_timeout = float(os.environ.get('DEVICE_MANAGER_TIMEOUT', 5))
+device_manager_pool_size = int(os.environ.get('DEVICE_MANAGER_POOL_SIZE', 10))
+# cache of device attributes retrieved from device-manager; expired entries
+# are still served for DEVICE_ATTRS_CACHE_STALE_TTL seconds while refreshed
+device_attrs_cache_size = int(os.environ.get('DEVICE_ATTRS_CACHE_SIZE', 10000))
+device_attrs_cache_ttl = float(os.environ.get('DEVICE_ATTRS_CACHE_TTL', 60))
+device_attrs_cache_stale_ttl = float(os.environ.get('DEVICE_ATTRS_CACHE_STALE_TTL', 300))
+# content codings responses may be compressed with, by preference (empty
+# disables compression), and the smallest body worth compressing
+api_compression = os.environ.get('HISTORY_COMPRESSION', 'zstd,gzip')
+api_compression_min_size = int(os.environ.get('HISTORY_COMPRESSION_MIN_SIZE', 1024))
+# parsed auth tokens kept in memory, and for how long (in seconds) those
+# without an "exp" claim are kept
+auth_token_cache_size = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))
+auth_token_cache_ttl = float(os.environ.get('AUTH_TOKEN_CACHE_TTL', 300))
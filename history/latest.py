@@ -0,0 +1,122 @@
+"""
+Latest value of every device attribute. The persister keeps one document per
+tenant and device in a single collection:
+
+    {
+        "tenant": "admin",
+        "device_id": "b374a5",
+        "attrs": {
+            "temperature": {"ts": <sample time>, "value": 23.4, "metadata": {}}
+        }
+    }
+
+Each attribute is written with $max, which compares embedded documents field
+by field, so the sample with the newest "ts" wins whatever order events are
+persisted in. This lets the API answer lastN=1 and tenant-wide snapshots with
+a single indexed read instead of a sorted find per attribute.
+
+Attribute names that cannot be used in a field path (containing "." or
+starting with "$") are only kept in the history.
+"""
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, UpdateOne
+from . import conf, mongo
+from .buckets import as_utc
+
+
+def is_enabled():
+    """ Whether the persister keeps the latest values """
+    return bool(conf.db_latest_collection)
+
+
+def value_update(tenant, device_id, attrs, ts, metadata):
+    """
+    Builds the upsert that merges the samples of an event into the latest
+    values of a device
+
+    :type attrs: dict
+    :param attrs: attribute name to value
+    :returns: the UpdateOne, or None if no attribute can be stored
+    """
+    ts = as_utc(ts)
+    newest = {}
+    for attr, value in attrs.items():
+        # the history API never returns blank values
+        if '.' in attr or attr.startswith('$') or value == ' ':
+            continue
+        newest['attrs.' + attr] = {'ts': ts, 'value': value, 'metadata': metadata}
+    if not newest:
+        return None
+    return UpdateOne({'tenant': tenant, 'device_id': device_id}, {'$max': newest}, upsert=True)
+
+
+def create_indexes(db):
+    db[conf.db_latest_collection].create_index(
+        [('tenant', ASCENDING), ('device_id', ASCENDING)], unique=True)
+
+
+def _as_history(device_id, attr, entry):
+    return {
+        'attr': attr,
+        'value': entry['value'],
+        'device_id': device_id,
+        'ts': entry['ts'],
+        'metadata': entry.get('metadata', {})
+    }
+
+
+def _unexpired(device_id, attrs, oldest):
+    return {attr: _as_history(device_id, attr, entry) for attr, entry in attrs.items()
+            if entry['ts'] >= oldest}
+
+
+def _oldest():
+    # values the history already expired are not served either
+    return datetime.utcnow() - timedelta(seconds=int(conf.db_expiration))
+
+
+def lookup(db, tenant, device_id):
+    """
+    Returns the latest values of a device, shaped as history documents
+
+    :rtype: dict
+    :returns: attribute to its latest document, or None when the device has
+        no latest values document
+    """
+    cursor = mongo.max_time(db[conf.db_latest_collection].find(
+        {'tenant': tenant, 'device_id': device_id}, {'_id': False, 'attrs': True}, limit=1))
+    doc = next(iter(cursor), None)
+    if doc is None:
+        return None
+    return _unexpired(device_id, doc.get('attrs', {}), _oldest())
+
+
+def lookup_many(db, tenant, device_ids):
+    """
+    Returns the latest values of several devices, in a single find
+
+    :rtype: dict
+    :returns: device id to {attribute: latest document}, leaving out devices
+        with no latest values document
+    """
+    cursor = mongo.max_time(db[conf.db_latest_collection].find(
+        {'tenant': tenant, 'device_id': {'$in': list(device_ids)}},
+        {'_id': False, 'device_id': True, 'attrs': True}))
+    oldest = _oldest()
+    return {doc['device_id']: _unexpired(doc['device_id'], doc.get('attrs', {}), oldest)
+            for doc in cursor}
+
+
+def snapshot(db, tenant):
+    """
+    Returns the latest values of every device of a tenant
+
+    :rtype: dict
+    :returns: device id to {attribute: latest document}
+    """
+    cursor = mongo.max_time(db[conf.db_latest_collection].find(
+        {'tenant': tenant}, {'_id': False, 'device_id': True, 'attrs': True},
+        sort=[('device_id', ASCENDING)]))
+    oldest = _oldest()
+    return {doc['device_id']: _unexpired(doc['device_id'], doc.get('attrs', {}), oldest)
+            for doc in cursor}
@@ -0,0 +1,81 @@
+"""
+MongoDB clients. Every client shares the pool and timeout settings; the API
+one also routes its reads by the configured read preference and read concern,
+so history queries can be served by secondaries instead of the primary the
+persister writes to. API queries are bounded by maxTimeMS.
+
+Options the installed driver does not know, such as minPoolSize and
+maxStalenessSeconds on the pinned PyMongo 3.2, are left out with a warning,
+as the client would refuse to be created.
+"""
+import pymongo
+import pymongo.common
+from . import conf, Logger
+
+logger = Logger.Log(conf.log_level).color_log()
+
+
+def supports(option):
+    """ Whether the installed driver knows a client option """
+    return option.lower() in pymongo.common.VALIDATORS
+
+
+def _set_if_supported(options, option, value, setting):
+    if supports(option):
+        options[option] = value
+    else:
+        logger.warning('%s needs a newer PyMongo than %s, ignoring it', setting, pymongo.version)
+
+
+def client_options():
+    """ Pool and timeout options of every client """
+    options = {
+        'maxPoolSize': conf.db_max_pool_size,
+        'connectTimeoutMS': conf.db_connect_timeout_ms,
+        'serverSelectionTimeoutMS': conf.db_server_selection_timeout_ms
+    }
+    if conf.db_min_pool_size:
+        _set_if_supported(options, 'minPoolSize', conf.db_min_pool_size, 'HISTORY_DB_MIN_POOL_SIZE')
+    # 0 means no timeout, which is what the driver does when they are not set
+    if conf.db_socket_timeout_ms:
+        options['socketTimeoutMS'] = conf.db_socket_timeout_ms
+    if conf.db_wait_queue_timeout_ms:
+        options['waitQueueTimeoutMS'] = conf.db_wait_queue_timeout_ms
+    return options
+
+
+def read_options():
+    """ Read routing options of the API client """
+    options = {'readPreference': conf.db_read_preference}
+    # the primary is never stale, and the driver rejects the option for it
+    if conf.db_max_staleness > 0 and conf.db_read_preference != 'primary':
+        _set_if_supported(options, 'maxStalenessSeconds', conf.db_max_staleness,
+                          'HISTORY_DB_MAX_STALENESS_SECONDS')
+    if conf.db_read_concern:
+        options['readConcernLevel'] = conf.db_read_concern
+    return options
+
+
+def client(**options):
+    """ Creates a client with the configured pool and timeouts """
+    return pymongo.MongoClient(conf.db_host, replicaSet=conf.db_replica_set,
+                               **dict(client_options(), **options))
+
+
+def reader():
+    """ Creates the client the API reads with """
+    return client(**read_options())
+
+
+def max_time(cursor):
+    """ Bounds the server time of a find cursor by conf.db_max_time_ms """
+    if conf.db_max_time_ms:
+        cursor.max_time_ms(conf.db_max_time_ms)
+    return cursor
+
+
+def command_options():
+    """ Options bounding the server time of an aggregate or command """
+    if conf.db_max_time_ms:
+        return {'maxTimeMS': conf.db_max_time_ms}
+    return {}
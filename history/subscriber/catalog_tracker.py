@@ -0,0 +1,74 @@
+import threading
+from history import catalog, conf, Logger
+from history.buckets import as_utc
+
+LOGGER = Logger.Log(conf.log_level).color_log()
+
+
+class CatalogTracker:
+    """
+    Accumulates the samples seen for each tenant, device and attribute and
+    periodically hands one catalog upsert per attribute to a WriteBuffer, so
+    the catalog costs a write per attribute and interval, not per sample.
+    With an ``index_manager``, the catalog indexes are ensured before the
+    first write.
+    """
+
+    def __init__(self, write_buffer, flush_interval=None, index_manager=None):
+        self.write_buffer = write_buffer
+        self.index_manager = index_manager
+        self.flush_interval = flush_interval or conf.persister_flush_interval
+        self.pending = dict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = None
+
+    def start(self):
+        if self.flusher is None:
+            self.flusher = threading.Thread(
+                target=self._run, name="CatalogFlusher", daemon=True)
+            self.flusher.start()
+
+    def record(self, tenant, device_id, attrs, ts):
+        """
+        Records a sample of each attribute at the given timestamp
+
+        :type attrs: iterable
+        :param attrs: attribute names
+        """
+        ts = as_utc(ts)
+        with self.lock:
+            for attr in attrs:
+                key = (tenant, device_id, attr)
+                entry = self.pending.get(key)
+                if entry is None:
+                    self.pending[key] = [ts, ts, 1]
+                else:
+                    entry[0] = min(entry[0], ts)
+                    entry[1] = max(entry[1], ts)
+                    entry[2] += 1
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, dict()
+        if pending:
+            if self.index_manager is not None:
+                self.index_manager.ensure(conf.db_catalog_collection)
+            self.write_buffer.add_operations(
+                conf.db_catalog_collection,
+                [catalog.entry_update(tenant, device_id, attr, *entry)
+                 for (tenant, device_id, attr), entry in pending.items()])
+
+    def close(self):
+        self.stopped.set()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        self.flush()
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as error:
+                LOGGER.error('Failed to update the attribute catalog: %s', error)
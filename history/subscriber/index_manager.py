@@ -0,0 +1,114 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from history import conf, Logger
+
+LOGGER = Logger.Log(conf.log_level).color_log()
+
+
+class IndexManager:
+    """
+    Creates collection indexes on a background worker pool, remembering which
+    collections were already indexed so that repeated device events cost
+    nothing. A collection whose indexes failed is not retried before its
+    backoff, which doubles on each failure, has elapsed.
+    """
+
+    def __init__(self, create_indexes, workers=None, retry_interval=30.0, max_retry_interval=600.0):
+        """
+        :type create_indexes: callable
+        :param create_indexes: function that creates the indexes of a
+            collection, given its name
+        """
+        self.create_indexes = create_indexes
+        self.workers = workers or conf.persister_index_workers
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.known = set()
+        self.in_flight = dict()
+        self.failures = dict()
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def ensure(self, collection_name):
+        """
+        Queues index creation for a collection, unless it is already indexed,
+        being indexed or backing off after a failure
+
+        :type collection_name: str
+        :param collection_name: collection to create index
+        :returns: the pending future, or None if nothing was queued
+        """
+        with self.lock:
+            if collection_name in self.known:
+                return None
+            failure = self.failures.get(collection_name)
+            if failure is not None and time.monotonic() < failure[1]:
+                return None
+            future = self.in_flight.get(collection_name)
+            if future is None:
+                future = self._get_executor().submit(self._create, collection_name)
+                self.in_flight[collection_name] = future
+            return future
+
+    def create(self, collection_name):
+        """
+        Creates the indexes of a collection in the calling thread
+
+        :type collection_name: str
+        :param collection_name: collection to create index
+        :returns: whether the indexes were created
+        """
+        return self._create(collection_name)
+
+    def bootstrap(self, collection_names):
+        """
+        Creates indexes for several collections in parallel and waits for all
+        of them to finish
+
+        :type collection_names: list
+        :param collection_names: collections to create index
+        """
+        futures = [self.ensure(name) for name in collection_names]
+        wait([future for future in futures if future is not None])
+
+    def wait(self):
+        """
+        Blocks until every queued index creation has finished
+        """
+        with self.lock:
+            futures = list(self.in_flight.values())
+        wait(futures)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def _create(self, collection_name):
+        try:
+            self.create_indexes(collection_name)
+            with self.lock:
+                self.known.add(collection_name)
+                self.failures.pop(collection_name, None)
+            return True
+        except Exception as error:
+            with self.lock:
+                attempts = self.failures.get(collection_name, (0, 0))[0] + 1
+                delay = min(self.retry_interval * 2 ** (attempts - 1), self.max_retry_interval)
+                self.failures[collection_name] = (attempts, time.monotonic() + delay)
+            if attempts == 1:
+                LOGGER.warning('Failed to create indexes for %s, retrying with backoff: %s',
+                               collection_name, error)
+            else:
+                LOGGER.debug('Failed to create indexes for %s (attempt %d): %s',
+                             collection_name, attempts, error)
+            return False
+        finally:
+            with self.lock:
+                self.in_flight.pop(collection_name, None)
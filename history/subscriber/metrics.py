@@ -0,0 +1,180 @@
+"""
+Minimal Prometheus instrumentation for the persister, rendered in the text
+exposition format by MetricsInterface
+"""
+import abc
+import json
+import threading
+from datetime import datetime, timezone
+import falcon
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}={}'.format(name, json.dumps(str(value))) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(abc.ABC):
+
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+    @abc.abstractmethod
+    def samples(self):
+        """ Returns the exposition lines of the metric samples """
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        super().__init__(name, description, labels)
+        self.values = dict()
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        return ['{}{} {}'.format(self.name, _format_labels(self.labels, key), _format_value(value))
+                for key, value in sorted(values.items())]
+
+
+class Gauge(Metric):
+    """
+    Gauge whose values are read, when rendered, from a function returning
+    a dict of {label value: value}. Only single-label gauges are supported.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, description, label):
+        super().__init__(name, description, (label,))
+        self.collect = dict
+
+    def samples(self):
+        return ['{}{} {}'.format(self.name, _format_labels(self.labels, (key,)), _format_value(value))
+                for key, value in sorted(self.collect().items())]
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = dict()
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, _ = self.values.get(self._key(labels), ([0], 0))
+        return sum(counts)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.labels, key, ('le', _format_value(bound))), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _format_labels(self.labels, key), _format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, _format_labels(self.labels, key), cumulative))
+        return lines
+
+
+MESSAGES = Counter(
+    'persister_messages_total', 'Messages received, by handler', ('handler',))
+PARSE_FAILURES = Counter(
+    'persister_parse_failures_total', 'Messages discarded because they could not be parsed', ('handler',))
+WRITE_FAILURES = Counter(
+    'persister_write_failures_total', 'Bulk writes that failed, by writer', ('writer',))
+WRITE_LATENCY = Histogram(
+    'persister_mongo_write_seconds', 'Duration of MongoDB bulk writes', ('writer',))
+BATCH_SIZE = Histogram(
+    'persister_batch_size', 'Operations per MongoDB bulk write', ('writer',),
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+LAG = Histogram(
+    'persister_lag_seconds', 'Time between the oldest event timestamp of a batch and its persistence',
+    ('writer',), buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900))
+SPOOLED = Counter(
+    'persister_spooled_batches_total', 'Failed bulk writes stored in the local spool', ('writer',))
+REPLAYED = Counter(
+    'persister_replayed_batches_total', 'Spooled bulk writes replayed into MongoDB')
+QUEUE_DEPTH = Gauge(
+    'persister_queue_depth', 'Items waiting in each pipeline queue', 'stage')
+
+REGISTRY = [MESSAGES, PARSE_FAILURES, WRITE_FAILURES, WRITE_LATENCY, BATCH_SIZE, LAG,
+            SPOOLED, REPLAYED, QUEUE_DEPTH]
+
+
+def seconds_since(event_time):
+    """
+    Returns the seconds elapsed since an event timestamp
+
+    :type event_time: datetime
+    :param event_time: naive UTC or timezone aware datetime
+    """
+    if event_time.tzinfo is not None:
+        event_time = event_time.astimezone(timezone.utc).replace(tzinfo=None)
+    return (datetime.utcnow() - event_time).total_seconds()
+
+
+def render():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+class MetricsInterface(object):
+    @staticmethod
+    def on_get(req, resp):
+        """
+        Returns the persister metrics in Prometheus text format
+        """
+        resp.content_type = 'text/plain; version=0.0.4'
+        resp.body = render()
+        resp.status = falcon.HTTP_200
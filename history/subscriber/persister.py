@@ -3,12 +3,18 @@ import json
 import falcon
 import time
 import pymongo
-from datetime import datetime
-from dateutil.parser import parse
-from history import conf, Logger
+from history import conf, Logger, buckets, catalog, latest, mongo
+from history.subscriber import timestamps, metrics
+from history.subscriber.catalog_tracker import CatalogTracker
+from history.subscriber.index_manager import IndexManager
+from history.subscriber.pipeline import Pipeline
+from history.subscriber.spool import Spool, Replayer
+from history.subscriber.write_buffer import WriteBuffer
 from dojot.module import Messenger, Config, Auth
 from wsgiref import simple_server  # NOQA
 import os
+import signal
+import sys
 
 LOGGER = Logger.Log(conf.log_level).color_log()
 
@@ -18,6 +24,12 @@ class Persister:
     def __init__(self):
         self.db = None
         self.client = None
+        self.write_buffer = None
+        self.notification_buffer = None
+        self.spool = None
+        self.replayer = None
+        self.catalog = None
+        self.index_manager = IndexManager(self.create_indexes)
 
     def init_mongodb(self, collection_name=None):
         """
@@ -27,14 +39,79 @@ class Persister:
         :param collection_name: collection to create index
         """
         try:
-            self.client = pymongo.MongoClient(
-                conf.db_host, replicaSet=conf.db_replica_set)
+            self.client = mongo.client()
             self.db = self.client['device_history']
+            self.create_unique_indexes()
+            if conf.persister_spool_dir:
+                self.init_spool()
+            # notifications get their own writer, so slow device data
+            # writes do not hold them back
+            self.write_buffer = WriteBuffer(
+                self.db, writers=conf.persister_writer_workers, name="data-writer", spool=self.spool)
+            self.write_buffer.start()
+            self.notification_buffer = WriteBuffer(
+                self.db, writers=1, name="notification-writer", spool=self.spool)
+            self.notification_buffer.start()
+            if catalog.is_enabled():
+                self.catalog = CatalogTracker(self.write_buffer, index_manager=self.index_manager)
+                self.catalog.start()
             if collection_name:
                 self.create_indexes(collection_name)
             LOGGER.info("db initialized")
         except Exception as error:
-            LOGGER.warn("Could not init mongo db client: %s" % error)
+            LOGGER.warning("Could not init mongo db client: %s", error)
+
+    def create_unique_indexes(self):
+        """
+        Builds the unique indexes of the latest values and catalog collections
+        before anything is written to them: concurrent first upserts of a
+        device could otherwise insert duplicates, and the build would then
+        fail for good. If they cannot be built now, the index manager retries
+        them with backoff.
+        """
+        for collection_name, enabled in ((conf.db_latest_collection, latest.is_enabled()),
+                                         (conf.db_catalog_collection, catalog.is_enabled())):
+            if enabled and not self.index_manager.create(collection_name):
+                LOGGER.error("Unique indexes of %s are missing, duplicates may be written to it",
+                             collection_name)
+
+    def init_spool(self):
+        """
+        Opens the local spool and starts replaying it. Without a usable spool
+        directory the persister still runs, only without spooling.
+        """
+        try:
+            self.spool = Spool()
+        except Exception as error:
+            LOGGER.error("Could not open the spool in %s, running without it: %s",
+                         conf.persister_spool_dir, error)
+            return
+        self.replayer = Replayer(self.spool, self.db)
+        self.replayer.start()
+
+    def shutdown(self):
+        """
+        Flushes every buffered write before the persister goes down
+        """
+        if self.catalog is not None:
+            self.catalog.close()
+        for buffer in (self.write_buffer, self.notification_buffer):
+            if buffer is not None:
+                buffer.close()
+        # the catalog flush above may still ask for indexes
+        self.index_manager.shutdown()
+        if self.replayer is not None:
+            self.replayer.stop()
+        if self.spool is not None:
+            self.spool.close()
+
+    def writer_depths(self):
+        """
+        Returns the number of batches waiting for each Mongo writer pool
+        """
+        return {buffer.name: buffer.depth()
+                for buffer in (self.write_buffer, self.notification_buffer)
+                if buffer is not None}
 
     def create_indexes(self, collection_name):
         """
@@ -43,20 +120,28 @@ class Persister:
         :type collection_name: str
         :param collection_name: collection to create index
         """
-        self.db[collection_name].create_index([('ts', pymongo.DESCENDING)])
+        if collection_name == conf.db_catalog_collection:
+            catalog.create_indexes(self.db)
+            return
+        if collection_name == conf.db_latest_collection:
+            latest.create_indexes(self.db)
+            return
+        # _id breaks ties between equal timestamps when paging the history
+        self.db[collection_name].create_index(
+            [('ts', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)])
         self.db[collection_name].create_index(
-            [('attr', pymongo.DESCENDING), ('ts', pymongo.DESCENDING)])
+            [('attr', pymongo.DESCENDING), ('ts', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)])
         self.db[collection_name].create_index(
             'ts', expireAfterSeconds=conf.db_expiration)
 
     def create_indexes_for_notifications(self, tenants):
-        LOGGER.debug(f"Creating indexes for tenants: {tenants}")
-        for tenant in tenants:
-            self.create_index_for_tenant(tenant)
+        LOGGER.debug("Creating indexes for tenants: %s", tenants)
+        self.index_manager.bootstrap(
+            ["{}_{}".format(tenant, "notifications") for tenant in tenants])
 
     def create_index_for_tenant(self, tenant):
         collection_name = "{}_{}".format(tenant, "notifications")
-        self.create_indexes(collection_name)
+        self.index_manager.ensure(collection_name)
 
     def enable_collection_sharding(self, collection_name):
         """
@@ -72,10 +157,11 @@ class Persister:
 
     def parse_message(self, data):
         """
-        Formats message to save in MongoDB
+        Formats a device-manager "configure" event as a device data event
 
         :type data: dict
         :param data: data that will be parsed to a format
+        :rtype: dict
         """
         parsed_message = dict()
         parsed_message['attrs'] = data['data']['attrs']
@@ -88,36 +174,17 @@ class Persister:
 
         parsed_message['metadata']['deviceid'] = data['data']['id']
         parsed_message['metadata']['tenant'] = data['meta']['service']
-        LOGGER.info("new message is: %s" % parsed_message)
-        return json.dumps(parsed_message)
+        LOGGER.debug("new message is: %s", parsed_message)
+        return parsed_message
 
     def parse_datetime(self, timestamp):
         """
         Parses date time
 
-        :type timestamp: string
-        :param timestamp: timestamp
+        :type timestamp: int, float, str or None
+        :param timestamp: epoch (seconds or milliseconds) or date-time string
         """
-        if timestamp is None:
-            return datetime.utcnow()
-        try:
-            val = int(timestamp)
-            if timestamp > ((2**31)-1):
-                return datetime.utcfromtimestamp(val/1000)
-            return datetime.utcfromtimestamp(float(timestamp))
-        except ValueError as error:
-            LOGGER.error(
-                "Failed to parse timestamp ({})\n{}".format(timestamp, error))
-        try:
-            return datetime.utcfromtimestamp(float(timestamp)/1000)
-        except ValueError as error:
-            LOGGER.error(
-                "Failed to parse timestamp ({})\n{}".format(timestamp, error))
-        try:
-            return parse(timestamp)
-        except TypeError as error:
-            raise TypeError(
-                'Timestamp could not be parsed: {}\n{}'.format(timestamp, error))
+        return timestamps.normalize(timestamp)
 
     def handle_event_data(self, tenant, message):
         """
@@ -129,27 +196,43 @@ class Persister:
             :type message: str
             :param message: A device data event
         """
+        metrics.MESSAGES.inc(handler='device_data')
         data = None
         try:
             data = json.loads(message)
-            LOGGER.info("Received data: %s" % data)
         except Exception as error:
+            metrics.PARSE_FAILURES.inc(handler='device_data')
             LOGGER.error(
                 'Received event is not valid JSON. Ignoring.\n%s', error)
             return
         LOGGER.debug('got data event %s', message)
+        self.ingest_event_data(tenant, data)
+
+    def ingest_event_data(self, tenant, data):
+        """
+            Given an already parsed device data event, persist it to mongo
+
+            :type tenant: str
+            :param tenant: tenant related to the event
+
+            :type data: dict
+            :param data: A device data event, with "attrs" and "metadata"
+        """
         metadata = data.get('metadata', None)
         if metadata is None:
+            metrics.PARSE_FAILURES.inc(handler='device_data')
             LOGGER.error(
                 'Received event has no metadata associated with it. Ignoring')
             return
         device_id = metadata.get('deviceid', None)
         if device_id is None:
+            metrics.PARSE_FAILURES.inc(handler='device_data')
             LOGGER.error(
                 'Received event cannot be traced to a valid device. Ignoring')
             return
         attrs = data.get('attrs', None)
         if attrs is None:
+            metrics.PARSE_FAILURES.inc(handler='device_data')
             LOGGER.error(
                 'Received event has no attrs associated with it. Ignoring')
             return
@@ -162,24 +245,44 @@ class Persister:
             del metadata['tenant']
         docs = []
         if type(data["attrs"]) is dict:
-            for attr in data.get('attrs', {}).keys():
-                docs.append({
-                    'attr': attr,
-                    'value': data['attrs'][attr],
-                    'device_id': device_id,
-                    'ts': timestamp,
-                    'metadata': metadata
-                })
+            if buckets.is_enabled():
+                for attr in data.get('attrs', {}).keys():
+                    docs.append(buckets.sample_update(
+                        attr, device_id, timestamp, data['attrs'][attr], metadata))
+            else:
+                for attr in data.get('attrs', {}).keys():
+                    docs.append({
+                        'attr': attr,
+                        'value': data['attrs'][attr],
+                        'device_id': device_id,
+                        'ts': timestamp,
+                        'metadata': metadata
+                    })
             if docs:
                 try:
                     collection_name = "{}_{}".format(tenant, device_id)
-                    self.db[collection_name].insert_many(docs)
+                    # devices created before the paging indexes existed only
+                    # get them here, on their first write
+                    self.index_manager.ensure(collection_name)
+                    if buckets.is_enabled():
+                        self.write_buffer.add_operations(collection_name, docs, timestamp)
+                    else:
+                        self.write_buffer.add(collection_name, docs, timestamp)
+                    if self.catalog is not None:
+                        self.catalog.record(tenant, device_id, data['attrs'].keys(), timestamp)
+                    if latest.is_enabled():
+                        update = latest.value_update(
+                            tenant, device_id, data['attrs'], timestamp, metadata)
+                        if update is not None:
+                            self.index_manager.ensure(conf.db_latest_collection)
+                            self.write_buffer.add_operations(
+                                conf.db_latest_collection, [update], timestamp)
                 except Exception as error:
-                    LOGGER.warn(
+                    LOGGER.warning(
                         'Failed to persist received information.\n%s', error)
         else:
             LOGGER.warning(
-                f"Expected attribute dictionary, got {type(data['attrs'])}")
+                "Expected attribute dictionary, got %s", type(data['attrs']))
             LOGGER.warning("Bailing out")
 
     def handle_event_devices(self, tenant, message):
@@ -193,34 +296,40 @@ class Persister:
             :type message: str
             :param message Device lifecyle message, as produced by device manager
         """
+        metrics.MESSAGES.inc(handler='devices')
         try:
             data = json.loads(message)
-            LOGGER.info('got device event %s', data)
+            LOGGER.info('got device event %s for device %s',
+                        data.get('event'), data.get('data', {}).get('id'))
+            LOGGER.debug('device event %s', data)
             if data['event'] == 'create' or data['event'] == 'update':
                 if "meta" in data and "data" in data:
                     collection_name = "{}_{}".format(
                         data['meta']['service'], data['data']['id'])
-                    self.create_indexes(collection_name)
+                    self.index_manager.ensure(collection_name)
             elif data['event'] == 'configure':
-                new_message = self.parse_message(data)
-                self.handle_event_data(tenant, new_message)
+                self.ingest_event_data(tenant, self.parse_message(data))
         except Exception as error:
+            metrics.PARSE_FAILURES.inc(handler='devices')
             LOGGER.warning('Failed to persist device event: %s', error)
 
     def handle_new_tenant(self, tenant, message):
+        metrics.MESSAGES.inc(handler='tenancy')
         data = json.loads(message)
         new_tenant = data['tenant']
         LOGGER.debug(
-            f"Received a new tenant: {new_tenant}. Will create index for it.")
+            "Received a new tenant: %s. Will create index for it.", new_tenant)
         self.create_index_for_tenant(new_tenant)
 
     def handle_notification(self, tenant, message):
+        metrics.MESSAGES.inc(handler='notifications')
         try:
             notification = json.loads(message)
             LOGGER.debug(
-                f"Received a notification: {notification}. Will check if it will be persisted.")
+                "Received a notification: %s. Will check if it will be persisted.", notification)
         except Exception as error:
-            LOGGER.debug(f"Invalid JSON: {error}")
+            metrics.PARSE_FAILURES.inc(handler='notifications')
+            LOGGER.debug("Invalid JSON: %s", error)
             return
         notification['ts'] = self.parse_datetime(notification.get("timestamp"))
         del notification['timestamp']
@@ -229,9 +338,10 @@ class Persister:
                 LOGGER.debug("Notification should be persisted.")
                 try:
                     collection_name = "{}_{}".format(tenant, "notifications")
-                    self.db[collection_name].insert_one(notification)
+                    self.notification_buffer.add(
+                        collection_name, [notification], notification['ts'])
                 except Exception as error:
-                    LOGGER.debug(f"Failed to persist notification:\n{error}")
+                    LOGGER.debug("Failed to persist notification:\n%s", error)
             else:
                 LOGGER.debug(
                     f"Notification should not be persisted. Discarding it.")
@@ -280,27 +390,40 @@ def str2_bool(v):
     return v.lower() in ("yes", "true", "t", "1")
 
 
-def start_dojot_messenger(config, persister, dojot_persist_notifications_only):
+def stage_callback(pipeline, name, handler, workers):
+    """
+    Returns the messenger callback for a handler: the handler itself or, when
+    a pipeline is given, the enqueueing side of a new stage running it.
+    """
+    if pipeline is None:
+        return handler
+    return pipeline.add_stage(name, handler, workers).put
+
+
+def start_dojot_messenger(config, persister, dojot_persist_notifications_only, pipeline=None):
 
     messenger = Messenger("Persister", config)
     messenger.init()
 
     messenger.create_channel("dojot.notifications", "r")
-    messenger.on(config.dojot['subjects']['tenancy'],
-                 "message", persister.handle_new_tenant)
+    messenger.on(config.dojot['subjects']['tenancy'], "message",
+                 stage_callback(pipeline, "tenancy", persister.handle_new_tenant, 1))
     LOGGER.info("Listen to tenancy events")
     messenger.on("dojot.notifications", "message",
-                 persister.handle_notification)
+                 stage_callback(pipeline, "notifications", persister.handle_notification,
+                                conf.persister_notification_workers))
     LOGGER.info('Listen to notification events')
     
     if str2_bool(dojot_persist_notifications_only) != True:
 
         messenger.create_channel(config.dojot['subjects']['devices'], "r")
         messenger.create_channel(config.dojot['subjects']['device_data'], "r")
-        messenger.on(config.dojot['subjects']['devices'],
-                     "message", persister.handle_event_devices)
-        messenger.on(config.dojot['subjects']['device_data'],
-                     "message", persister.handle_event_data)
+        messenger.on(config.dojot['subjects']['devices'], "message",
+                     stage_callback(pipeline, "devices", persister.handle_event_devices,
+                                    conf.persister_device_workers))
+        messenger.on(config.dojot['subjects']['device_data'], "message",
+                     stage_callback(pipeline, "device_data", persister.handle_event_data,
+                                    conf.persister_data_workers))
         LOGGER.info("Listen to devices events")
 
 
@@ -318,16 +441,24 @@ def main():
     LOGGER.debug("... persister was successfully initialized.")
     LOGGER.debug("Initializing dojot messenger...")
 
+    pipeline = Pipeline()
     start_dojot_messenger(
-        config, persister, conf.dojot_persist_notifications_only)
+        config, persister, conf.dojot_persist_notifications_only, pipeline)
     LOGGER.debug("... dojot messenger was successfully initialized.")
 
     # Create falcon app
     app = falcon.API()
     app.add_route('/persister/log', LoggingInterface())
+    app.add_route('/persister/metrics', metrics.MetricsInterface())
+    metrics.QUEUE_DEPTH.collect = lambda: dict(pipeline.depths(), **persister.writer_depths())
     httpd = simple_server.make_server(
         '0.0.0.0', os.environ.get("PERSISTER_PORT", 8057), app)
-    httpd.serve_forever()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        httpd.serve_forever()
+    finally:
+        pipeline.stop()
+        persister.shutdown()
 
 
 if __name__ == "__main__":
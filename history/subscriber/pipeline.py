@@ -0,0 +1,93 @@
+import queue
+import threading
+from history import conf, Logger
+
+LOGGER = Logger.Log(conf.log_level).color_log()
+
+
+class Stage:
+    """
+    A bounded queue drained by a pool of worker threads. Putting work into a
+    full stage blocks the caller, which is how backpressure reaches the Kafka
+    consumer.
+    """
+
+    def __init__(self, name, handler, workers=1, queue_size=None):
+        """
+        :type name: str
+        :param name: stage name, used for thread names and metrics
+
+        :type handler: callable
+        :param handler: function called with the arguments given to put()
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = queue.Queue(queue_size or conf.persister_queue_size)
+        self.threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name="{}-{}".format(self.name, index), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, *args):
+        """
+        Enqueues a call to the stage handler, blocking while the queue is full
+        """
+        self.queue.put(args)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stop(self):
+        """
+        Processes whatever is queued and stops the workers
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _run(self):
+        while True:
+            args = self.queue.get()
+            if args is None:
+                return
+            try:
+                self.handler(*args)
+            except Exception as error:
+                LOGGER.error('Stage %s failed to process an item: %s', self.name, error)
+
+
+class Pipeline:
+    """
+    Set of stages fed by the dojot messenger callbacks
+    """
+
+    def __init__(self):
+        self.stages = dict()
+
+    def add_stage(self, name, handler, workers=1, queue_size=None):
+        """
+        Creates and starts a stage
+
+        :returns: the new Stage
+        """
+        stage = Stage(name, handler, workers, queue_size)
+        stage.start()
+        self.stages[name] = stage
+        return stage
+
+    def depths(self):
+        """
+        Returns the number of queued items of each stage
+        """
+        return {name: stage.depth() for name, stage in self.stages.items()}
+
+    def stop(self):
+        for stage in self.stages.values():
+            stage.stop()
@@ -0,0 +1,291 @@
+"""
+Local durable spool for bulk writes that failed because MongoDB was not
+reachable. Failed batches are appended to memory-mapped segment files and a
+Replayer thread drains them back into MongoDB at a controlled rate.
+
+Segment layout:
+
+    header: magic (4 bytes), version (4 bytes), read offset (8 bytes)
+    record: length (4 bytes), crc32 (4 bytes), BSON payload
+
+Segments are preallocated, so the end of the written records is the first
+record with a zero length or a bad checksum.
+
+Batches are replayed whole. MongoDB rejects the inserts of a batch that was
+partly applied before the connection failed, but not its updates, which are
+applied again: bucket $push may duplicate samples and catalog $inc may
+overcount. $max updates (latest values) are not affected.
+"""
+import glob
+import mmap
+import os
+import random
+import struct
+import threading
+import zlib
+from bson import BSON
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
+from history import conf, Logger
+from history.subscriber import metrics
+
+LOGGER = Logger.Log(conf.log_level).color_log()
+
+MAGIC = b'HSPL'
+VERSION = 1
+
+
+def encode_operation(operation):
+    """
+    Converts a pymongo write operation into a BSON-friendly dict
+    """
+    # pymongo does not expose the contents of its operation objects
+    if isinstance(operation, InsertOne):
+        return {'insert': operation._doc}
+    if isinstance(operation, UpdateOne):
+        return {'update': operation._filter, 'doc': operation._doc, 'upsert': operation._upsert}
+    raise TypeError('Cannot spool operation {}'.format(operation))
+
+
+def decode_operation(data):
+    if 'insert' in data:
+        return InsertOne(data['insert'])
+    return UpdateOne(data['update'], data['doc'], upsert=data['upsert'])
+
+
+class Segment:
+    """
+    A preallocated, memory-mapped spool file
+    """
+
+    HEADER = struct.Struct('<4sIQ')
+    RECORD = struct.Struct('<II')
+
+    def __init__(self, path, size=None):
+        self.path = path
+        created = not os.path.exists(path)
+        self.file = open(path, 'w+b' if created else 'r+b')
+        if created:
+            self.file.truncate(size)
+        self.size = os.path.getsize(path)
+        self.mmap = mmap.mmap(self.file.fileno(), self.size)
+        if created:
+            self.HEADER.pack_into(self.mmap, 0, MAGIC, VERSION, self.HEADER.size)
+        magic, _, self.read_offset = self.HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a spool segment'.format(path))
+        self.write_offset = self._scan()
+
+    def _scan(self):
+        offset = self.read_offset
+        while offset + self.RECORD.size <= self.size:
+            length, crc = self.RECORD.unpack_from(self.mmap, offset)
+            end = offset + self.RECORD.size + length
+            if length == 0 or end > self.size:
+                break
+            if zlib.crc32(self.mmap[offset + self.RECORD.size:end]) != crc:
+                break
+            offset = end
+        return offset
+
+    def append(self, payload):
+        """
+        Appends a record, returning False if it does not fit in the segment
+        """
+        end = self.write_offset + self.RECORD.size + len(payload)
+        if end > self.size:
+            return False
+        self.mmap[self.write_offset + self.RECORD.size:end] = payload
+        self.RECORD.pack_into(self.mmap, self.write_offset, len(payload), zlib.crc32(payload))
+        self.mmap.flush()
+        self.write_offset = end
+        return True
+
+    def read(self):
+        """
+        Returns the oldest record not yet acknowledged, or None
+        """
+        if self.read_offset >= self.write_offset:
+            return None
+        length, _ = self.RECORD.unpack_from(self.mmap, self.read_offset)
+        start = self.read_offset + self.RECORD.size
+        return self.mmap[start:start + length]
+
+    def ack(self):
+        """
+        Marks the oldest record as replayed
+        """
+        length, _ = self.RECORD.unpack_from(self.mmap, self.read_offset)
+        self.read_offset += self.RECORD.size + length
+        self.HEADER.pack_into(self.mmap, 0, MAGIC, VERSION, self.read_offset)
+        self.mmap.flush(0, min(mmap.PAGESIZE, self.size))
+
+    def exhausted(self):
+        return self.read_offset >= self.write_offset
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class Spool:
+    """
+    Append-only queue of failed bulk writes, split into segment files
+    """
+
+    def __init__(self, directory=None, segment_size=None):
+        self.directory = directory or conf.persister_spool_dir
+        self.segment_size = segment_size or conf.persister_spool_segment_size
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.segments = [Segment(path) for path in
+                         sorted(glob.glob(os.path.join(self.directory, 'segment-*.spool')))]
+        self.sequence = len(self.segments) and int(
+            os.path.basename(self.segments[-1].path)[len('segment-'):-len('.spool')])
+        if self.segments:
+            LOGGER.info('Found %d spool segments to replay in %s', len(self.segments), self.directory)
+
+    def _new_segment(self, min_size):
+        self.sequence += 1
+        path = os.path.join(self.directory, 'segment-{:012d}.spool'.format(self.sequence))
+        segment = Segment(path, max(self.segment_size, min_size + Segment.HEADER.size + Segment.RECORD.size))
+        self.segments.append(segment)
+        return segment
+
+    def append(self, collection_name, operations):
+        """
+        Stores a batch of write operations for later replay
+
+        :type collection_name: str
+        :param collection_name: target collection
+
+        :type operations: list
+        :param operations: pymongo write operations
+        """
+        payload = BSON.encode({
+            'collection': collection_name,
+            'operations': [encode_operation(operation) for operation in operations]
+        })
+        with self.lock:
+            if not self.segments or not self.segments[-1].append(payload):
+                self._new_segment(len(payload)).append(payload)
+
+    def peek(self):
+        """
+        Returns the oldest spooled batch as (collection name, operations), or
+        None if the spool is empty
+        """
+        with self.lock:
+            while self.segments:
+                payload = self.segments[0].read()
+                if payload is not None:
+                    try:
+                        data = BSON(payload).decode()
+                        return data['collection'], [decode_operation(op) for op in data['operations']]
+                    except Exception as error:
+                        LOGGER.error('Discarding unreadable spool record: %s', error)
+                        self.segments[0].ack()
+                        continue
+                if len(self.segments) == 1:
+                    return None
+                self.segments.pop(0).remove()
+            return None
+
+    def ack(self):
+        """
+        Drops the batch returned by the last peek()
+        """
+        with self.lock:
+            segment = self.segments[0]
+            segment.ack()
+            if segment.exhausted():
+                self.segments.pop(0).remove()
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+            self.segments = []
+
+
+class Replayer:
+    """
+    Drains a Spool back into MongoDB, at most ``rate`` batches per second.
+    While MongoDB is unreachable it backs off exponentially, with jitter. A
+    batch that keeps failing for any other reason is discarded after
+    ``max_attempts`` replays, so it does not hold back the batches behind it.
+    """
+
+    def __init__(self, spool, db, rate=None, idle_interval=1.0, max_backoff=30.0, max_attempts=None):
+        self.spool = spool
+        self.db = db
+        self.rate = rate or conf.persister_spool_replay_rate
+        self.max_attempts = max_attempts or conf.persister_spool_replay_attempts
+        self.failures = 0
+        self.idle_interval = idle_interval
+        self.max_backoff = max_backoff
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="SpoolReplayer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def replay_one(self):
+        """
+        Replays the oldest spooled batch
+
+        :returns: False if the spool is empty
+        :raises ConnectionFailure: if MongoDB is still unreachable
+        :raises Exception: if the batch failed and has attempts left
+        """
+        entry = self.spool.peek()
+        if entry is None:
+            return False
+        collection_name, operations = entry
+        try:
+            self.db[collection_name].bulk_write(operations, ordered=False)
+        except BulkWriteError as error:
+            # part of the batch was written before the failure
+            LOGGER.warning('Replayed batch on %s was partially rejected: %s',
+                           collection_name, error.details.get('writeErrors', [])[:1])
+        except ConnectionFailure:
+            raise
+        except Exception as error:
+            self.failures += 1
+            if self.failures < self.max_attempts:
+                raise
+            LOGGER.error('Discarding spooled batch of %d operations on %s after %d failed replays: %s',
+                         len(operations), collection_name, self.failures, error)
+        self.failures = 0
+        self.spool.ack()
+        metrics.REPLAYED.inc()
+        return True
+
+    def _run(self):
+        backoff = 1.0 / self.rate
+        delay = 0
+        while not self.stopped.wait(delay):
+            try:
+                replayed = self.replay_one()
+            except ConnectionFailure as error:
+                LOGGER.debug('MongoDB still unavailable, retrying spooled writes later: %s', error)
+                backoff = min(backoff * 2, self.max_backoff)
+                delay = backoff * random.uniform(0.5, 1.0)
+                continue
+            except Exception as error:
+                LOGGER.error('Failed to replay spooled writes: %s', error)
+                delay = self.idle_interval
+                continue
+            backoff = 1.0 / self.rate
+            delay = backoff if replayed else self.idle_interval
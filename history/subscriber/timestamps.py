@@ -0,0 +1,96 @@
+"""
+Normalizes event timestamps into datetimes, dispatching on the value type so
+that the common shapes (epoch numbers and RFC3339 strings) never reach
+dateutil's generic parser
+"""
+import re
+from datetime import datetime, timedelta, timezone
+from dateutil.parser import parse
+
+# Epoch values above this are taken as milliseconds
+MAX_EPOCH_SECONDS = (2**31) - 1
+
+RFC3339 = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})[Tt ](\d{2}):(\d{2}):(\d{2})'
+    r'(?:\.(\d{1,6})\d*)?'
+    r'(?:([Zz])|([+-])(\d{2}):(\d{2}))?$')
+
+_offsets = {}
+
+
+def from_epoch(value):
+    """
+    Converts an epoch, in seconds or milliseconds, to a naive UTC datetime
+
+    :type value: int or float
+    :param value: epoch
+    """
+    if value > MAX_EPOCH_SECONDS:
+        return datetime.utcfromtimestamp(value / 1000)
+    return datetime.utcfromtimestamp(value)
+
+
+def _offset(sign, hours, minutes):
+    key = (sign, hours, minutes)
+    tz = _offsets.get(key)
+    if tz is None:
+        delta = timedelta(hours=int(hours), minutes=int(minutes))
+        tz = timezone(-delta if sign == '-' else delta)
+        _offsets[key] = tz
+    return tz
+
+
+def from_rfc3339(value):
+    """
+    Strictly parses an RFC3339 date-time, returning None when the string does
+    not follow that format
+
+    :type value: str
+    :param value: date-time string
+    """
+    match = RFC3339.match(value)
+    if match is None:
+        return None
+    (year, month, day, hour, minute, second, fraction,
+     utc, sign, offset_hours, offset_minutes) = match.groups()
+    if utc:
+        tz = timezone.utc
+    elif sign:
+        tz = _offset(sign, offset_hours, offset_minutes)
+    else:
+        tz = None
+    microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+    try:
+        return datetime(int(year), int(month), int(day), int(hour),
+                        int(minute), int(second), microsecond, tzinfo=tz)
+    except ValueError:
+        return None
+
+
+def normalize(timestamp):
+    """
+    Converts an event timestamp into a datetime
+
+    :type timestamp: int, float, str or None
+    :param timestamp: epoch (seconds or milliseconds) or date-time string.
+        None means "now".
+    :raises TypeError: if the timestamp could not be parsed
+    """
+    if timestamp is None:
+        return datetime.utcnow()
+    if isinstance(timestamp, (int, float)):
+        try:
+            return from_epoch(timestamp)
+        except (ValueError, OverflowError, OSError) as error:
+            raise TypeError(
+                'Timestamp could not be parsed: {}\n{}'.format(timestamp, error))
+    if isinstance(timestamp, str):
+        parsed = from_rfc3339(timestamp)
+        if parsed is not None:
+            return parsed
+    try:
+        return parse(timestamp)
+    except (TypeError, ValueError, OverflowError) as error:
+        raise TypeError(
+            'Timestamp could not be parsed: {}\n{}'.format(timestamp, error))
+
@@ -0,0 +1,188 @@
+import threading
+import time
+from pymongo import InsertOne
+from pymongo.errors import ConnectionFailure
+from history import conf, Logger
+from history.buckets import as_utc
+from history.subscriber import metrics
+from history.subscriber.pipeline import Stage
+
+LOGGER = Logger.Log(conf.log_level).color_log()
+
+
+class WriteBuffer:
+    """
+    Collects write operations across messages, grouped by target collection,
+    and flushes them as unordered bulk writes.
+
+    A collection is flushed as soon as it has ``batch_size`` pending
+    operations, or when its oldest pending operation is older than
+    ``flush_interval`` seconds. With ``writers``, flushed batches are handed
+    to a pool of writer threads instead of being written by the caller.
+    With a ``spool``, batches that fail because MongoDB is unreachable are
+    stored there to be replayed later.
+    """
+
+    def __init__(self, db, batch_size=None, flush_interval=None, writers=0, name="writer", spool=None):
+        self.db = db
+        self.name = name
+        self.spool = spool
+        self.writer = None
+        if writers:
+            self.writer = Stage(name, self._bulk_write, writers,
+                                conf.persister_writer_queue_size)
+        self.batch_size = batch_size or conf.persister_batch_size
+        self.flush_interval = flush_interval or conf.persister_flush_interval
+        self.pending = dict()
+        self.first_added = dict()
+        self.oldest_event = dict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = None
+
+    def start(self):
+        """
+        Starts the background thread that flushes aged batches
+        """
+        if self.writer is not None and not self.writer.threads:
+            self.writer.start()
+        if self.flusher is None:
+            self.flusher = threading.Thread(
+                target=self._flush_aged, name="WriteBufferFlusher", daemon=True)
+            self.flusher.start()
+
+    def add(self, collection_name, docs, event_time=None):
+        """
+        Queues documents to be inserted into a collection
+
+        :type collection_name: str
+        :param collection_name: target collection
+
+        :type docs: list
+        :param docs: documents to be inserted
+
+        :type event_time: datetime
+        :param event_time: timestamp of the event the documents came from,
+            used to measure the persistence lag
+        """
+        self.add_operations(collection_name, [InsertOne(doc) for doc in docs], event_time)
+
+    def add_operations(self, collection_name, operations, event_time=None):
+        """
+        Queues pymongo write operations (InsertOne, UpdateOne, ...) to be
+        executed against a collection
+
+        :type collection_name: str
+        :param collection_name: target collection
+
+        :type operations: list
+        :param operations: write operations
+
+        :type event_time: datetime
+        :param event_time: timestamp of the event the operations came from
+        """
+        batch = None
+        if event_time is not None:
+            event_time = as_utc(event_time)
+        with self.lock:
+            pending = self.pending.setdefault(collection_name, [])
+            if not pending:
+                self.first_added[collection_name] = time.monotonic()
+            pending.extend(operations)
+            if event_time is not None:
+                oldest = self.oldest_event.get(collection_name)
+                if oldest is None or event_time < oldest:
+                    self.oldest_event[collection_name] = event_time
+            if len(pending) >= self.batch_size:
+                batch = self._take(collection_name)
+        if batch:
+            self.write(collection_name, *batch)
+
+    def flush(self):
+        """
+        Writes every pending batch, regardless of its size or age
+        """
+        with self.lock:
+            batches = [(name, self._take(name)) for name in list(self.pending)]
+        for collection_name, batch in batches:
+            self.write(collection_name, *batch)
+
+    def close(self):
+        """
+        Stops the background flusher and writes whatever is still pending
+        """
+        self.stopped.set()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        self.flush()
+        if self.writer is not None:
+            self.writer.stop()
+
+    def write(self, collection_name, batch, event_time=None):
+        """
+        Executes a batch of operations as a single unordered bulk write, on
+        the writer pool when there is one. A full writer queue blocks the
+        caller.
+
+        :type collection_name: str
+        :param collection_name: target collection
+
+        :type batch: list
+        :param batch: write operations
+
+        :type event_time: datetime
+        :param event_time: oldest event timestamp in the batch
+        """
+        if self.writer is not None and self.writer.threads:
+            self.writer.put(collection_name, batch, event_time)
+        else:
+            self._bulk_write(collection_name, batch, event_time)
+
+    def _bulk_write(self, collection_name, batch, event_time=None):
+        metrics.BATCH_SIZE.observe(len(batch), writer=self.name)
+        started = time.monotonic()
+        try:
+            self.db[collection_name].bulk_write(batch, ordered=False)
+        except ConnectionFailure as error:
+            metrics.WRITE_FAILURES.inc(writer=self.name)
+            if self.spool is None:
+                LOGGER.warning(
+                    'Failed to persist %d operations on %s.\n%s', len(batch), collection_name, error)
+                return
+            LOGGER.warning(
+                'MongoDB unavailable, spooling %d operations on %s.\n%s', len(batch), collection_name, error)
+            try:
+                self.spool.append(collection_name, batch)
+                metrics.SPOOLED.inc(writer=self.name)
+            except Exception as spool_error:
+                LOGGER.error('Failed to spool operations on %s: %s', collection_name, spool_error)
+            return
+        except Exception as error:
+            metrics.WRITE_FAILURES.inc(writer=self.name)
+            LOGGER.warning(
+                'Failed to persist %d operations on %s.\n%s', len(batch), collection_name, error)
+            return
+        metrics.WRITE_LATENCY.observe(time.monotonic() - started, writer=self.name)
+        if event_time is not None:
+            metrics.LAG.observe(metrics.seconds_since(event_time), writer=self.name)
+
+    def depth(self):
+        """
+        Returns the number of batches waiting for a writer
+        """
+        return self.writer.depth() if self.writer is not None else 0
+
+    def _take(self, collection_name):
+        self.first_added.pop(collection_name, None)
+        return self.pending.pop(collection_name, []), self.oldest_event.pop(collection_name, None)
+
+    def _flush_aged(self):
+        while not self.stopped.wait(self.flush_interval / 2):
+            now = time.monotonic()
+            with self.lock:
+                aged = [name for name, added in self.first_added.items()
+                        if now - added >= self.flush_interval]
+                batches = [(name, self._take(name)) for name in aged]
+            for collection_name, batch in batches:
+                self.write(collection_name, *batch)
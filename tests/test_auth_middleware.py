@@ -1,8 +1,12 @@
+import base64
+import time
 import pytest
 import falcon
 import json
 from unittest.mock import Mock, MagicMock, patch
+from history.api import tokens
 from history.api.models import AuthMiddleware
+from history.api.tokens import TokenCache
 
 class TestAuthMiddleware:
 
@@ -33,3 +37,53 @@ class TestAuthMiddleware:
     def test_parse_token_none(self):
         authmidd = AuthMiddleware()
         assert authmidd._parse_token(None) is None
+
+    def test_decode_base_64_url_safe_alphabet(self):
+        assert AuthMiddleware._decode_base64('-_8') == b'\xfb\xff'
+
+    def test_parse_token_returns_service(self):
+        payload = base64.urlsafe_b64encode(json.dumps({'service': 'admin'}).encode()).decode().rstrip('=')
+        assert AuthMiddleware()._parse_token('header.' + payload + '.signature') == 'admin'
+
+
+def make_token(claims):
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip('=')
+    return 'header.' + payload + '.signature'
+
+
+class TestTokenCache:
+
+    def test_warm_tokens_are_not_parsed_again(self):
+        cache = TokenCache(max_size=10, ttl=60)
+        token = make_token({'service': 'admin'})
+        with patch('history.api.tokens.parse', wraps=tokens.parse) as mock_parse:
+            assert cache.get(token) == 'admin'
+            assert cache.get(token) == 'admin'
+        assert mock_parse.call_count == 1
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+    def test_entries_expire_at_exp_claim(self):
+        cache = TokenCache(max_size=10, ttl=60)
+        token = make_token({'service': 'admin', 'exp': time.time() + 0.05})
+        assert cache.get(token) == 'admin'
+        assert token in cache.entries
+        time.sleep(0.06)
+        with patch('history.api.tokens.parse', wraps=tokens.parse) as mock_parse:
+            assert cache.get(token) == 'admin'
+        assert mock_parse.call_count == 1
+        assert token not in cache.entries
+
+    def test_least_recently_used_tokens_are_evicted(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        first, second, third = (make_token({'service': str(i)}) for i in range(3))
+        cache.get(first)
+        cache.get(second)
+        cache.get(first)
+        cache.get(third)
+        assert list(cache.entries) == [first, third]
+
+    def test_invalid_tokens_are_not_cached(self):
+        cache = TokenCache(max_size=10, ttl=60)
+        assert cache.get(make_token({'user': 'admin'})) is None
+        assert cache.get('not a token') is None
+        assert cache.entries == {}
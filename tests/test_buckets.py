@@ -0,0 +1,105 @@
+import pymongo
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+from history import buckets
+
+
+def bucket(attr, start, samples, device_id='dev'):
+    return {
+        'attr': attr,
+        'device_id': device_id,
+        'ts': start,
+        'count': len(samples),
+        'samples': {'ts': [ts for ts, _ in samples], 'value': [v for _, v in samples]},
+        'metadata': {}
+    }
+
+
+class TestBuckets:
+
+    @patch('history.buckets.conf')
+    def test_is_enabled(self, mock_conf):
+        mock_conf.db_storage_mode = 'bucket'
+        assert buckets.is_enabled()
+        mock_conf.db_storage_mode = 'document'
+        assert not buckets.is_enabled()
+
+    def test_window_start(self):
+        assert buckets.window_start(datetime(2021, 8, 3, 20, 38, 13), 3600) == datetime(2021, 8, 3, 20)
+
+    def test_window_start_aware_timestamp(self):
+        ts = datetime(2021, 8, 3, 20, 38, 13, tzinfo=timezone.utc)
+        assert buckets.window_start(ts, 600) == datetime(2021, 8, 3, 20, 30)
+
+    def test_sample_update(self):
+        ts = datetime(2021, 8, 3, 20, 38, 13)
+        update = buckets.sample_update('temp', 'dev', ts, 21.5, {})
+        assert update._filter['attr'] == 'temp'
+        assert update._filter['ts'] == buckets.window_start(ts)
+        assert update._doc['$push'] == {'samples.ts': ts, 'samples.value': 21.5}
+        assert update._upsert
+
+    def test_unpack_sorts_and_merges_buckets_of_same_window(self):
+        start = datetime(2021, 8, 3, 20)
+        cursor = [
+            bucket('temp', start, [(datetime(2021, 8, 3, 20, 5), 1), (datetime(2021, 8, 3, 20, 1), 2)]),
+            bucket('temp', start, [(datetime(2021, 8, 3, 20, 3), 3)]),
+        ]
+        values = [doc['value'] for doc in buckets.unpack(cursor, descending=False)]
+        assert values == [2, 3, 1]
+
+    def test_unpack_passes_plain_documents_through(self):
+        doc = {'attr': 'temp', 'value': 1, 'device_id': 'dev', 'ts': datetime(2021, 8, 3), 'metadata': {}}
+        assert list(buckets.unpack([doc])) == [doc]
+
+    def test_find_last_n(self):
+        collection = MagicMock()
+        collection.find.return_value.__iter__.return_value = [
+            bucket('temp', datetime(2021, 8, 3, 21), [(datetime(2021, 8, 3, 21, 1), 4)]),
+            bucket('temp', datetime(2021, 8, 3, 20), [(datetime(2021, 8, 3, 20, 1), 1),
+                                                      (datetime(2021, 8, 3, 20, 2), 2)]),
+        ]
+        query = {'query': {'attr': 'temp', 'value': {'$ne': ' '}}, 'filter': {'_id': False},
+                 'sort': [('ts', pymongo.DESCENDING)], 'limit': 2}
+        history = list(buckets.find(collection, query))
+        assert [doc['value'] for doc in history] == [4, 2]
+        assert history[0] == {'attr': 'temp', 'value': 4, 'device_id': 'dev',
+                              'ts': datetime(2021, 8, 3, 21, 1), 'metadata': {}}
+        collection.find.assert_called_once_with(
+            {'attr': 'temp'}, {'_id': False}, sort=[('ts', pymongo.DESCENDING)])
+
+    def test_find_reads_samples__when_fields_are_selected(self):
+        collection = MagicMock()
+        collection.find.return_value.__iter__.return_value = []
+        query = {'query': {'attr': 'temp'}, 'filter': {'_id': False, 'attr': True, 'ts': True},
+                 'sort': [('ts', pymongo.DESCENDING)], 'limit': 2, 'fields': ['ts']}
+        list(buckets.find(collection, query))
+        assert collection.find.call_args[0][1] == {
+            '_id': False, 'attr': True, 'ts': True, 'samples': True, 'value': True}
+
+    def test_find_date_range(self):
+        collection = MagicMock()
+        collection.find.return_value.__iter__.return_value = [
+            bucket('temp', datetime(2021, 8, 3, 20), [(datetime(2021, 8, 3, 20, 10), 1),
+                                                      (datetime(2021, 8, 3, 20, 20), ' '),
+                                                      (datetime(2021, 8, 3, 20, 30), 3),
+                                                      (datetime(2021, 8, 3, 20, 50), 4)]),
+        ]
+        query = {'query': {'attr': 'temp', 'value': {'$ne': ' '},
+                           'ts': {'$gte': datetime(2021, 8, 3, 20, 15),
+                                  '$lte': datetime(2021, 8, 3, 20, 40, tzinfo=timezone.utc)}},
+                 'filter': {}, 'sort': [('ts', pymongo.ASCENDING)], 'limit': False}
+        history = list(buckets.find(collection, query))
+        assert [doc['value'] for doc in history] == [3]
+        bucket_query = collection.find.call_args[0][0]
+        assert bucket_query['ts'] == {'$gte': datetime(2021, 8, 3, 20),
+                                      '$lte': datetime(2021, 8, 3, 20, 40)}
+
+    def test_sample_stages_match_windows_then_samples(self):
+        lower = datetime(2021, 8, 3, 20, 38, 13)
+        upper = datetime(2021, 8, 3, 22, 0, 0)
+        match = {'value': {'$ne': ' '}, 'attr': {'$in': ['a']}, 'ts': {'$gte': lower, '$lte': upper}}
+        stages = buckets.sample_stages(match)
+        assert stages[0] == {'$match': {'attr': {'$in': ['a']},
+                                        'ts': {'$gte': datetime(2021, 8, 3, 20, 0, 0), '$lte': upper}}}
+        assert stages[-1] == {'$match': {'ts': {'$gte': lower, '$lte': upper}, 'value': {'$ne': ' '}}}
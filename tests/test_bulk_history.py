@@ -0,0 +1,101 @@
+import datetime
+import json
+import pytest
+import falcon
+from unittest.mock import MagicMock, patch
+from history.api.models import BulkHistory
+
+
+def make_request(params):
+    request = MagicMock()
+    request.params = params
+    request.client_prefers = lambda types: 'application/json' if 'application/json' in types else None
+    return request
+
+
+def get_collection(service, device_id):
+    if device_id == 'missing':
+        raise falcon.HTTPNotFound()
+    collection = MagicMock()
+    collection.find.return_value.__iter__.return_value = [
+        {'attr': 'temperature', 'value': device_id, 'ts': datetime.datetime(2021, 8, 3, 20, 38, 13)}]
+    return collection
+
+
+@pytest.fixture(autouse=True)
+def mock_get_catalog():
+    with patch('history.api.models.DeviceHistory.get_catalog', return_value={}) as mock:
+        yield mock
+
+
+class TestBulkHistory:
+
+    def test_parse_devices__should_accept_comma_separated_and_list_values(self):
+        assert BulkHistory.parse_devices('a, b,a') == ['a', 'b']
+        assert BulkHistory.parse_devices(['a', 'b,c']) == ['a', 'b', 'c']
+
+    @patch('history.api.models.conf.api_bulk_max_devices', 2)
+    def test_parse_devices__should_reject_too_many_devices(self):
+        with pytest.raises(falcon.HTTPInvalidParam):
+            BulkHistory.parse_devices('a,b,c')
+
+    def test_on_get__should_require_devices(self):
+        with pytest.raises(falcon.HTTPMissingParam):
+            BulkHistory.on_get(make_request({'attr': 'temperature'}), falcon.Response())
+
+    @patch('history.api.models.HistoryUtil.get_collection', side_effect=get_collection)
+    def test_on_get__should_combine_the_history_of_every_device(self, mock_get_collection):
+        request = make_request({'device_id': 'dev1,dev2,missing', 'attr': 'temperature', 'lastN': '5'})
+        response = falcon.Response()
+        BulkHistory.on_get(request, response)
+        history = json.loads(response.body)
+        assert list(history) == ['dev1', 'dev2', 'missing']
+        assert history['dev1']['temperature'][0]['value'] == 'dev1'
+        assert history['dev2']['temperature'][0]['value'] == 'dev2'
+        assert history['missing'] == {'temperature': []}
+
+    @patch('history.api.models.conf.api_stream_responses', True)
+    @patch('history.api.models.HistoryUtil.get_collection', side_effect=get_collection)
+    def test_on_get__should_stream_a_device_at_a_time__when_streaming_is_enabled(self, mock_get_collection):
+        request = make_request({'device_id': ['dev1', 'dev2'], 'attr': 'temperature', 'lastN': '5'})
+        response = falcon.Response()
+        BulkHistory.on_get(request, response)
+        history = json.loads(b''.join(response.stream))
+        assert [history[device]['temperature'][0]['value'] for device in history] == ['dev1', 'dev2']
+
+    @patch('history.api.models.HistoryUtil.get_db')
+    @patch('history.api.models.latest.lookup_many')
+    @patch('history.api.models.HistoryUtil.get_collection')
+    def test_on_get__should_serve_lastN_1_from_latest_values_in_a_single_lookup(self, mock_get_collection,
+        mock_lookup_many, mock_get_db):
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13)
+        mock_lookup_many.return_value = {
+            'dev1': {'temperature': {'attr': 'temperature', 'value': 1, 'ts': ts}},
+            'dev2': {'temperature': {'attr': 'temperature', 'value': 2, 'ts': ts}}}
+        request = make_request({'device_id': 'dev1,dev2', 'attr': ['temperature'], 'lastN': '1'})
+        response = falcon.Response()
+        BulkHistory.on_get(request, response)
+        history = json.loads(response.body)
+        assert history['dev2'] == {'temperature': [{'attr': 'temperature', 'value': 2, 'ts': '2021-08-03T20:38:13Z'}]}
+        assert mock_lookup_many.call_count == 1
+        assert not mock_get_collection.called
+
+    @patch('history.api.models.HistoryUtil.get_db')
+    @patch('history.api.models.latest.lookup_many')
+    @patch('history.api.models.HistoryUtil.get_collection', side_effect=get_collection)
+    def test_on_get__should_report_unknown_device_as_empty__when_serving_lastN_1_from_latest_values(self,
+        mock_get_collection, mock_lookup_many, mock_get_db):
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13)
+        mock_lookup_many.return_value = {
+            'dev1': {'temperature': {'attr': 'temperature', 'value': 1, 'ts': ts}},
+            'missing': {}}
+        request = make_request({'device_id': 'dev1,missing', 'attr': 'temperature', 'lastN': '1'})
+        response = falcon.Response()
+        BulkHistory.on_get(request, response)
+        history = json.loads(response.body)
+        assert history['dev1']['temperature'][0]['value'] == 1
+        assert history['missing'] == {'temperature': []}
+
+    def test_csv_response_parser__should_concatenate_every_device(self):
+        history = {'dev1': {'a': [{'value': 1}], 'b': [{'value': 2}]}, 'dev2': {'a': [{'value': 3}]}}
+        assert [d['value'] for d in BulkHistory.csv_response_parser(history)] == [1, 2, 3]
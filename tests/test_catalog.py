@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from pymongo import UpdateOne
+from history import catalog
+from history.subscriber.catalog_tracker import CatalogTracker
+
+
+class TestCatalog:
+
+    def test_entry_update_merges_into_catalog_entry(self):
+        first = datetime(2021, 8, 3, 20, 38, 13, tzinfo=timezone.utc)
+        last = datetime(2021, 8, 3, 21, 38, 13)
+        operation = catalog.entry_update('admin', 'dev', 'temperature', first, last, 2)
+        assert operation == UpdateOne(
+            {'tenant': 'admin', 'device_id': 'dev', 'attr': 'temperature'},
+            {
+                '$min': {'first_ts': datetime(2021, 8, 3, 20, 38, 13)},
+                '$max': {'last_ts': last},
+                '$inc': {'count': 2}
+            },
+            upsert=True)
+
+    def test_lookup_returns_entries_by_attr(self):
+        db = MagicMock()
+        ts = datetime(2021, 8, 3, 20, 38, 13)
+        db['catalog'].find.return_value.__iter__.return_value = [
+            {'attr': 'temperature', 'first_ts': ts, 'last_ts': ts, 'count': 1}]
+        assert catalog.lookup(db, 'admin', 'dev') == {
+            'temperature': {'first_ts': ts, 'last_ts': ts, 'count': 1}}
+
+
+class TestCatalogTracker:
+
+    def test_samples_are_coalesced_per_attr(self):
+        buffer = MagicMock()
+        tracker = CatalogTracker(buffer, flush_interval=60)
+        ts = datetime(2021, 8, 3, 20, 38, 13)
+        tracker.record('admin', 'dev', ['temperature', 'humidity'], ts)
+        tracker.record('admin', 'dev', ['temperature'], ts + timedelta(seconds=10))
+        tracker.record('admin', 'dev', ['temperature'], ts - timedelta(seconds=10))
+        tracker.flush()
+        collection_name, operations = buffer.add_operations.call_args[0]
+        assert collection_name == 'catalog'
+        assert len(operations) == 2
+        assert catalog.entry_update('admin', 'dev', 'temperature', ts - timedelta(seconds=10),
+                                    ts + timedelta(seconds=10), 3) in operations
+        assert tracker.pending == {}
+
+    def test_flush_without_samples_does_not_write(self):
+        buffer = MagicMock()
+        tracker = CatalogTracker(buffer, flush_interval=60)
+        tracker.flush()
+        assert not buffer.add_operations.called
+
+    def test_close_flushes_pending(self):
+        buffer = MagicMock()
+        tracker = CatalogTracker(buffer, flush_interval=60)
+        tracker.start()
+        tracker.record('admin', 'dev', ['temperature'], datetime.utcnow())
+        tracker.close()
+        assert buffer.add_operations.called
+
+    def test_flush_ensures_catalog_indexes(self):
+        index_manager = MagicMock()
+        tracker = CatalogTracker(MagicMock(), flush_interval=60, index_manager=index_manager)
+        tracker.record('admin', 'dev', ['temperature'], datetime.utcnow())
+        tracker.flush()
+        index_manager.ensure.assert_called_once_with('catalog')
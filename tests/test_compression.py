@@ -0,0 +1,86 @@
+import gzip
+import pytest
+import falcon
+from unittest.mock import MagicMock, patch
+from history.api import compression
+from history.api.compression import CompressionMiddleware
+
+
+def make_request(accept_encoding):
+    request = MagicMock()
+    request.get_header = lambda name: accept_encoding if name == 'Accept-Encoding' else None
+    return request
+
+
+class TestCompression:
+
+    def test_accepted_encodings__should_parse_quality_values(self):
+        assert compression.accepted_encodings('gzip;q=0.5, zstd, br;q=0, *;q=x') == {
+            'gzip': 0.5, 'zstd': 1.0, 'br': 0.0, '*': 0.0}
+
+    @patch('history.api.compression.conf.api_compression', 'zstd,gzip')
+    def test_negotiate__should_prefer_highest_quality_then_server_order(self):
+        assert compression.negotiate('gzip') == 'gzip'
+        assert compression.negotiate('gzip;q=0.9, zstd;q=0.5') == 'gzip'
+        assert compression.negotiate('identity') is None
+        assert compression.negotiate(None) is None
+        if compression.zstandard is not None:
+            assert compression.negotiate('gzip, zstd') == 'zstd'
+            assert compression.negotiate('*') == 'zstd'
+
+    @patch('history.api.compression.conf.api_compression', '')
+    def test_negotiate__should_not_compress__when_compression_is_disabled(self):
+        assert compression.negotiate('gzip') is None
+
+    @patch('history.api.compression.conf.api_compression', 'gzip')
+    def test_process_response__should_compress_large_bodies(self):
+        response = falcon.Response()
+        response.body = '{"attr": "temperature"}' * 100
+        CompressionMiddleware(min_size=1024).process_response(make_request('gzip'), response, None, True)
+        assert response.body is None
+        assert gzip.decompress(response.data).decode('utf-8') == '{"attr": "temperature"}' * 100
+        assert response.get_header('Content-Encoding') == 'gzip'
+        assert response.get_header('Vary') == 'Accept-Encoding'
+
+    @patch('history.api.compression.conf.api_compression', 'gzip')
+    def test_process_response__should_not_compress_small_bodies(self):
+        response = falcon.Response()
+        response.body = '[]'
+        CompressionMiddleware(min_size=1024).process_response(make_request('gzip'), response, None, True)
+        assert response.body == '[]'
+        assert response.get_header('Content-Encoding') is None
+
+    @patch('history.api.compression.conf.api_compression', 'gzip')
+    def test_process_response__should_compress_streams_lazily(self):
+        read = []
+
+        def chunks():
+            for i in range(10):
+                read.append(i)
+                yield b'x' * 600
+
+        response = falcon.Response()
+        response.stream = chunks()
+        CompressionMiddleware(min_size=1024).process_response(make_request('gzip'), response, None, True)
+        assert read == [0, 1]
+        assert response.get_header('Content-Encoding') == 'gzip'
+        assert gzip.decompress(b''.join(response.stream)) == b'x' * 6000
+
+    @patch('history.api.compression.conf.api_compression', 'gzip')
+    def test_process_response__should_send_short_streams_uncompressed(self):
+        response = falcon.Response()
+        response.stream = iter([b'[', b']'])
+        CompressionMiddleware(min_size=1024).process_response(make_request('gzip'), response, None, True)
+        assert response.stream is None
+        assert response.data == b'[]'
+        assert response.get_header('Content-Encoding') is None
+
+    @patch('history.api.compression.conf.api_compression', 'zstd')
+    def test_process_response__should_compress_with_zstd(self):
+        zstandard = pytest.importorskip('zstandard')
+        response = falcon.Response()
+        response.stream = iter([b'y' * 2000, b'y' * 2000])
+        CompressionMiddleware(min_size=1024).process_response(make_request('zstd'), response, None, True)
+        assert response.get_header('Content-Encoding') == 'zstd'
+        data = b''.join(response.stream)
+        assert zstandard.ZstdDecompressor().decompressobj().decompress(data) == b'y' * 4000
@@ -1,8 +1,16 @@
+import json
 import pytest
 import falcon
 import datetime
+import pymongo
 from unittest.mock import MagicMock, Mock, patch
-from history.api.models import DeviceHistory, HistoryUtil
+from history.api.models import DeviceHistory, DeviceSummary, HistoryUtil, LatestValues
+
+
+@pytest.fixture(autouse=True)
+def mock_get_catalog():
+    with patch('history.api.models.DeviceHistory.get_catalog', return_value={}) as mock:
+        yield mock
 
 
 class TestDeviceHistory:
@@ -55,7 +63,7 @@ class TestDeviceHistory:
         
         assert except_history == history_concatenated
         
-    @patch('requests.get')   
+    @patch('history.api.device_manager.session.get')
     def test_get_attrs_should_return_attrs_list(self,mock_get):
         mock_get.return_value.text = """{ 
             "attrs": { 
@@ -87,7 +95,7 @@ class TestDeviceHistory:
                 1
             ]
         }"""       
-        attrs_list = DeviceHistory.get_attrs('device_id','token')
+        attrs_list = DeviceHistory.get_attrs('device_id','token','test_get_attrs')
         
         assert attrs_list == ['attr1', 'attr2']           
 
@@ -110,9 +118,26 @@ class TestDeviceHistory:
                 "metadata": {}
             }
         ]
-        collection.find = lambda query, filter, sort, limit : mock_data
+        collection.find.return_value.__iter__.return_value = mock_data
         query = { "query": "", "filter": "", "sort": "", "limit": ""}
         assert DeviceHistory.get_single_attr(collection, query)  
+
+    @patch('history.api.models.buckets.find')
+    @patch('history.api.models.buckets.is_enabled', return_value=True)
+    def test_get_single_attr__should_unpack_buckets__when_bucket_mode_is_enabled(self, mock_is_enabled, mock_find):
+        collection = MagicMock()
+        mock_find.return_value = iter([{
+            "attr": "attr1",
+            "value": "teste",
+            "device_id": "teste",
+            "ts": datetime.datetime(2021, 8, 3, 20, 38, 13),
+            "metadata": {}
+        }])
+        query = { "query": "", "filter": "", "sort": "", "limit": ""}
+        history = DeviceHistory.get_single_attr(collection, query)
+        mock_find.assert_called_once_with(collection, query)
+        assert not collection.find.called
+        assert history[0]['ts'] == '2021-08-03T20:38:13Z'
               
     
     @patch('history.api.models.HistoryUtil.get_collection')    
@@ -135,7 +160,7 @@ class TestDeviceHistory:
     
     def test_on_get__should_return_a_response_with_code_200__when_no_attr_was_specified(self,mock_get_collection, mock_get_attrs, mock_parse_request, 
         mock_validate_accept_header, mock_build_response_body):
-         with patch('history.api.models.DeviceHistory.get_single_attr') as mock_get_attr:
+         with patch('history.api.models.DeviceHistory.get_multiple_attrs') as mock_get_attr:
             request = MagicMock()
             request.params.keys.return_value = []
             request.get_header.return_value = 'token'
@@ -183,7 +208,7 @@ class TestDeviceHistory:
     @patch('history.api.response_util.build_response_body')      
     def test_on_get__should_return_a_response_with_code_200__when_attrs_list_was_specified(self,mock_get_collection, mock_get_attrs, mock_parse_request, 
         mock_validate_accept_header, mock_build_response_body):
-        with patch('history.api.models.DeviceHistory.get_single_attr') as mock_get_attr:
+        with patch('history.api.models.DeviceHistory.get_multiple_attrs') as mock_get_attr:
             request = MagicMock()
             #request.params.keys.return_value = ['attr']
             request.get_header.return_value = 'token'
@@ -198,6 +223,363 @@ class TestDeviceHistory:
             
             DeviceHistory.on_get(request, response, 'test')
 
-            assert response.status == falcon.HTTP_200  
-            
-    
\ No newline at end of file
+            assert response.status == falcon.HTTP_200
+
+    def test_parse_request__should_not_filter_attr__when_no_attr_is_given(self):
+        request = MagicMock()
+        request.params.keys.return_value = ['lastN']
+        request.params.__getitem__.side_effect = lambda key: {"lastN": 1}[key]
+        query = DeviceHistory.parse_request(request, None)
+        assert query['query'] == {'value': {'$ne': ' '}}
+        assert query['limit'] == 1
+
+    def test_get_multiple_attrs__should_run_a_capped_find_per_attr__when_limit_is_given(self):
+        collection = MagicMock()
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13)
+        samples = {'attr1': [{'attr': 'attr1', 'value': 1, 'ts': ts}],
+                   'attr2': [{'attr': 'attr2', 'value': 2, 'ts': ts}], 'attr3': []}
+
+        def find(query, projection, sort, limit):
+            cursor = MagicMock()
+            cursor.__iter__.return_value = [dict(d) for d in samples[query['attr']]]
+            return cursor
+        collection.find.side_effect = find
+        query = {'query': {'value': {'$ne': ' '}}, 'filter': {}, 'limit': 1,
+                 'sort': [('ts', pymongo.DESCENDING)]}
+        history = DeviceHistory.get_multiple_attrs(collection, query, ['attr1', 'attr2', 'attr3'])
+
+        assert list(history.keys()) == ['attr1', 'attr2', 'attr3']
+        assert history['attr1'] == [{'attr': 'attr1', 'value': 1, 'ts': '2021-08-03T20:38:13Z'}]
+        assert history['attr3'] == []
+        assert collection.find.call_count == 3
+        for call in collection.find.call_args_list:
+            assert call[1] == {'sort': [('ts', pymongo.DESCENDING)], 'limit': 1}
+        assert not collection.aggregate.called
+
+    @patch('history.api.models.conf.db_max_time_ms', 1500)
+    @pytest.mark.parametrize('limit', [0, 1])
+    def test_get_multiple_attrs__should_bound_query_time(self, limit):
+        collection = MagicMock()
+        query = {'query': {}, 'filter': {}, 'limit': limit, 'sort': [('ts', pymongo.DESCENDING)]}
+        DeviceHistory.get_multiple_attrs(collection, query, ['attr1'])
+        collection.find.return_value.max_time_ms.assert_called_once_with(1500)
+
+    def test_parse_request__should_project_selected_fields(self):
+        request = MagicMock()
+        request.params = {'fields': ['value', 'ts']}
+        query = DeviceHistory.parse_request(request, 'attr1')
+        assert query['fields'] == ['value', 'ts']
+        assert query['filter'] == {'attr': True, 'ts': True, 'value': True, '_id': False}
+
+    @pytest.mark.parametrize('fields', ['value,_id', '', 'metadata.unit'])
+    def test_parse_fields__should_raise_invalid_param__when_fields_are_invalid(self, fields):
+        with pytest.raises(falcon.HTTPInvalidParam):
+            DeviceHistory.parse_fields(fields)
+
+    def test_get_single_attr__should_return_only_selected_fields(self):
+        collection = MagicMock()
+        collection.find.return_value.__iter__.return_value = [
+            {'attr': 'attr1', 'value': 1, 'ts': datetime.datetime(2021, 8, 3, 20, 38, 13)}]
+        request = MagicMock()
+        request.params = {'fields': 'value,ts'}
+        history = DeviceHistory.get_single_attr(collection, DeviceHistory.parse_request(request, 'attr1'))
+        assert history == [{'value': 1, 'ts': '2021-08-03T20:38:13Z'}]
+
+    def test_get_multiple_attrs__should_return_only_selected_fields__when_limit_is_given(self):
+        collection = MagicMock()
+        collection.find.return_value.__iter__.return_value = [
+            {'attr': 'attr1', 'ts': datetime.datetime(2021, 8, 3, 20, 38, 13), 'value': 1}]
+        request = MagicMock()
+        request.params = {'fields': 'value', 'lastN': '1'}
+        history = DeviceHistory.get_multiple_attrs(
+            collection, DeviceHistory.parse_request(request, None), ['attr1'])
+        assert history == {'attr1': [{'value': 1}]}
+        assert collection.find.call_args[0][1] == {'attr': True, 'ts': True, 'value': True, '_id': False}
+
+    def test_get_multiple_attrs__should_run_a_single_find__when_no_limit_is_given(self):
+        collection = MagicMock()
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13)
+        collection.find.return_value.__iter__.return_value = [
+            {'attr': 'attr1', 'value': 1, 'ts': ts},
+            {'attr': 'attr1', 'value': 2, 'ts': ts},
+            {'attr': 'attr2', 'value': 3, 'ts': ts},
+        ]
+        query = {'query': {'value': {'$ne': ' '}}, 'filter': {'_id': False}, 'limit': False,
+                 'sort': [('ts', pymongo.ASCENDING)]}
+        history = DeviceHistory.get_multiple_attrs(collection, query, ['attr1', 'attr2'])
+
+        assert [d['value'] for d in history['attr1']] == [1, 2]
+        assert [d['value'] for d in history['attr2']] == [3]
+        collection.find.assert_called_once_with(
+            {'value': {'$ne': ' '}, 'attr': {'$in': ['attr1', 'attr2']}}, {'_id': False},
+            sort=[('attr', pymongo.ASCENDING), ('ts', pymongo.ASCENDING)])
+
+    @patch('history.api.models.HistoryUtil.get_collection')
+    @patch('history.api.models.DeviceHistory.get_single_attr', return_value=[{'value': 1}])
+    @patch('history.api.response_util.build_response_body', return_value='[]')
+    def test_on_get_single_attr__should_read_history__when_attr_is_missing_from_catalog(self,
+        mock_build_response_body, mock_get_single_attr, mock_get_collection, mock_get_catalog):
+        request = MagicMock()
+        request.params = {'attr': 'uncataloged'}
+        mock_get_catalog.return_value = {'attr1': {}}
+        DeviceHistory.on_get(request, falcon.Response(), 'testid')
+        assert mock_get_single_attr.call_args[0][1]['query']['attr'] == 'uncataloged'
+
+    @patch('history.api.models.HistoryUtil.get_collection')
+    @patch('history.api.models.DeviceHistory.get_attrs')
+    @patch('history.api.models.DeviceHistory.get_multiple_attrs', return_value={})
+    @patch('history.api.response_util.build_response_body', return_value='{}')
+    def test_on_get__should_add_cataloged_attrs_to_device_manager_ones__when_no_attr_was_specified(self,
+        mock_build_response_body, mock_get_multiple_attrs, mock_get_attrs, mock_get_collection, mock_get_catalog):
+        request = MagicMock()
+        request.params = {}
+        mock_get_attrs.return_value = ['attr3', 'attr1']
+        mock_get_catalog.return_value = {'attr2': {}, 'attr1': {}}
+        DeviceHistory.on_get(request, falcon.Response(), 'testid')
+        assert mock_get_multiple_attrs.call_args[0][2] == ['attr3', 'attr1', 'attr2']
+
+    @patch('history.api.models.DeviceHistory.get_attrs', side_effect=falcon.HTTPBadGateway())
+    def test_get_all_attrs__should_use_catalog__when_device_manager_is_unavailable(self, mock_get_attrs,
+        mock_get_catalog):
+        request = MagicMock()
+        mock_get_catalog.return_value = {'attr2': {}, 'attr1': {}}
+        assert DeviceHistory.get_all_attrs(request, 'testid') == ['attr1', 'attr2']
+        mock_get_catalog.return_value = {}
+        with pytest.raises(falcon.HTTPBadGateway):
+            DeviceHistory.get_all_attrs(request, 'testid')
+
+    @patch('history.api.models.HistoryUtil.get_collection')
+    @patch('history.api.models.DeviceHistory.get_single_attr', return_value=[{'value': 1}])
+    @patch('history.api.models.DeviceHistory.get_multiple_attrs', return_value={})
+    @patch('history.api.response_util.build_response_body', return_value='[]')
+    def test_on_get__should_not_read_catalog__when_attrs_are_given(self, mock_build_response_body,
+        mock_get_multiple_attrs, mock_get_single_attr, mock_get_collection, mock_get_catalog):
+        request = MagicMock()
+        request.params = {'attr': 'attr1'}
+        DeviceHistory.on_get(request, falcon.Response(), 'testid')
+        request.params = {'attr': ['attr1', 'attr2']}
+        DeviceHistory.on_get(request, falcon.Response(), 'testid')
+        assert not mock_get_catalog.called
+
+
+    @patch('history.api.models.conf.api_stream_responses', True)
+    @patch('history.api.models.HistoryUtil.get_collection')
+    def test_on_get_single_attr__should_stream_from_cursor__when_streaming_is_enabled(self, mock_get_collection):
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13)
+        mock_get_collection.return_value.find.return_value.__iter__.return_value = iter([
+            {'attr': 'attr1', 'value': 1, 'ts': ts}, {'attr': 'attr1', 'value': 2, 'ts': ts}])
+        request = MagicMock()
+        request.params = {'attr': 'attr1'}
+        request.client_prefers.return_value = 'application/json'
+        response = falcon.Response()
+        DeviceHistory.on_get(request, response, 'testid')
+        assert response.body is None
+        assert json.loads(b''.join(response.stream)) == [
+            {'attr': 'attr1', 'value': 1, 'ts': '2021-08-03T20:38:13Z'},
+            {'attr': 'attr1', 'value': 2, 'ts': '2021-08-03T20:38:13Z'}]
+
+    @patch('history.api.models.conf.api_stream_responses', True)
+    @patch('history.api.models.HistoryUtil.get_collection')
+    def test_on_get_single_attr__should_raise_not_found__when_streamed_cursor_is_empty(self, mock_get_collection):
+        mock_get_collection.return_value.find.return_value.__iter__.return_value = iter([])
+        request = MagicMock()
+        request.params = {'attr': 'attr1'}
+        with pytest.raises(falcon.HTTPNotFound):
+            DeviceHistory.on_get(request, falcon.Response(), 'testid')
+
+    @patch('history.api.models.conf.api_stream_responses', True)
+    @patch('history.api.models.HistoryUtil.get_collection')
+    def test_on_get_attrs_list__should_stream_grouped_cursor__when_streaming_is_enabled(self, mock_get_collection):
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13)
+        mock_get_collection.return_value.find.return_value.__iter__.return_value = iter([
+            {'attr': 'attr1', 'value': 1, 'ts': ts},
+            {'attr': 'attr1', 'value': 2, 'ts': ts},
+            {'attr': 'attr2', 'value': 3, 'ts': ts}])
+        request = MagicMock()
+        request.params = {'attr': ['attr1', 'attr2', 'attr3']}
+        request.client_prefers.return_value = 'application/json'
+        response = falcon.Response()
+        DeviceHistory.on_get(request, response, 'testid')
+        history = json.loads(b''.join(response.stream))
+        assert [d['value'] for d in history['attr1']] == [1, 2]
+        assert [d['value'] for d in history['attr2']] == [3]
+        assert history['attr3'] == []
+
+
+    @patch('history.api.models.HistoryUtil.get_collection')
+    def test_on_get__should_return_a_page_and_its_token__when_pageSize_is_given(self, mock_get_collection):
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13)
+        mock_get_collection.return_value.find.return_value.__iter__.return_value = [
+            {'_id': 1, 'attr': 'attr1', 'value': 1, 'ts': ts},
+            {'_id': 2, 'attr': 'attr2', 'value': 2, 'ts': ts},
+            {'_id': 3, 'attr': 'attr1', 'value': 3, 'ts': ts}]
+        request = MagicMock()
+        request.params = {'attr': ['attr1', 'attr2'], 'pageSize': '2'}
+        request.client_prefers.return_value = 'application/json'
+        response = falcon.Response()
+        DeviceHistory.on_get(request, response, 'testid')
+        query = mock_get_collection.return_value.find.call_args[0][0]
+        assert query['attr'] == {'$in': ['attr1', 'attr2']}
+        assert json.loads(response.body) == {
+            'attr1': [{'attr': 'attr1', 'value': 1, 'ts': '2021-08-03T20:38:13Z'}],
+            'attr2': [{'attr': 'attr2', 'value': 2, 'ts': '2021-08-03T20:38:13Z'}]}
+        assert response.get_header('X-Next-Page-Token')
+
+    @patch('history.api.models.buckets.is_enabled', return_value=True)
+    @patch('history.api.models.HistoryUtil.get_collection')
+    def test_on_get__should_reject_paging__when_bucket_mode_is_enabled(self, mock_get_collection, mock_is_enabled):
+        request = MagicMock()
+        request.params = {'attr': 'attr1', 'pageSize': '2'}
+        with pytest.raises(falcon.HTTPInvalidParam):
+            DeviceHistory.on_get(request, falcon.Response(), 'testid')
+
+
+    @patch('history.api.models.HistoryUtil.get_collection')
+    @patch('history.api.models.DeviceHistory.get_latest')
+    def test_on_get__should_serve_lastN_1_from_latest_values(self, mock_get_latest, mock_get_collection):
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13)
+        mock_get_latest.return_value = {'attr1': {
+            'attr': 'attr1', 'value': 1, 'device_id': 'testid', 'ts': ts, 'metadata': {}}}
+        request = MagicMock()
+        request.params = {'attr': 'attr1', 'lastN': '1'}
+        request.client_prefers.return_value = 'application/json'
+        response = falcon.Response()
+        DeviceHistory.on_get(request, response, 'testid')
+        assert json.loads(response.body) == [
+            {'attr': 'attr1', 'value': 1, 'device_id': 'testid', 'ts': '2021-08-03T20:38:13Z', 'metadata': {}}]
+        assert not mock_get_collection.called
+
+    @patch('history.api.models.HistoryUtil.get_collection')
+    @patch('history.api.models.DeviceHistory.get_multiple_attrs')
+    @patch('history.api.models.DeviceHistory.get_latest')
+    def test_on_get__should_look_up_attrs_missing_from_latest_values_in_history(self, mock_get_latest,
+        mock_get_multiple_attrs, mock_get_collection, mock_get_catalog):
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13)
+        mock_get_latest.return_value = {'attr1': {
+            'attr': 'attr1', 'value': 1, 'device_id': 'testid', 'ts': ts, 'metadata': {}}}
+        mock_get_catalog.return_value = {'attr1': {}, 'attr2': {}}
+        mock_get_multiple_attrs.return_value = {'attr2': [{'attr': 'attr2', 'value': 2}]}
+        request = MagicMock()
+        request.params = {'attr': ['attr1', 'attr2', 'attr3'], 'lastN': '1'}
+        request.client_prefers.return_value = 'application/json'
+        response = falcon.Response()
+        DeviceHistory.on_get(request, response, 'testid')
+        history = json.loads(response.body)
+        assert history['attr1'][0]['value'] == 1
+        assert history['attr2'] == [{'attr': 'attr2', 'value': 2}]
+        assert history['attr3'] == []
+        assert mock_get_multiple_attrs.call_args[0][2] == ['attr2', 'attr3']
+
+    @patch('history.api.models.HistoryUtil.get_collection')
+    @patch('history.api.models.DeviceHistory.get_single_attr', return_value=[{'value': 1}])
+    @patch('history.api.models.DeviceHistory.get_latest', return_value=None)
+    def test_on_get__should_use_history__when_device_has_no_latest_values(self, mock_get_latest,
+        mock_get_single_attr, mock_get_collection):
+        request = MagicMock()
+        request.params = {'attr': 'attr1', 'lastN': '1'}
+        request.client_prefers.return_value = 'application/json'
+        response = falcon.Response()
+        DeviceHistory.on_get(request, response, 'testid')
+        assert json.loads(response.body) == [{'value': 1}]
+
+
+    def test_parse_interval__should_return_milliseconds(self):
+        assert DeviceHistory.parse_interval('30s') == 30 * 1000
+        assert DeviceHistory.parse_interval('5m') == 5 * 60 * 1000
+        assert DeviceHistory.parse_interval('1d') == 24 * 60 * 60 * 1000
+
+    @pytest.mark.parametrize('interval', ['', '5', '0m', '5w', '-5m'])
+    def test_parse_interval__should_raise_invalid_param__when_interval_is_invalid(self, interval):
+        with pytest.raises(falcon.HTTPInvalidParam):
+            DeviceHistory.parse_interval(interval)
+
+    def test_parse_functions__should_accept_comma_separated_and_list_values(self):
+        assert DeviceHistory.parse_functions('avg,max,avg') == ['avg', 'max']
+        assert DeviceHistory.parse_functions(['min', 'last']) == ['min', 'last']
+        assert DeviceHistory.parse_functions(None) == ['avg']
+        with pytest.raises(falcon.HTTPInvalidParam):
+            DeviceHistory.parse_functions('avg,median')
+
+    def test_get_aggregated__should_group_samples_into_time_buckets(self):
+        collection = MagicMock()
+        collection.aggregate.return_value = [
+            {'_id': {'attr': 'attr1', 'ts': datetime.datetime(2021, 8, 3, 20, 35)}, 'avg': 1.5, 'count': 2},
+            {'_id': {'attr': 'attr1', 'ts': datetime.datetime(2021, 8, 3, 20, 40)}, 'avg': 3, 'count': 1},
+        ]
+        query = {'query': {'value': {'$ne': ' '}}, 'filter': {}, 'limit': False,
+                 'sort': [('ts', pymongo.DESCENDING)]}
+        history = DeviceHistory.get_aggregated(collection, query, ['attr1', 'attr2'], 5 * 60 * 1000, ['avg', 'count'])
+
+        assert history == {
+            'attr1': [
+                {'attr': 'attr1', 'ts': '2021-08-03T20:35:00Z', 'avg': 1.5, 'count': 2},
+                {'attr': 'attr1', 'ts': '2021-08-03T20:40:00Z', 'avg': 3, 'count': 1}],
+            'attr2': []}
+        pipeline = collection.aggregate.call_args[0][0]
+        assert pipeline[0] == {'$match': {'value': {'$ne': ' '}, 'attr': {'$in': ['attr1', 'attr2']}}}
+        group = pipeline[2]['$group']
+        assert group['_id']['ts']['$subtract'][1] == {'$mod': [{'$subtract': ['$ts', datetime.datetime(1970, 1, 1)]}, 300000]}
+        assert group['avg'] == {'$avg': '$value'}
+        assert group['count'] == {'$sum': 1}
+
+    @patch('history.api.models.buckets.is_enabled', return_value=True)
+    def test_get_aggregated__should_unwind_samples__when_bucket_mode_is_enabled(self, mock_is_enabled):
+        collection = MagicMock()
+        collection.aggregate.return_value = []
+        query = {'query': {'value': {'$ne': ' '}}, 'filter': {}, 'limit': False,
+                 'sort': [('ts', pymongo.DESCENDING)]}
+        DeviceHistory.get_aggregated(collection, query, ['attr1'], 60000, ['last'])
+        pipeline = collection.aggregate.call_args[0][0]
+        assert {'$unwind': {'path': '$ts', 'includeArrayIndex': 'index'}} in pipeline
+
+    @patch('history.api.models.HistoryUtil.get_collection')
+    @patch('history.api.models.DeviceHistory.get_aggregated', return_value={})
+    @patch('history.api.response_util.build_response_body', return_value='{}')
+    def test_on_get__should_aggregate__when_interval_is_given(self, mock_build_response_body,
+        mock_get_aggregated, mock_get_collection):
+        request = MagicMock()
+        request.params = {'attr': 'attr1', 'interval': '5m', 'fn': 'min,max'}
+        response = falcon.Response()
+        DeviceHistory.on_get(request, response, 'testid')
+        assert response.status == falcon.HTTP_200
+        _, _, attrs, interval, functions = mock_get_aggregated.call_args[0]
+        assert (attrs, interval, functions) == (['attr1'], 300000, ['min', 'max'])
+
+
+class TestDeviceSummary:
+
+    def test_on_get__should_summarize_catalog_entries(self, mock_get_catalog):
+        request = MagicMock()
+        mock_get_catalog.return_value = {'attr1': {
+            'first_ts': datetime.datetime(2021, 8, 3, 20, 38, 13),
+            'last_ts': datetime.datetime(2021, 8, 4, 20, 38, 13),
+            'count': 3
+        }}
+        response = falcon.Response()
+        DeviceSummary.on_get(request, response, 'testid')
+        assert response.status == falcon.HTTP_200
+        assert json.loads(response.body) == {'device_id': 'testid', 'attrs': {'attr1': {
+            'first_ts': '2021-08-03T20:38:13Z', 'last_ts': '2021-08-04T20:38:13Z', 'count': 3}}}
+
+    def test_on_get__should_raise_not_found__when_device_is_not_cataloged(self, mock_get_catalog):
+        with pytest.raises(falcon.HTTPNotFound):
+            DeviceSummary.on_get(MagicMock(), falcon.Response(), 'testid')
+
+
+class TestLatestValues:
+
+    @patch('history.api.models.HistoryUtil.get_db')
+    @patch('history.api.models.latest.snapshot')
+    def test_on_get__should_return_latest_values_by_device(self, mock_snapshot, mock_get_db):
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13)
+        mock_snapshot.return_value = {
+            'dev1': {'attr1': {'attr': 'attr1', 'value': 1, 'ts': ts},
+                     'attr2': {'attr': 'attr2', 'value': 2, 'ts': ts}},
+            'dev2': {'attr2': {'attr': 'attr2', 'value': 3, 'ts': ts}}}
+        request = MagicMock()
+        request.params = {'attr': 'attr1'}
+        request.client_prefers.return_value = 'application/json'
+        response = falcon.Response()
+        LatestValues.on_get(request, response)
+        assert json.loads(response.body) == {
+            'dev1': [{'attr': 'attr1', 'value': 1, 'ts': '2021-08-03T20:38:13Z'}]}
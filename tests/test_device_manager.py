@@ -0,0 +1,66 @@
+import time
+from unittest.mock import MagicMock, patch
+import falcon
+import pytest
+import requests
+from history.api import device_manager
+from history.api.device_manager import AttrsCache
+
+
+class TestFetchAttrs:
+
+    @patch('history.api.device_manager.session.get')
+    def test_unreachable_device_manager_is_a_bad_gateway(self, mock_get):
+        mock_get.side_effect = requests.exceptions.ConnectTimeout('timed out')
+        with pytest.raises(falcon.HTTPBadGateway):
+            device_manager.fetch_attrs('dev', 'token')
+
+
+class TestAttrsCache:
+
+    def test_fresh_entries_are_served_from_cache(self):
+        fetch = MagicMock(return_value=['attr1'])
+        cache = AttrsCache(fetch, max_size=10, ttl=60, stale_ttl=60)
+        assert cache.get('admin', 'dev', 'token') == ['attr1']
+        assert cache.get('admin', 'dev', 'token') == ['attr1']
+        fetch.assert_called_once_with('dev', 'token')
+
+    def test_entries_are_keyed_by_tenant(self):
+        fetch = MagicMock(return_value=['attr1'])
+        cache = AttrsCache(fetch, max_size=10, ttl=60, stale_ttl=60)
+        cache.get('admin', 'dev', 'token')
+        cache.get('other', 'dev', 'token')
+        assert fetch.call_count == 2
+
+    def test_least_recently_used_entry_is_evicted(self):
+        fetch = MagicMock(return_value=['attr1'])
+        cache = AttrsCache(fetch, max_size=2, ttl=60, stale_ttl=60)
+        cache.get('admin', 'dev1', 'token')
+        cache.get('admin', 'dev2', 'token')
+        cache.get('admin', 'dev1', 'token')
+        cache.get('admin', 'dev3', 'token')
+        assert list(cache.entries) == [('admin', 'dev1'), ('admin', 'dev3')]
+
+    def test_stale_entry_is_served_while_refreshed(self):
+        fetch = MagicMock(side_effect=[['attr1'], ['attr1', 'attr2']])
+        cache = AttrsCache(fetch, max_size=10, ttl=0.01, stale_ttl=60)
+        cache.get('admin', 'dev', 'token')
+        time.sleep(0.02)
+        assert cache.get('admin', 'dev', 'token') == ['attr1']
+        cache.executor.shutdown(wait=True)
+        assert cache.entries[('admin', 'dev')][0] == ['attr1', 'attr2']
+        assert fetch.call_count == 2
+
+    def test_expired_entry_is_fetched_again(self):
+        fetch = MagicMock(side_effect=[['attr1'], ['attr2']])
+        cache = AttrsCache(fetch, max_size=10, ttl=0, stale_ttl=0)
+        cache.get('admin', 'dev', 'token')
+        assert cache.get('admin', 'dev', 'token') == ['attr2']
+        assert fetch.call_count == 2
+
+    def test_failed_fetch_is_not_cached(self):
+        fetch = MagicMock(side_effect=[falcon.HTTPBadGateway(), ['attr1']])
+        cache = AttrsCache(fetch, max_size=10, ttl=60, stale_ttl=60)
+        with pytest.raises(falcon.HTTPBadGateway):
+            cache.get('admin', 'dev', 'token')
+        assert cache.get('admin', 'dev', 'token') == ['attr1']
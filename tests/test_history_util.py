@@ -7,10 +7,22 @@ from history.api.models import HistoryUtil
 class MockDBCol:
     def collection_names(self):
         return ['service_item','tenant_id']
+
+    def command(self, name, filter):
+        names = [n for n in self.collection_names() if n == filter['name']]
+        return {'cursor': {'firstBatch': [{'name': n} for n in names]}}
     
     def __getitem__(self, key):
         return str(key)
 
+
+@pytest.fixture(autouse=True)
+def clear_known_collections():
+    HistoryUtil.known_collections.clear()
+    yield
+    HistoryUtil.known_collections.clear()
+
+
 class TestHistoryUtil:
 
     @patch.object(HistoryUtil,'get_db')
@@ -25,6 +37,36 @@ class TestHistoryUtil:
             mock_db.collection_names.return_value = []
             HistoryUtil.get_collection('service','item')
 
+    @patch.object(HistoryUtil, 'get_db')
+    def test_get_collection_is_looked_up_once(self, mock_db):
+        db = MockDBCol()
+        db.command = Mock(wraps=db.command)
+        mock_db.return_value = db
+        HistoryUtil.get_collection('service', 'item')
+        HistoryUtil.get_collection('service', 'item')
+        db.command.assert_called_once_with('listCollections', filter={'name': 'service_item'})
+
+    @patch.object(HistoryUtil, 'get_db')
+    def test_get_collection_misses_are_looked_up_again(self, mock_db):
+        db = MockDBCol()
+        db.command = Mock(wraps=db.command)
+        mock_db.return_value = db
+        for _ in range(2):
+            with pytest.raises(falcon.HTTPNotFound):
+                HistoryUtil.get_collection('service', 'other')
+        assert db.command.call_count == 2
+
+    @patch('history.api.models.conf.collection_cache_ttl', 0)
+    @patch.object(HistoryUtil, 'get_db')
+    def test_get_collection_forgets_dropped_collections(self, mock_db):
+        db = MockDBCol()
+        mock_db.return_value = db
+        HistoryUtil.get_collection('service', 'item')
+        db.collection_names = lambda: []
+        with pytest.raises(falcon.HTTPNotFound):
+            HistoryUtil.get_collection('service', 'item')
+        assert 'service_item' not in HistoryUtil.known_collections
+
     def test_check_type_string(self):
         assert HistoryUtil.check_type('"test"') == "string"
     
@@ -44,3 +86,9 @@ class TestHistoryUtil:
     def test_model_value_wrong_type(self):
         with pytest.raises(ValueError):
             assert HistoryUtil.model_value("value", "int")
+
+    def test_handle_timeout__should_answer_gateway_timeout(self):
+        with pytest.raises(falcon.HTTPError) as error:
+            HistoryUtil.handle_timeout(pymongo.errors.ExecutionTimeout('operation exceeded time limit'),
+                                       MagicMock(), MagicMock(), {})
+        assert error.value.status == falcon.HTTP_504
@@ -0,0 +1,68 @@
+import threading
+from unittest.mock import MagicMock
+from history.subscriber.index_manager import IndexManager
+
+
+class TestIndexManager:
+
+    def test_ensure_creates_indexes_in_background(self):
+        create_indexes = MagicMock()
+        manager = IndexManager(create_indexes, workers=2)
+        manager.ensure('admin_dev')
+        manager.wait()
+        create_indexes.assert_called_once_with('admin_dev')
+        assert 'admin_dev' in manager.known
+
+    def test_ensure_skips_known_collections(self):
+        create_indexes = MagicMock()
+        manager = IndexManager(create_indexes, workers=2)
+        manager.ensure('admin_dev')
+        manager.wait()
+        assert manager.ensure('admin_dev') is None
+        assert create_indexes.call_count == 1
+
+    def test_ensure_does_not_queue_twice_while_in_flight(self):
+        release = threading.Event()
+        create_indexes = MagicMock(side_effect=lambda name: release.wait(1))
+        manager = IndexManager(create_indexes, workers=2)
+        first = manager.ensure('admin_dev')
+        second = manager.ensure('admin_dev')
+        release.set()
+        manager.wait()
+        assert first is second
+        assert create_indexes.call_count == 1
+
+    def test_failed_creation_is_retried(self):
+        create_indexes = MagicMock(side_effect=[Exception('mongo down'), None])
+        manager = IndexManager(create_indexes, workers=1, retry_interval=0)
+        manager.ensure('admin_dev')
+        manager.wait()
+        assert 'admin_dev' not in manager.known
+        manager.ensure('admin_dev')
+        manager.wait()
+        assert create_indexes.call_count == 2
+        assert 'admin_dev' in manager.known
+
+    def test_bootstrap_waits_for_all_collections(self):
+        create_indexes = MagicMock()
+        manager = IndexManager(create_indexes, workers=4)
+        manager.bootstrap(['t1_notifications', 't2_notifications', 't3_notifications'])
+        assert create_indexes.call_count == 3
+        assert manager.known == {'t1_notifications', 't2_notifications', 't3_notifications'}
+
+    def test_failed_creation_backs_off(self):
+        create_indexes = MagicMock(side_effect=Exception('duplicate key'))
+        manager = IndexManager(create_indexes, workers=1, retry_interval=60)
+        manager.ensure('latest')
+        manager.wait()
+        assert manager.ensure('latest') is None
+        assert create_indexes.call_count == 1
+
+    def test_create_runs_in_calling_thread(self):
+        create_indexes = MagicMock()
+        manager = IndexManager(create_indexes, workers=1)
+        assert manager.create('latest')
+        assert 'latest' in manager.known
+        assert manager.executor is None
+        create_indexes.side_effect = Exception('mongo down')
+        assert not manager.create('catalog')
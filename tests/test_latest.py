@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from pymongo import UpdateOne
+from history import latest
+
+
+class TestLatest:
+
+    def test_value_update_keeps_the_newest_sample_of_each_attr(self):
+        ts = datetime(2021, 8, 3, 20, 38, 13, tzinfo=timezone.utc)
+        operation = latest.value_update('admin', 'dev', {'temperature': 23.4, 'a.b': 1, 'blank': ' '},
+                                        ts, {'unit': 'C'})
+        assert operation == UpdateOne(
+            {'tenant': 'admin', 'device_id': 'dev'},
+            {'$max': {'attrs.temperature': {
+                'ts': datetime(2021, 8, 3, 20, 38, 13), 'value': 23.4, 'metadata': {'unit': 'C'}}}},
+            upsert=True)
+
+    def test_value_update_returns_none__when_no_attr_can_be_stored(self):
+        assert latest.value_update('admin', 'dev', {'$set': 1}, datetime.utcnow(), {}) is None
+
+    def test_lookup_returns_unexpired_values_as_history_documents(self):
+        db = MagicMock()
+        ts = datetime.utcnow()
+        db['latest'].find.return_value.__iter__.return_value = [{'attrs': {
+            'temperature': {'ts': ts, 'value': 23.4, 'metadata': {}},
+            'humidity': {'ts': ts - timedelta(days=365), 'value': 40, 'metadata': {}}}}]
+        assert latest.lookup(db, 'admin', 'dev') == {'temperature': {
+            'attr': 'temperature', 'value': 23.4, 'device_id': 'dev', 'ts': ts, 'metadata': {}}}
+
+    def test_lookup_returns_none__when_device_has_no_document(self):
+        db = MagicMock()
+        db['latest'].find.return_value.__iter__.return_value = []
+        assert latest.lookup(db, 'admin', 'dev') is None
+
+    def test_snapshot_returns_values_by_device(self):
+        db = MagicMock()
+        ts = datetime.utcnow()
+        db['latest'].find.return_value.__iter__.return_value = [
+            {'device_id': 'dev1', 'attrs': {'temperature': {'ts': ts, 'value': 1, 'metadata': {}}}},
+            {'device_id': 'dev2', 'attrs': {}}]
+        snapshot = latest.snapshot(db, 'admin')
+        assert snapshot['dev1']['temperature']['value'] == 1
+        assert snapshot['dev2'] == {}
+        assert db['latest'].find.call_args[0][0] == {'tenant': 'admin'}
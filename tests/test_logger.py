@@ -0,0 +1,44 @@
+import logging
+import queue
+from unittest.mock import patch
+from history.Logger import RateLimitFilter, NonBlockingQueueHandler
+
+
+def make_record(lineno=10, msg='message'):
+    return logging.LogRecord('history', logging.INFO, 'persister.py', lineno, msg, None, None)
+
+
+class TestRateLimitFilter:
+
+    def test_limits_records_per_call_site(self):
+        rate_filter = RateLimitFilter(2, period=60)
+        allowed = [rate_filter.filter(make_record()) for _ in range(5)]
+        assert allowed == [True, True, False, False, False]
+
+    def test_call_sites_are_limited_independently(self):
+        rate_filter = RateLimitFilter(1, period=60)
+        assert rate_filter.filter(make_record(lineno=10))
+        assert rate_filter.filter(make_record(lineno=20))
+        assert not rate_filter.filter(make_record(lineno=10))
+
+    @patch('history.Logger.time.monotonic')
+    def test_reports_suppressed_records_on_next_period(self, mock_monotonic):
+        rate_filter = RateLimitFilter(1, period=1)
+        mock_monotonic.return_value = 100
+        rate_filter.filter(make_record())
+        rate_filter.filter(make_record())
+        rate_filter.filter(make_record())
+        mock_monotonic.return_value = 101
+        record = make_record()
+        assert rate_filter.filter(record)
+        assert record.getMessage() == 'message (2 similar messages suppressed)'
+
+
+class TestNonBlockingQueueHandler:
+
+    def test_drops_records_when_queue_is_full(self):
+        handler = NonBlockingQueueHandler(queue.Queue(1))
+        handler.emit(make_record())
+        handler.emit(make_record())
+        assert handler.queue.qsize() == 1
+        assert handler.dropped == 1
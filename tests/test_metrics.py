@@ -0,0 +1,49 @@
+import falcon
+from datetime import datetime, timedelta, timezone
+from history.subscriber import metrics
+
+
+class TestMetrics:
+
+    def test_counter_render(self):
+        counter = metrics.Counter('test_total', 'Test counter', ('handler',))
+        counter.inc(handler='device_data')
+        counter.inc(2, handler='device_data')
+        counter.inc(handler='notifications')
+        assert counter.render() == (
+            '# HELP test_total Test counter\n'
+            '# TYPE test_total counter\n'
+            'test_total{handler="device_data"} 3.0\n'
+            'test_total{handler="notifications"} 1.0')
+
+    def test_histogram_render(self):
+        histogram = metrics.Histogram('test_seconds', 'Test histogram', ('writer',), buckets=(0.1, 1))
+        histogram.observe(0.05, writer='data')
+        histogram.observe(0.5, writer='data')
+        histogram.observe(5, writer='data')
+        assert histogram.count(writer='data') == 3
+        assert histogram.samples() == [
+            'test_seconds_bucket{writer="data",le="0.1"} 1',
+            'test_seconds_bucket{writer="data",le="1.0"} 2',
+            'test_seconds_bucket{writer="data",le="+Inf"} 3',
+            'test_seconds_sum{writer="data"} 5.55',
+            'test_seconds_count{writer="data"} 3']
+
+    def test_gauge_reads_collect_function(self):
+        gauge = metrics.Gauge('test_depth', 'Test gauge', 'stage')
+        gauge.collect = lambda: {'device_data': 3, 'notifications': 0}
+        assert gauge.samples() == ['test_depth{stage="device_data"} 3.0',
+                                   'test_depth{stage="notifications"} 0.0']
+
+    def test_seconds_since(self):
+        assert 59 < metrics.seconds_since(datetime.utcnow() - timedelta(seconds=60)) < 61
+        aware = datetime.now(timezone.utc) - timedelta(seconds=60)
+        assert 59 < metrics.seconds_since(aware) < 61
+
+    def test_metrics_interface(self):
+        resp = falcon.Response()
+        metrics.MetricsInterface.on_get(None, resp)
+        assert resp.status == falcon.HTTP_200
+        assert resp.content_type.startswith('text/plain')
+        assert '# TYPE persister_messages_total counter' in resp.body
+        assert '# TYPE persister_mongo_write_seconds histogram' in resp.body
@@ -0,0 +1,73 @@
+from unittest.mock import MagicMock, patch
+import pymongo.common
+from history import mongo
+
+
+class TestMongo:
+
+    @patch('history.mongo.conf.db_socket_timeout_ms', 0)
+    @patch('history.mongo.conf.db_wait_queue_timeout_ms', 0)
+    def test_client_options__should_leave_out_disabled_timeouts(self):
+        options = mongo.client_options()
+        assert 'socketTimeoutMS' not in options
+        assert 'waitQueueTimeoutMS' not in options
+        assert options['maxPoolSize'] == 100
+
+    @patch('history.mongo.conf.db_socket_timeout_ms', 5000)
+    @patch('history.mongo.conf.db_wait_queue_timeout_ms', 1000)
+    def test_client_options__should_set_configured_timeouts(self):
+        options = mongo.client_options()
+        assert options['socketTimeoutMS'] == 5000
+        assert options['waitQueueTimeoutMS'] == 1000
+
+    @patch('history.mongo.conf.db_read_preference', 'secondary')
+    @patch('history.mongo.conf.db_max_staleness', 120)
+    @patch('history.mongo.conf.db_read_concern', 'majority')
+    def test_read_options__should_route_reads(self):
+        assert mongo.read_options() == {'readPreference': 'secondary', 'maxStalenessSeconds': 120,
+                                        'readConcernLevel': 'majority'}
+
+    @patch('history.mongo.conf.db_read_preference', 'primary')
+    @patch('history.mongo.conf.db_max_staleness', 120)
+    @patch('history.mongo.conf.db_read_concern', '')
+    def test_read_options__should_not_bound_staleness__when_reading_from_primary(self):
+        assert mongo.read_options() == {'readPreference': 'primary'}
+
+    @patch('history.mongo.pymongo.MongoClient')
+    def test_reader__should_create_client_with_pool_and_read_options(self, mock_client):
+        mongo.reader()
+        _, kwargs = mock_client.call_args
+        assert kwargs['readPreference'] == 'secondaryPreferred'
+        assert kwargs['maxPoolSize'] == 100
+        assert 'replicaSet' in kwargs
+
+    @patch('history.mongo.pymongo.MongoClient')
+    def test_client__should_not_route_reads(self, mock_client):
+        mongo.client()
+        assert 'readPreference' not in mock_client.call_args[1]
+
+    @patch('history.mongo.conf.db_max_time_ms', 2000)
+    def test_max_time__should_bound_cursor_and_commands(self):
+        cursor = MagicMock()
+        assert mongo.max_time(cursor) is cursor
+        cursor.max_time_ms.assert_called_once_with(2000)
+        assert mongo.command_options() == {'maxTimeMS': 2000}
+
+    @patch('history.mongo.conf.db_max_time_ms', 0)
+    def test_max_time__should_not_bound__when_disabled(self):
+        cursor = MagicMock()
+        mongo.max_time(cursor)
+        assert not cursor.max_time_ms.called
+        assert mongo.command_options() == {}
+
+    @patch('history.mongo.conf.db_min_pool_size', 5)
+    @patch('history.mongo.conf.db_read_preference', 'secondary')
+    @patch('history.mongo.conf.db_max_staleness', 120)
+    def test_options__should_leave_out_options_unknown_to_the_driver(self):
+        validators = {name: check for name, check in pymongo.common.VALIDATORS.items()
+                      if name not in ('minpoolsize', 'maxstalenessseconds')}
+        with patch.object(pymongo.common, 'VALIDATORS', validators), \
+                patch('history.mongo.logger') as mock_logger:
+            assert 'minPoolSize' not in mongo.client_options()
+            assert 'maxStalenessSeconds' not in mongo.read_options()
+        assert mock_logger.warning.call_count == 2
@@ -26,6 +26,62 @@ class TestNotificationHistory:
         NotificationHistory.on_get(req,resp)
         assert resp.status == falcon.HTTP_200
     
+    @patch('history.api.models.conf.api_stream_responses', True)
+    @patch.object(HistoryUtil, 'get_collection')
+    def test_notification_on_get__should_stream__when_streaming_is_enabled(self, mock_get_collection):
+        mock_get_collection.return_value.find.return_value.__iter__.return_value = iter([
+            {"subject": "user_notification", "ts": datetime.datetime(2019, 2, 20, 17, 17, 52)}])
+        req = MagicMock()
+        req.params = {}
+        req.client_prefers.return_value = 'application/json'
+        resp = falcon.Response()
+        NotificationHistory.on_get(req, resp)
+        assert resp.status == falcon.HTTP_200
+        assert resp.content_type == 'application/json'
+        assert json.loads(b''.join(resp.stream)) == {"notifications": [
+            {"subject": "user_notification", "ts": "2019-02-20T17:17:52Z"}]}
+
+    @patch('history.api.models.conf.api_stream_responses', True)
+    @patch.object(HistoryUtil, 'get_collection')
+    def test_notification_on_get__should_not_stream_json__when_csv_is_preferred(self, mock_get_collection):
+        mock_get_collection.return_value.find.return_value.__iter__.return_value = [
+            {"subject": "user_notification", "ts": datetime.datetime(2019, 2, 20, 17, 17, 52)}]
+        req = falcon.Request(testing.create_environ(
+            headers={'Accept': 'text/csv;q=1, application/json;q=0.5'}))
+        req.context['related_service'] = 'admin'
+        resp = falcon.Response()
+        NotificationHistory.on_get(req, resp)
+        assert resp.stream is None
+        assert resp.content_type == 'text/csv'
+
+    @patch.object(HistoryUtil, 'get_collection')
+    def test_notification_on_get__should_return_a_page__when_pageSize_is_given(self, mock_get_collection):
+        mock_get_collection.return_value.find.return_value.__iter__.return_value = [
+            {"_id": 1, "subject": "user_notification", "ts": datetime.datetime(2019, 2, 20, 17, 17, 52)}]
+        req = MagicMock()
+        req.params = {"pageSize": "10", "subject": "\"user_notification\""}
+        req.client_prefers.return_value = 'application/json'
+        resp = falcon.Response()
+        NotificationHistory.on_get(req, resp)
+        query = mock_get_collection.return_value.find.call_args[0][0]
+        assert "pageSize" not in query
+        assert json.loads(resp.body) == {"notifications": [
+            {"subject": "user_notification", "ts": "2019-02-20T17:17:52Z"}]}
+        assert resp.get_header("X-Next-Page-Token") is None
+
+    @patch.object(HistoryUtil, 'get_collection')
+    def test_notification_on_get__should_return_a_single_row_csv__when_accept_is_csv(self, mock_get_collection):
+        mock_get_collection.return_value.find.return_value.__iter__.return_value = [
+            {"subject": "user_notification", "ts": datetime.datetime(2019, 2, 20, 17, 17, 52)}]
+        req = falcon.Request(testing.create_environ(headers={'Accept': 'text/csv'}))
+        req.context['related_service'] = 'admin'
+        resp = falcon.Response()
+        NotificationHistory.on_get(req, resp)
+        assert resp.status == falcon.HTTP_200
+        assert resp.content_type == 'text/csv'
+        assert resp.body == ('"notifications"\n'
+                             '"[{\'subject\': \'user_notification\', \'ts\': \'2019-02-20T17:17:52Z\'}]"\n')
+
     def test_get_query(self):
         with patch.object(HistoryUtil,'model_value') as mock_model_value:
             mock_model_value.return_value = 'bar'
@@ -0,0 +1,60 @@
+import datetime
+import pytest
+import falcon
+import pymongo
+from unittest.mock import MagicMock, patch
+from bson import ObjectId
+from history.api import paging
+
+
+def make_request(params):
+    request = MagicMock()
+    request.params = params
+    return request
+
+
+class TestPaging:
+
+    def test_parse__should_return_none__when_request_is_not_paginated(self):
+        assert paging.parse(make_request({'lastN': '10'})) is None
+
+    def test_parse__should_read_size_and_order(self):
+        page = paging.parse(make_request({'pageSize': '50', 'order': 'asc'}))
+        assert page.size == 50
+        assert page.sort == [('ts', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]
+        assert page.after is None
+
+    @pytest.mark.parametrize('params', [
+        {'pageSize': 'ten'}, {'pageSize': '0'}, {'pageSize': '10', 'order': 'sideways'},
+        {'pageToken': 'not a token'}])
+    def test_parse__should_raise_invalid_param__when_params_are_invalid(self, params):
+        with pytest.raises(falcon.HTTPInvalidParam):
+            paging.parse(make_request(params))
+
+    @patch('history.api.paging.conf.api_max_page_size', 100)
+    def test_parse__should_reject_pages_above_the_maximum_size(self):
+        with pytest.raises(falcon.HTTPInvalidParam):
+            paging.parse(make_request({'pageSize': '101'}))
+
+    def test_find__should_return_a_token_that_seeks_past_the_page(self):
+        ts = datetime.datetime(2021, 8, 3, 20, 38, 13, tzinfo=datetime.timezone.utc)
+        ids = [ObjectId() for _ in range(3)]
+        collection = MagicMock()
+        collection.find.return_value.__iter__.return_value = [{'_id': _id, 'attr': 'a', 'ts': ts} for _id in ids]
+        page = paging.Page(2)
+
+        docs, token = page.find(collection, {'attr': 'a'}, {'_id': False})
+        assert docs == [{'attr': 'a', 'ts': ts}, {'attr': 'a', 'ts': ts}]
+        collection.find.assert_called_once_with(
+            {'attr': 'a'}, None, sort=page.sort, limit=3)
+
+        following = paging.parse(make_request({'pageToken': token, 'pageSize': '2'}))
+        assert following.after == (ts, ids[1])
+        assert following.direction == pymongo.DESCENDING
+        assert following.seek({'attr': 'a'}) == {'$and': [
+            {'attr': 'a'}, {'$or': [{'ts': {'$lt': ts}}, {'ts': ts, '_id': {'$lt': ids[1]}}]}]}
+
+    def test_find__should_not_return_a_token__on_the_last_page(self):
+        collection = MagicMock()
+        collection.find.return_value.__iter__.return_value = [{'_id': ObjectId(), 'ts': datetime.datetime.utcnow()}]
+        assert paging.Page(2).find(collection, {}, {})[1] is None
@@ -0,0 +1,56 @@
+import threading
+from unittest.mock import MagicMock
+from history.subscriber.pipeline import Stage, Pipeline
+
+
+class TestStage:
+
+    def test_workers_run_handler(self):
+        handler = MagicMock()
+        stage = Stage('test', handler, workers=2, queue_size=10)
+        stage.start()
+        stage.put('admin', 'message1')
+        stage.put('admin', 'message2')
+        stage.stop()
+        handler.assert_any_call('admin', 'message1')
+        handler.assert_any_call('admin', 'message2')
+        assert stage.threads == []
+
+    def test_handler_failure_does_not_stop_worker(self):
+        handler = MagicMock(side_effect=[Exception('boom'), None])
+        stage = Stage('test', handler, workers=1, queue_size=10)
+        stage.start()
+        stage.put('admin', 'message1')
+        stage.put('admin', 'message2')
+        stage.stop()
+        assert handler.call_count == 2
+
+    def test_put_blocks_when_queue_is_full(self):
+        release = threading.Event()
+        stage = Stage('test', lambda *args: release.wait(1), workers=1, queue_size=1)
+        stage.start()
+        stage.put('first')
+        stage.put('second')
+        blocked = threading.Thread(target=stage.put, args=('third',))
+        blocked.start()
+        blocked.join(0.1)
+        assert blocked.is_alive()
+        release.set()
+        blocked.join(1)
+        assert not blocked.is_alive()
+        stage.stop()
+
+
+class TestPipeline:
+
+    def test_add_stage_and_depths(self):
+        pipeline = Pipeline()
+        release = threading.Event()
+        stage = pipeline.add_stage('device_data', lambda *args: release.wait(1), workers=1, queue_size=5)
+        stage.put('a')
+        stage.put('b')
+        stage.put('c')
+        assert pipeline.depths()['device_data'] >= 2
+        release.set()
+        pipeline.stop()
+        assert pipeline.depths() == {'device_data': 0}
@@ -2,8 +2,12 @@ import pytest
 import falcon
 import json
 from unittest.mock import MagicMixin, MagicMock
+from falcon import testing
+from history.api import response_util
 
-from history.api.response_util import validate_accept_header, build_response_body
+from history.api.response_util import validate_accept_header, build_response_body, \
+    json_array_chunks, json_object_chunks, embed_json_array, csv_chunks, csv_text, stream_array, stream_groups, \
+    set_body, json_map_chunks, PLACEHOLDER
 
 class TestResponseUtil:
     
@@ -30,32 +34,52 @@ class TestResponseUtil:
     
     def test_validate_accept_header__should_not_raised_exception__when_http_accept_is_supported(self):
         request = MagicMock()
-        request.client_accepts = lambda accept : True
+        request.client_prefers.return_value = "application/json"
         
         validate_accept_header(request)
         
     def test_validate_accept_header__should_raised_http_not_acceptable_exception__when_http_accept_is_not_supported(self):
         request = MagicMock()
-        request.client_accepts = lambda accept : False
+        request.client_prefers.return_value = None
         with pytest.raises(falcon.HTTPNotAcceptable):
             validate_accept_header(request)
 
+    @pytest.mark.parametrize('accept, expected', [
+        (None, 'application/json'),
+        ('*/*', 'application/json'),
+        ('application/json, text/csv', 'application/json'),
+        ('text/csv;q=0.5, application/json;q=0.4', 'text/csv'),
+        ('application/x-ndjson, */*;q=0.1', 'application/x-ndjson'),
+    ])
+    def test_media_type__should_honor_accept_quality_values(self, accept, expected):
+        headers = {'Accept': accept} if accept else {}
+        assert response_util.media_type(falcon.Request(testing.create_environ(headers=headers))) == expected
+
+    def test_media_type__should_prefer_binary_formats__when_client_ranks_them_first(self):
+        if response_util.msgpack is None or response_util.pyarrow is None:
+            pytest.skip('msgpack and pyarrow are optional')
+        for accept, expected in (
+                ('application/vnd.apache.arrow.stream, */*;q=0.1', 'application/vnd.apache.arrow.stream'),
+                ('application/msgpack;q=1, application/json;q=0.5', 'application/msgpack')):
+            request = falcon.Request(testing.create_environ(headers={'Accept': accept}))
+            assert response_util.media_type(request) == expected
+
     def test_build_response_body__should_return_a_json__when_accept_is_json(self):
         request = MagicMock()
-        request.client_accepts = lambda accept : accept == "application/json"
+        request.client_prefers = lambda types: "application/json" if "application/json" in types else None
 
         assert build_response_body(request, self.mock_history) == json.dumps(self.mock_history)
             
     def test_build_response_body__should_return_a_csv__when_accept_is_csv(self):
         request = MagicMock()
-        request.client_accepts = lambda accept : accept == "text/csv"
+        request.client_prefers = lambda types: "text/csv" if "text/csv" in types else None
         except_csv = '"attr","value","device_id","ts"\n"attr1","teste","teste","2021-08-03T20:38:13.389000Z"\n'
 
         assert build_response_body(request, self.mock_history["attr1"]) == except_csv
             
     def test_build_response_body__should__return_a_csv__when_accept_is_csv_and_a_parser_entered(self):
         request = MagicMock()
-        request.client_accepts = lambda accept : accept == "text/csv"             
+        request.client_prefers = lambda types: "text/csv" if "text/csv" in types else None             
         mock_parse = lambda history : self.mock_history["attr1"] + self.mock_history["attr2"]
         except_csv = '"attr","value","device_id","ts"\n"attr1","teste","teste","2021-08-03T20:38:13.389000Z"\n"attr2","teste","teste","2021-08-03T20:38:13.389000Z"\n'
 
@@ -63,6 +87,114 @@ class TestResponseUtil:
             
     def test_build_response_body__should_raised_a_http_not_acceptable_exception__when_accept_is_not_supported(self):
         request = MagicMock()
-        request.client_accepts = lambda accept : False
+        request.client_prefers.return_value = None
         with pytest.raises(falcon.HTTPNotAcceptable):
-            build_response_body(request, self.mock_history)
\ No newline at end of file
+            build_response_body(request, self.mock_history)
+
+    def test_json_array_chunks__should_match_json_dumps(self):
+        docs = self.mock_history["attr1"] + self.mock_history["attr2"]
+        chunks = list(json_array_chunks(iter(docs), chunk_size=10))
+        assert len(chunks) > 1
+        assert b''.join(chunks).decode('utf-8') == json.dumps(docs)
+        assert b''.join(json_array_chunks(iter([]))) == b'[]'
+
+    def test_json_object_chunks__should_match_json_dumps(self):
+        items = [(attr, iter(docs)) for attr, docs in self.mock_history.items()]
+        assert b''.join(json_object_chunks(items)).decode('utf-8') == json.dumps(self.mock_history)
+        assert b''.join(json_object_chunks([])) == b'{}'
+
+    def test_json_map_chunks__should_match_json_dumps(self):
+        items = {"dev1": self.mock_history, "dev2": {}}
+        assert json.loads(b''.join(json_map_chunks(iter(items.items())))) == items
+        assert b''.join(json_map_chunks(iter([]))) == b'{}'
+
+    def test_embed_json_array__should_replace_placeholder(self):
+        document = {"notifications": PLACEHOLDER, "other": 1}
+        docs = self.mock_history["attr1"]
+        assert b''.join(embed_json_array(document, iter(docs))).decode('utf-8') == \
+            json.dumps({"notifications": docs, "other": 1})
+
+
+    def test_csv_chunks__should_stream_in_several_chunks(self):
+        docs = self.mock_history["attr1"] * 100
+        chunks = list(csv_chunks(iter(docs), chunk_size=256))
+        assert len(chunks) > 1
+        assert b''.join(chunks).decode('utf-8') == ''.join(csv_text(docs, lookahead=None))
+
+    def test_csv_text__should_decide_columns_from_lookahead(self):
+        docs = [{"a": 1}, {"a": 2, "b": "late"}]
+        assert ''.join(csv_text(docs, lookahead=1)) == '"a"\n1\n2\n'
+
+    @pytest.mark.parametrize('docs', [
+        [],
+        [{"a": 1, "b": "x", "m": {}}, {"a": 2, "b": "y", "m": {"k": 1}}],
+        [{"a": 1.5, "b": None}, {"a": 2, "b": "y"}],
+        [{"v": 1}, {"v": "s"}, {"v": 2.5}, {"v": True}, {"v": None}, {"v": [1, 2]}, {"v": {"x": 1}}],
+        [{"v": True}, {"v": False}],
+        [{"v": 1e20}, {"v": 0.1}, {"v": -3}],
+        [{"v": 'a"b,c\nd'}],
+        [{"v": 1}, {"w": 2}],
+        [{"v": {"x": {"y": 1}}, "z": [{"a": 1}]}],
+        [{"v": float('nan')}, {"v": 1}],
+        [{"v": float('nan')}, {"v": "s"}, {"v": 2}],
+        [{"v": 1}, {"v": None}, {"v": 2}],
+        [{"v": True}, {"v": None}],
+    ])
+    def test_csv_text__should_match_pandas(self, docs):
+        pd = pytest.importorskip('pandas')
+        import csv
+        import io
+        expected = io.StringIO()
+        pd.json_normalize(docs).to_csv(expected, index=False, quotechar='"', encoding="utf-8",
+                                       quoting=csv.QUOTE_NONNUMERIC)
+        assert ''.join(csv_text(docs, lookahead=None)) == expected.getvalue()
+
+    def test_stream_array__should_stream_csv__when_accept_is_csv(self):
+        request = MagicMock()
+        request.client_prefers = lambda types: "text/csv" if "text/csv" in types else None
+        except_csv = '"attr","value","device_id","ts"\n"attr1","teste","teste","2021-08-03T20:38:13.389000Z"\n'
+
+        assert b''.join(stream_array(request, iter(self.mock_history["attr1"]))).decode('utf-8') == except_csv
+
+    def test_build_response_body__should_return_ndjson_rows__when_accept_is_ndjson(self):
+        request = MagicMock()
+        request.client_prefers = lambda types: "application/x-ndjson" if "application/x-ndjson" in types else None
+        body = build_response_body(request, self.mock_history)
+        assert [json.loads(line) for line in body.splitlines()] == \
+            self.mock_history["attr1"] + self.mock_history["attr2"]
+
+    def test_build_response_body__should_return_msgpack__when_accept_is_msgpack(self):
+        msgpack = pytest.importorskip("msgpack")
+        request = MagicMock()
+        request.client_prefers = lambda types: "application/msgpack" if "application/msgpack" in types else None
+        assert msgpack.unpackb(build_response_body(request, self.mock_history)) == self.mock_history
+
+    def test_build_response_body__should_return_arrow_columns__when_accept_is_arrow(self):
+        pyarrow = pytest.importorskip("pyarrow")
+        request = MagicMock()
+        request.client_prefers = lambda types: "application/vnd.apache.arrow.stream" if "application/vnd.apache.arrow.stream" in types else None
+        history = {"attr1": [{"attr": "attr1", "value": 1.5, "ts": "2021-08-03T20:38:13.389000Z",
+                              "metadata": {"unit": "C"}},
+                             {"attr": "attr1", "value": "off", "ts": "2021-08-03T20:38:14Z", "metadata": {}}]}
+        body = build_response_body(request, history)
+        table = pyarrow.ipc.open_stream(body).read_all()
+        assert table.column_names == ["attr", "value", "ts", "metadata.unit"]
+        assert table.column("value").to_pylist() == ["1.5", "off"]
+        assert table.schema.field("ts").type == pyarrow.timestamp("us", tz="UTC")
+        assert table.column("metadata.unit").to_pylist() == ["C", None]
+
+    def test_set_body__should_set_content_type_and_binary_data(self):
+        pytest.importorskip("msgpack")
+        request = MagicMock()
+        request.client_prefers = lambda types: "application/msgpack" if "application/msgpack" in types else None
+        response = falcon.Response()
+        set_body(request, response, self.mock_history)
+        assert response.content_type == "application/msgpack"
+        assert isinstance(response.data, bytes)
+
+    def test_stream_groups__should_stream_ndjson_rows__when_accept_is_ndjson(self):
+        request = MagicMock()
+        request.client_prefers = lambda types: "application/x-ndjson" if "application/x-ndjson" in types else None
+        items = [(attr, iter(docs)) for attr, docs in self.mock_history.items()]
+        lines = b''.join(stream_groups(request, items)).decode('utf-8').splitlines()
+        assert [json.loads(line)["attr"] for line in lines] == ["attr1", "attr2"]
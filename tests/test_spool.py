@@ -0,0 +1,129 @@
+import os
+from datetime import datetime
+from unittest.mock import MagicMock
+import pytest
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure
+from history.subscriber.spool import Spool, Replayer
+from history.subscriber.write_buffer import WriteBuffer
+
+
+class TestSpool:
+
+    def test_append_and_peek(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_size=4096)
+        ts = datetime(2021, 8, 3, 20, 38, 13)
+        spool.append('admin_dev', [InsertOne({'attr': 'a', 'ts': ts}),
+                                   UpdateOne({'attr': 'b'}, {'$inc': {'count': 1}}, upsert=True)])
+        collection_name, operations = spool.peek()
+        assert collection_name == 'admin_dev'
+        assert operations[0] == InsertOne({'attr': 'a', 'ts': ts})
+        assert operations[1] == UpdateOne({'attr': 'b'}, {'$inc': {'count': 1}}, upsert=True)
+
+    def test_ack_moves_to_next_batch(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_size=4096)
+        spool.append('admin_dev1', [InsertOne({'attr': 'a'})])
+        spool.append('admin_dev2', [InsertOne({'attr': 'b'})])
+        spool.ack()
+        assert spool.peek()[0] == 'admin_dev2'
+        spool.ack()
+        assert spool.peek() is None
+
+    def test_batches_survive_reopening(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_size=4096)
+        spool.append('admin_dev1', [InsertOne({'attr': 'a'})])
+        spool.append('admin_dev2', [InsertOne({'attr': 'b'})])
+        spool.ack()
+        spool.close()
+        reopened = Spool(str(tmp_path), segment_size=4096)
+        assert reopened.peek()[0] == 'admin_dev2'
+        reopened.append('admin_dev3', [InsertOne({'attr': 'c'})])
+        reopened.ack()
+        assert reopened.peek()[0] == 'admin_dev3'
+
+    def test_full_segment_rolls_over_and_is_removed_once_replayed(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_size=256)
+        for index in range(5):
+            spool.append('admin_dev', [InsertOne({'attr': 'a' * 50, 'index': index})])
+        assert len(os.listdir(str(tmp_path))) > 1
+        replayed = []
+        while spool.peek() is not None:
+            replayed.append(spool.peek()[1][0]._doc['index'])
+            spool.ack()
+        assert replayed == [0, 1, 2, 3, 4]
+        assert len(os.listdir(str(tmp_path))) <= 1
+
+
+class TestReplayer:
+
+    def test_replay_one_writes_and_acks(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_size=4096)
+        spool.append('admin_dev', [InsertOne({'attr': 'a'})])
+        db = MagicMock()
+        replayer = Replayer(spool, db, rate=100)
+        assert replayer.replay_one()
+        db['admin_dev'].bulk_write.assert_called_once_with([InsertOne({'attr': 'a'})], ordered=False)
+        assert not replayer.replay_one()
+
+    def test_replay_one_keeps_batch_while_mongo_is_down(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_size=4096)
+        spool.append('admin_dev', [InsertOne({'attr': 'a'})])
+        db = MagicMock()
+        db['admin_dev'].bulk_write.side_effect = AutoReconnect('down')
+        replayer = Replayer(spool, db, rate=100)
+        with pytest.raises(AutoReconnect):
+            replayer.replay_one()
+        assert spool.peek() is not None
+
+    def test_replay_one_drops_rejected_batch(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_size=4096)
+        spool.append('admin_dev', [InsertOne({'attr': 'a'})])
+        db = MagicMock()
+        db['admin_dev'].bulk_write.side_effect = BulkWriteError({'writeErrors': [{'code': 11000}]})
+        replayer = Replayer(spool, db, rate=100)
+        assert replayer.replay_one()
+        assert spool.peek() is None
+
+    def test_replay_one_discards_batch_failing_after_max_attempts(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_size=4096)
+        spool.append('admin_dev1', [InsertOne({'attr': 'a'})])
+        spool.append('admin_dev2', [InsertOne({'attr': 'b'})])
+        db = MagicMock()
+        db['admin_dev1'].bulk_write.side_effect = OperationFailure('failed')
+        replayer = Replayer(spool, db, rate=100, max_attempts=3)
+        for _ in range(2):
+            with pytest.raises(OperationFailure):
+                replayer.replay_one()
+            assert spool.peek()[0] == 'admin_dev1'
+        assert replayer.replay_one()
+        assert spool.peek()[0] == 'admin_dev2'
+        assert replayer.failures == 0
+
+    def test_replay_one_does_not_count_connection_failures(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_size=4096)
+        spool.append('admin_dev', [InsertOne({'attr': 'a'})])
+        db = MagicMock()
+        db['admin_dev'].bulk_write.side_effect = AutoReconnect('down')
+        replayer = Replayer(spool, db, rate=100, max_attempts=1)
+        with pytest.raises(AutoReconnect):
+            replayer.replay_one()
+        assert spool.peek() is not None
+
+
+class TestWriteBufferSpooling:
+
+    def test_unreachable_mongo_spools_batch(self):
+        db = MagicMock()
+        db['admin_dev'].bulk_write.side_effect = AutoReconnect('down')
+        spool = MagicMock()
+        buffer = WriteBuffer(db, batch_size=1, flush_interval=60, spool=spool)
+        buffer.add('admin_dev', [{'attr': 'a'}])
+        spool.append.assert_called_once_with('admin_dev', [InsertOne({'attr': 'a'})])
+
+    def test_other_failures_are_not_spooled(self):
+        db = MagicMock()
+        db['admin_dev'].bulk_write.side_effect = BulkWriteError({'writeErrors': []})
+        spool = MagicMock()
+        buffer = WriteBuffer(db, batch_size=1, flush_interval=60, spool=spool)
+        buffer.add('admin_dev', [{'attr': 'a'}])
+        assert not spool.append.called
@@ -1,6 +1,8 @@
+import datetime
 import pytest
 import falcon
 import json
+import pymongo
 from unittest.mock import patch, Mock, MagicMock
 from history.api.models import STHHistory, DeviceHistory
 
@@ -13,7 +15,7 @@ class TestSTHH:
         response = falcon.Response()
         request = MagicMock()
         request.context.return_value= None
-        mock_pymongo_find.find.return_value = {
+        mock_pymongo_find.find.return_value.__iter__.return_value = {
             "id":0,
             "attrs":[{
                 "value":"plim",
@@ -29,3 +31,33 @@ class TestSTHH:
 
         STHHistory.on_get(request,response,'test_device','test_id','blim')
         assert response.status == falcon.HTTP_200
+
+    @patch('history.api.models.conf.api_stream_responses', True)
+    @patch('history.api.models.HistoryUtil.get_collection')
+    def test_on_get__should_stream_values_oldest_first__when_there_is_no_limit(self, mock_get_collection):
+        collection = mock_get_collection.return_value
+        collection.find.return_value.__iter__.return_value = iter([
+            {"value": "plom", "ts": datetime.datetime(2019, 9, 5, 16, 30, 21)},
+            {"value": "plim", "ts": datetime.datetime(2019, 9, 5, 17, 30, 21)}])
+        request = MagicMock()
+        request.params = {}
+        response = falcon.Response()
+        STHHistory.on_get(request, response, 'test_device', 'test_id', 'blim')
+        body = json.loads(b''.join(response.stream))
+        values = body["contextResponses"][0]["contextElement"]["attributes"][0]["values"]
+        assert [v["attrValue"] for v in values] == ["plom", "plim"]
+        assert collection.find.call_args[1]['sort'] == [('ts', pymongo.ASCENDING)]
+
+    @patch('history.api.models.HistoryUtil.get_collection')
+    def test_on_get__should_read_values__when_fields_leave_them_out(self, mock_get_collection):
+        collection = mock_get_collection.return_value
+        collection.find.return_value.__iter__.return_value = iter([
+            {"value": "plim", "ts": datetime.datetime(2019, 9, 5, 17, 30, 21)}])
+        request = MagicMock()
+        request.params = {'fields': 'ts', 'lastN': '1'}
+        response = falcon.Response()
+        STHHistory.on_get(request, response, 'test_device', 'test_id', 'blim')
+        assert collection.find.call_args[0][1]['value'] is True
+        body = json.loads(response.body)
+        values = body["contextResponses"][0]["contextElement"]["attributes"][0]["values"]
+        assert values == [{"attrType": "test_device", "attrValue": "plim", "recvTime": "2019-09-05T17:30:21Z"}]
@@ -1,6 +1,7 @@
 from dojot.module.config import Config
 import pytest
 import json
+from datetime import datetime
 import pymongo
 import unittest
 from unittest.mock import Mock, MagicMock, patch, call
@@ -55,17 +56,32 @@ class TestPersister:
         })
         p = Persister()
         p.handle_event_devices('admin', message)
-        assert mock_create_indexes.called
+        p.index_manager.wait()
+        mock_create_indexes.assert_called_once_with('admin_e51k')
 
-    @patch.object(Persister, 'handle_event_data')
-    @patch.object(Persister, 'parse_message', return_value='message')
-    def test_handle_event_devices_configure(self, mock_event_data, mock_parse_message):
+    @patch.object(Persister, 'create_indexes')
+    def test_handle_event_devices_update_known_collection(self, mock_create_indexes):
+        message = json.dumps({
+            "event": "update",
+            "data": {"id": "e51k"},
+            "meta": {"service": "admin"}
+        })
+        p = Persister()
+        p.handle_event_devices('admin', message)
+        p.index_manager.wait()
+        p.handle_event_devices('admin', message)
+        p.index_manager.wait()
+        assert mock_create_indexes.call_count == 1
+
+    @patch.object(Persister, 'ingest_event_data')
+    @patch.object(Persister, 'parse_message', return_value={'attrs': {}})
+    def test_handle_event_devices_configure(self, mock_parse_message, mock_ingest_event_data):
         message = json.dumps({
             "event": "configure"
         })
         p = Persister()
         p.handle_event_devices('admin', message)
-        assert mock_event_data.called
+        mock_ingest_event_data.assert_called_once_with('admin', {'attrs': {}})
 
     # Testing handle_event_data
     def test_handle_event_data_invalid_json(self):
@@ -74,24 +90,28 @@ class TestPersister:
         assert p.handle_event_data('admin', message) is None
 
     def test_handle_event_data_no_data(self):
-        message = json.dumps({"data": None})
-        assert Persister.handle_event_data(self, 'admin', message) is None
+        data = {"data": None}
+        assert Persister.ingest_event_data(self, 'admin', data) is None
 
     def test_handle_event_data_no_device_id(self):
-        message = json.dumps(
-            {"attrs": {"foo": "bar"}, "metadata": {"deviceid": None}})
-        assert Persister.handle_event_data(self, 'admin', message) is None
+        data = {"attrs": {"foo": "bar"}, "metadata": {"deviceid": None}}
+        assert Persister.ingest_event_data(self, 'admin', data) is None
 
     def test_handle_event_data_no_attrs(self):
-        message = json.dumps(
-            {"metadata": {"deviceid": "labtemp"}})
-        assert Persister.handle_event_data(self, 'admin', message) is None
+        data = {"metadata": {"deviceid": "labtemp"}}
+        assert Persister.ingest_event_data(self, 'admin', data) is None
 
     def test_handle_event_data_no_timestamp(self):
         with pytest.raises(AttributeError):
-            message = json.dumps(
-                {"attrs": {"foo": "bar"}, "metadata": {"deviceid": "labtemp"}})
-            Persister.handle_event_data(self, 'admin', message)
+            data = {"attrs": {"foo": "bar"}, "metadata": {"deviceid": "labtemp"}}
+            Persister.ingest_event_data(self, 'admin', data)
+
+    @patch.object(Persister, 'ingest_event_data')
+    def test_handle_event_data_ingests_parsed_event(self, mock_ingest_event_data):
+        data = {"attrs": {"foo": "bar"}, "metadata": {"deviceid": "labtemp"}}
+        p = Persister()
+        p.handle_event_data('admin', json.dumps(data))
+        mock_ingest_event_data.assert_called_once_with('admin', data)
 
     def test_handle_event_data_attrs_no_dict(self):
         message = json.dumps({
@@ -109,6 +129,100 @@ class TestPersister:
         p = Persister()
         p.handle_event_data('admin', message)
 
+    def test_handle_event_data_buffered(self):
+        message = json.dumps({
+            "attrs": {"foo": "bar", "baz": 1},
+            "metadata": {"deviceid": "labtemp", "timestamp": 1567704621, "tenant": "admin"}
+        })
+        p = Persister()
+        p.write_buffer = MagicMock()
+        p.handle_event_data('admin', message)
+        collection_name, docs, event_time = p.write_buffer.add.call_args[0]
+        assert collection_name == 'admin_labtemp'
+        assert [doc['attr'] for doc in docs] == ['foo', 'baz']
+        assert event_time == datetime(2019, 9, 5, 17, 30, 21)
+
+    @patch('history.subscriber.persister.buckets.is_enabled', return_value=True)
+    def test_handle_event_data_bucketed(self, mock_is_enabled):
+        message = json.dumps({
+            "attrs": {"foo": "bar", "baz": 1},
+            "metadata": {"deviceid": "labtemp", "timestamp": 1567704621, "tenant": "admin"}
+        })
+        p = Persister()
+        p.write_buffer = MagicMock()
+        p.handle_event_data('admin', message)
+        collection_name, operations, event_time = p.write_buffer.add_operations.call_args_list[0][0]
+        assert collection_name == 'admin_labtemp'
+        assert [op._filter['attr'] for op in operations] == ['foo', 'baz']
+        assert all(op._upsert for op in operations)
+
+    def test_handle_event_data_updates_latest_values(self):
+        message = json.dumps({
+            "attrs": {"foo": "bar", "baz": 1, "blank": " "},
+            "metadata": {"deviceid": "labtemp", "timestamp": 1567704621, "tenant": "admin"}
+        })
+        p = Persister()
+        p.write_buffer = MagicMock()
+        p.index_manager = MagicMock()
+        p.handle_event_data('admin', message)
+        collection_name, operations, event_time = p.write_buffer.add_operations.call_args[0]
+        assert collection_name == 'latest'
+        assert operations[0]._filter == {'tenant': 'admin', 'device_id': 'labtemp'}
+        ts = datetime(2019, 9, 5, 17, 30, 21)
+        assert operations[0]._doc == {'$max': {
+            'attrs.foo': {'ts': ts, 'value': 'bar', 'metadata': {}},
+            'attrs.baz': {'ts': ts, 'value': 1, 'metadata': {}}}}
+        p.index_manager.ensure.assert_any_call('latest')
+
+    def test_handle_event_data_ensures_device_collection_indexes(self):
+        message = json.dumps({
+            "attrs": {"foo": "bar"},
+            "metadata": {"deviceid": "labtemp", "timestamp": 1567704621, "tenant": "admin"}
+        })
+        p = Persister()
+        p.write_buffer = MagicMock()
+        p.index_manager = MagicMock()
+        p.handle_event_data('admin', message)
+        p.index_manager.ensure.assert_any_call('admin_labtemp')
+
+    def test_handle_event_data_records_catalog(self):
+        message = json.dumps({
+            "attrs": {"foo": "bar", "baz": 1},
+            "metadata": {"deviceid": "labtemp", "timestamp": 1567704621, "tenant": "admin"}
+        })
+        p = Persister()
+        p.write_buffer = MagicMock()
+        p.catalog = MagicMock()
+        p.handle_event_data('admin', message)
+        tenant, device_id, attrs, ts = p.catalog.record.call_args[0]
+        assert (tenant, device_id, list(attrs)) == ('admin', 'labtemp', ['foo', 'baz'])
+        assert ts == datetime(2019, 9, 5, 17, 30, 21)
+
+    def test_handle_notification_buffered(self):
+        p = Persister()
+        p.notification_buffer = MagicMock()
+        message = json.dumps(
+            {"timestamp": 1567704621, "metaAttrsFilter": {"shouldPersist": True}})
+        p.handle_notification('admin', message)
+        collection_name, docs, event_time = p.notification_buffer.add.call_args[0]
+        assert collection_name == 'admin_notifications'
+        assert len(docs) == 1
+
+    def test_handle_event_data_counts_parse_failures(self):
+        from history.subscriber import metrics
+        failures = metrics.PARSE_FAILURES.get(handler='device_data')
+        p = Persister()
+        p.handle_event_data('admin', 'not json')
+        assert metrics.PARSE_FAILURES.get(handler='device_data') == failures + 1
+
+    def test_shutdown_flushes_write_buffer(self):
+        p = Persister()
+        p.write_buffer = MagicMock()
+        p.notification_buffer = MagicMock()
+        p.shutdown()
+        assert p.write_buffer.close.called
+        assert p.notification_buffer.close.called
+
     # Testing parse_datetime
 
     def test_parse_datetime_error(self):
@@ -126,10 +240,10 @@ class TestPersister:
                     }},
             "meta": {"timestamp": 1567704621, "service": "admin"}
         })
-        expected_data = json.dumps({
+        expected_data = {
             "attrs": {"foo": "bar"},
             "metadata":
-            {"timestamp": 1567704621, "deviceid": "testid", "tenant": "admin"}})
+            {"timestamp": 1567704621, "deviceid": "testid", "tenant": "admin"}}
         assert Persister.parse_message(self, data) == expected_data
 
     # Testing creating_index_for_tenant
@@ -138,13 +252,15 @@ class TestPersister:
     def test_create_index_for_tenant(self, mock_create_indexes):
         p = Persister()
         p.create_index_for_tenant('admin')
-        assert mock_create_indexes.called
+        p.index_manager.wait()
+        mock_create_indexes.assert_called_once_with('admin_notifications')
 
     @patch.object(Persister, 'create_indexes')
     def test_create_index_for_notifications(self, mock_create_index):
         p = Persister()
-        p.create_indexes_for_notifications('admin')
-        assert mock_create_index.called
+        p.create_indexes_for_notifications(['admin', 'other'])
+        mock_create_index.assert_any_call('admin_notifications')
+        mock_create_index.assert_any_call('other_notifications')
 
     @patch.object(Persister, 'create_indexes')
     def test_init_mongodb(self, mock_create_indexes):
@@ -152,15 +268,40 @@ class TestPersister:
         p.init_mongodb('admin_notifications')
         assert mock_create_indexes.called
 
+    @patch.object(Persister, 'create_unique_indexes')
     @patch.object(pymongo.collection.Collection, 'create_index')
-    def test_init_mongodb_create_index(self, mock_create_index):
+    def test_init_mongodb_create_index(self, mock_create_index, mock_create_unique_indexes):
         p = Persister()
         p.init_mongodb('admin_notifications')
         assert mock_create_index.call_count == 3
 
+    @patch.object(pymongo.collection.Collection, 'create_index')
+    def test_init_mongodb_creates_unique_indexes_before_writing(self, mock_create_index):
+        p = Persister()
+        p.init_mongodb()
+        unique = [args[0] for args, kwargs in mock_create_index.call_args_list if kwargs.get('unique')]
+        assert unique == [[('tenant', 1), ('device_id', 1)],
+                          [('tenant', 1), ('device_id', 1), ('attr', 1)]]
+        assert p.index_manager.known == {'latest', 'catalog'}
+        p.shutdown()
+
+    @patch.object(Persister, 'create_unique_indexes')
+    @patch('history.subscriber.persister.Spool', side_effect=PermissionError('read-only'))
+    @patch('history.subscriber.persister.conf.persister_spool_dir', '/spool')
+    def test_init_mongodb_runs_without_spool__when_it_cannot_be_opened(self, mock_spool,
+        mock_create_unique_indexes):
+        p = Persister()
+        p.init_mongodb()
+        assert p.spool is None
+        assert p.replayer is None
+        assert p.write_buffer is not None
+        assert p.notification_buffer is not None
+        p.shutdown()
+
+    @patch.object(Persister, 'create_unique_indexes')
     @patch.object(pymongo.collection.Collection, 'create_index')
     @patch.object(pymongo.database.Database, 'command')
-    def test_enable_collection_sharding(self, mock_command, mock_create_index):
+    def test_enable_collection_sharding(self, mock_command, mock_create_index, mock_create_unique_indexes):
         p = Persister()
         p.init_mongodb()
         p.enable_collection_sharding('admin_notifications')
@@ -278,6 +419,34 @@ def test_persist_only_notifications(mock_messenger, mock_config, create_indexes)
     assert mock_messenger().on.call_count == 2
 
 
+@patch.object(Config, 'load_defaults')
+@patch('history.subscriber.persister.Messenger')
+def test_persist_all_events_through_pipeline(mock_messenger, mock_config):
+
+    from history.subscriber.persister import start_dojot_messenger
+    from history.subscriber.pipeline import Pipeline
+
+    p = Persister()
+    pipeline = Pipeline()
+
+    mock_config.dojot = {
+        "subjects": {
+            "tenancy": "dojot.tenancy",
+            "devices": "dojot.device-manager.device",
+            "device_data": "device-data"
+        }
+    }
+
+    start_dojot_messenger(mock_config, p, False, pipeline)
+
+    assert set(pipeline.stages) == {"tenancy", "notifications", "devices", "device_data"}
+    mock_messenger().on.assert_any_call("dojot.notifications", "message",
+                                        pipeline.stages["notifications"].put)
+    mock_messenger().on.assert_any_call(mock_config.dojot['subjects']['device_data'],
+                                        "message", pipeline.stages["device_data"].put)
+    pipeline.stop()
+
+
 def test_str2_bool_return_true():
     from history.subscriber.persister import str2_bool
 
@@ -302,7 +471,9 @@ def test_str2_bool_return_false():
 @patch('history.subscriber.persister.start_dojot_messenger')
 @patch('history.subscriber.persister.falcon.API')
 @patch('history.subscriber.persister.simple_server')
-def test_persister_main(mock_simple_server, mock_falcon_api, mock_start_dojot_messenger, mock_create_indexes_for_notifications,
+@patch('history.subscriber.persister.Pipeline')
+@patch('history.subscriber.persister.signal')
+def test_persister_main(mock_signal, mock_pipeline, mock_simple_server, mock_falcon_api, mock_start_dojot_messenger, mock_create_indexes_for_notifications,
                         mock_init_mongodb, mock_get_tenants):
     from history.subscriber.persister import main
     main()
@@ -312,3 +483,4 @@ def test_persister_main(mock_simple_server, mock_falcon_api, mock_start_dojot_me
     assert mock_start_dojot_messenger.called
     assert mock_falcon_api.called
     assert mock_simple_server.make_server.called
+    assert mock_pipeline().stop.called
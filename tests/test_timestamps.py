@@ -0,0 +1,52 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from history.subscriber import timestamps
+
+
+class TestTimestamps:
+
+    def test_normalize_epoch_seconds(self):
+        assert timestamps.normalize(1567704621) == datetime(2019, 9, 5, 17, 30, 21)
+
+    def test_normalize_epoch_milliseconds(self):
+        assert timestamps.normalize(1567704621500) == datetime(2019, 9, 5, 17, 30, 21, 500000)
+
+    def test_normalize_epoch_float_seconds(self):
+        assert timestamps.normalize(1567704621.25) == datetime(2019, 9, 5, 17, 30, 21, 250000)
+
+    def test_normalize_none_is_now(self):
+        before = datetime.utcnow()
+        assert before <= timestamps.normalize(None) <= datetime.utcnow()
+
+    def test_normalize_rfc3339_utc(self):
+        assert timestamps.normalize('2021-08-03T20:38:13.389Z') == \
+            datetime(2021, 8, 3, 20, 38, 13, 389000, tzinfo=timezone.utc)
+
+    def test_normalize_rfc3339_offset(self):
+        assert timestamps.normalize('2021-08-03T20:38:13-03:00') == \
+            datetime(2021, 8, 3, 20, 38, 13, tzinfo=timezone(timedelta(hours=-3)))
+
+    def test_normalize_rfc3339_nanoseconds_are_truncated(self):
+        assert timestamps.normalize('2021-08-03T20:38:13.123456789Z') == \
+            datetime(2021, 8, 3, 20, 38, 13, 123456, tzinfo=timezone.utc)
+
+    @patch('history.subscriber.timestamps.parse')
+    def test_normalize_rfc3339_skips_dateutil(self, mock_parse):
+        timestamps.normalize('2021-08-03T20:38:13Z')
+        assert not mock_parse.called
+
+    def test_normalize_falls_back_to_dateutil(self):
+        assert timestamps.normalize('Aug 3 2021 20:38:13') == datetime(2021, 8, 3, 20, 38, 13)
+
+    def test_normalize_invalid_string(self):
+        with pytest.raises(TypeError):
+            timestamps.normalize('not a date')
+
+    def test_normalize_invalid_rfc3339_date(self):
+        with pytest.raises(TypeError):
+            timestamps.normalize('2021-13-03T20:38:13Z')
+
+    def test_normalize_invalid_type(self):
+        with pytest.raises(TypeError):
+            timestamps.normalize({'ts': 1})
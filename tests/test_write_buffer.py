@@ -0,0 +1,83 @@
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+from pymongo import InsertOne, UpdateOne
+from history.subscriber.write_buffer import WriteBuffer
+
+
+class TestWriteBuffer:
+
+    def test_add_below_batch_size_does_not_write(self):
+        db = MagicMock()
+        buffer = WriteBuffer(db, batch_size=3, flush_interval=60)
+        buffer.add('admin_dev', [{'attr': 'a'}, {'attr': 'b'}])
+        assert not db['admin_dev'].bulk_write.called
+
+    def test_add_reaching_batch_size_writes_unordered(self):
+        db = MagicMock()
+        buffer = WriteBuffer(db, batch_size=2, flush_interval=60)
+        buffer.add('admin_dev', [{'attr': 'a'}])
+        buffer.add('admin_dev', [{'attr': 'b'}])
+        db['admin_dev'].bulk_write.assert_called_once_with(
+            [InsertOne({'attr': 'a'}), InsertOne({'attr': 'b'})], ordered=False)
+        assert buffer.pending == {}
+
+    def test_batches_are_grouped_by_collection(self):
+        db = MagicMock()
+        buffer = WriteBuffer(db, batch_size=10, flush_interval=60)
+        buffer.add('admin_dev1', [{'attr': 'a'}])
+        buffer.add('admin_dev2', [{'attr': 'b'}, {'attr': 'c'}])
+        assert len(buffer.pending['admin_dev1']) == 1
+        assert len(buffer.pending['admin_dev2']) == 2
+
+    def test_add_operations_keeps_given_operations(self):
+        db = MagicMock()
+        buffer = WriteBuffer(db, batch_size=1, flush_interval=60)
+        operation = UpdateOne({'attr': 'a'}, {'$inc': {'count': 1}}, upsert=True)
+        buffer.add_operations('admin_dev', [operation])
+        db['admin_dev'].bulk_write.assert_called_once_with([operation], ordered=False)
+
+    def test_flusher_writes_aged_batches(self):
+        db = MagicMock()
+        buffer = WriteBuffer(db, batch_size=100, flush_interval=0.05)
+        buffer.start()
+        buffer.add('admin_dev', [{'attr': 'a'}])
+        time.sleep(0.2)
+        buffer.close()
+        db['admin_dev'].bulk_write.assert_called_once()
+
+    def test_close_flushes_pending(self):
+        db = MagicMock()
+        buffer = WriteBuffer(db, batch_size=100, flush_interval=60)
+        buffer.add('admin_dev', [{'attr': 'a'}])
+        buffer.add('admin_notifications', [{'subject': 'b'}])
+        buffer.close()
+        assert db['admin_dev'].bulk_write.called
+        assert db['admin_notifications'].bulk_write.called
+        assert buffer.pending == {}
+
+    def test_write_failure_is_not_raised(self):
+        db = MagicMock()
+        db['admin_dev'].bulk_write.side_effect = Exception('mongo down')
+        buffer = WriteBuffer(db, batch_size=1, flush_interval=60)
+        buffer.add('admin_dev', [{'attr': 'a'}])
+
+    def test_writer_pool_writes_batches(self):
+        db = MagicMock()
+        buffer = WriteBuffer(db, batch_size=1, flush_interval=60, writers=2)
+        buffer.start()
+        buffer.add('admin_dev1', [{'attr': 'a'}])
+        buffer.add('admin_dev2', [{'attr': 'b'}])
+        buffer.close()
+        assert db['admin_dev1'].bulk_write.called
+        assert db['admin_dev2'].bulk_write.called
+
+    def test_bulk_write_records_metrics(self):
+        from history.subscriber import metrics
+        db = MagicMock()
+        buffer = WriteBuffer(db, batch_size=2, flush_interval=60, name='metrics-test')
+        buffer.add('admin_dev', [{'attr': 'a'}], datetime.utcnow())
+        buffer.add('admin_dev', [{'attr': 'b'}], datetime.utcnow() - timedelta(seconds=5))
+        assert metrics.BATCH_SIZE.count(writer='metrics-test') == 1
+        assert metrics.WRITE_LATENCY.count(writer='metrics-test') == 1
+        assert metrics.LAG.count(writer='metrics-test') == 1